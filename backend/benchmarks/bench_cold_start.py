@@ -0,0 +1,169 @@
+"""
+Cold-start profiler: per-module import time and time to first request
+
+Starts a fresh interpreter under ``python -X importtime`` that imports
+``server``, runs the lifespan startup and serves one request in-process,
+as a new worker does after a scale-out. Reports the time from spawning
+the process to the first response, split into phases, and the slowest
+imports. Run from the backend directory:
+
+    STORAGE_ENGINE=embedded python -m benchmarks.bench_cold_start --runs 5
+"""
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Written to stderr around the measured window, so imports made by the
+# profiler itself are left out
+START_MARKER = "-- cold start --"
+END_MARKER = "-- first response --"
+
+
+def parse_importtime(text: str) -> List[Tuple[str, int, int, int]]:
+    """(module, self us, cumulative us, nesting depth) per ``-X importtime`` line"""
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+async def _serve_first_request(app, path: str) -> Tuple[float, float, int]:
+    """Lifespan startup, one GET and shutdown, driven the way an ASGI server does"""
+    import asyncio
+
+    lifespan_in: asyncio.Queue = asyncio.Queue()
+    lifespan_out: asyncio.Queue = asyncio.Queue()
+    lifespan = asyncio.create_task(
+        app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, lifespan_in.get, lifespan_out.put)
+    )
+    await lifespan_in.put({"type": "lifespan.startup"})
+    message = await lifespan_out.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(f"Startup failed: {message.get('message')}")
+    ready = time.time()
+
+    status = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+        "state": {},
+    }
+    await app(scope, receive, send)
+    responded = time.time()
+
+    await lifespan_in.put({"type": "lifespan.shutdown"})
+    await lifespan_out.get()
+    await lifespan
+    return ready, responded, status
+
+
+def _child(path: str) -> None:
+    """Entry point of the profiled interpreter; prints its timestamps as JSON"""
+    import asyncio
+
+    sys.stderr.write(START_MARKER + "\n")
+    sys.stderr.flush()
+    started = time.time()
+    import server
+
+    imported = time.time()
+    ready, responded, status = asyncio.run(_serve_first_request(server.app, path))
+    sys.stderr.write(END_MARKER + "\n")
+    sys.stderr.flush()
+    print(json.dumps({
+        "started": started, "imported": imported, "ready": ready, "responded": responded, "status": status,
+    }))
+
+
+def measure_cold_start(path: str = "/api/health/live", env: Optional[Dict[str, str]] = None, runs: int = 1) -> Dict[str, Any]:
+    """Profile ``runs`` fresh processes and return the fastest one
+
+    Times are in milliseconds; ``modules`` lists every module imported
+    while starting up and serving the request, in ``parse_importtime`` form.
+    """
+    import subprocess
+
+    child_env = {**os.environ, **(env or {})}
+    code = f"from benchmarks.bench_cold_start import _child; _child({path!r})"
+    best = None
+    for _ in range(runs):
+        launched = time.time()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=BACKEND_DIR, env=child_env, capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"Cold start failed:\n{completed.stderr[-2000:]}")
+        marks = json.loads(completed.stdout.strip().splitlines()[-1])
+        window = completed.stderr.split(START_MARKER, 1)[1].split(END_MARKER, 1)[0]
+        result = {
+            "status": marks["status"],
+            "time_to_first_request_ms": (marks["responded"] - launched) * 1000,
+            "interpreter_ms": (marks["started"] - launched) * 1000,
+            "import_ms": (marks["imported"] - marks["started"]) * 1000,
+            "startup_ms": (marks["ready"] - marks["imported"]) * 1000,
+            "request_ms": (marks["responded"] - marks["ready"]) * 1000,
+            "modules": parse_importtime(window),
+        }
+        if best is None or result["time_to_first_request_ms"] < best["time_to_first_request_ms"]:
+            best = result
+    return best
+
+
+def format_report(result: Dict[str, Any], top: int = 15) -> str:
+    lines = [f"time to first request {result['time_to_first_request_ms']:9.1f} ms (status {result['status']})"]
+    for phase in ("interpreter", "import", "startup", "request"):
+        lines.append(f"  {phase:<19} {result[phase + '_ms']:9.1f} ms")
+
+    modules = result["modules"]
+    lines.append(f"\n{'top-level imports':<40} {'cumulative ms':>13}")
+    roots = sorted((m for m in modules if m[3] == 0), key=lambda m: m[2], reverse=True)
+    for name, _, cumulative_us, _ in roots[:top]:
+        lines.append(f"{name:<40} {cumulative_us / 1000:>13.1f}")
+
+    lines.append(f"\n{'slowest modules':<40} {'self ms':>13} {'cumulative ms':>13}")
+    for name, self_us, cumulative_us, _ in sorted(modules, key=lambda m: m[1], reverse=True)[:top]:
+        lines.append(f"{name:<40} {self_us / 1000:>13.1f} {cumulative_us / 1000:>13.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--path", default="/api/health/live", help="path of the first request")
+    parser.add_argument("--runs", type=int, default=3, help="processes to start; the fastest is reported")
+    parser.add_argument("--top", type=int, default=15, help="modules to list")
+    args = parser.parse_args()
+    print(format_report(measure_cold_start(args.path, runs=args.runs), args.top))
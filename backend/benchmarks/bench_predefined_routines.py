@@ -0,0 +1,92 @@
+"""
+Micro-benchmark for GET /api/predefined-routines
+
+Compares the previous implementation (models returned through
+``response_model`` validation and JSON encoding on every call) with the
+pre-serialized catalog. Run from the backend directory:
+
+    python -m benchmarks.bench_predefined_routines --routines 1000
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from typing import List
+
+import httpx
+from fastapi import FastAPI, Response
+
+from models.habit_stack import PredefinedRoutine
+from services.routines import load_routine_catalog
+
+
+def build_catalog_file(count: int, habits_per_routine: int) -> str:
+    routines = [
+        {
+            "id": f"routine-{i}",
+            "name": f"Routine {i}",
+            "description": f"Synthetic routine number {i}",
+            "habits": [
+                {"id": f"habit-{i}-{j}", "name": f"Habit {j}", "order": j}
+                for j in range(habits_per_routine)
+            ],
+        }
+        for i in range(count)
+    ]
+    handle = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    with handle:
+        json.dump(routines, handle)
+    return handle.name
+
+
+def build_app(path: str) -> FastAPI:
+    catalog = load_routine_catalog(path)
+    app = FastAPI()
+
+    @app.get("/before", response_model=List[PredefinedRoutine])
+    async def before():
+        return catalog.routines
+
+    @app.get("/after", response_model=List[PredefinedRoutine])
+    async def after():
+        return Response(content=catalog.body, media_type="application/json")
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, url: str, duration: float) -> float:
+    requests = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        response = await client.get(url)
+        response.raise_for_status()
+        requests += 1
+    return requests / (time.perf_counter() - start)
+
+
+async def main(args):
+    app = build_app(build_catalog_file(args.routines, args.habits))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        before = await client.get("/before")
+        after = await client.get("/after")
+        assert before.json() == after.json(), "payloads differ"
+
+        results = {}
+        for name in ("before", "after"):
+            results[name] = await measure(client, f"/{name}", args.duration)
+
+    print(f"{args.routines} routines x {args.habits} habits ({len(after.content)} bytes)")
+    for name, rps in results.items():
+        print(f"  {name:>6}: {rps:10.1f} req/s")
+    print(f"  speedup: {results['after'] / results['before']:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--routines", type=int, default=1000)
+    parser.add_argument("--habits", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=3.0)
+    asyncio.run(main(parser.parse_args()))
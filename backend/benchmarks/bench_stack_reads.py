@@ -0,0 +1,77 @@
+"""
+Benchmark for GET /api/habit-stacks/{id} with and without FAST_READS
+
+Serves a stack of 10, 100 and 1000 habits from the embedded storage
+engine through the real router, so only handler and serialization cost
+is measured. Run from the backend directory:
+
+    python -m benchmarks.bench_stack_reads --requests 2000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+import httpx
+from fastapi import FastAPI
+
+import routes.habit_stacks as habit_stacks
+from storage.embedded import EmbeddedStackStore
+
+
+def build_stack(habit_count: int) -> dict:
+    now = datetime.utcnow()
+    return {
+        "id": "bench-stack",
+        "name": f"Stack with {habit_count} habits",
+        "habits": [
+            {"id": f"habit-{i}", "name": f"Habit number {i}", "order": i}
+            for i in range(habit_count)
+        ],
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def percentile(samples, pct):
+    return statistics.quantiles(samples, n=100)[pct - 1]
+
+
+async def run(client: httpx.AsyncClient, requests: int):
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get("/api/habit-stacks/bench-stack")
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    cpu = (time.process_time() - cpu_start) / requests
+    return percentile(latencies, 50), percentile(latencies, 99), cpu
+
+
+async def main(args):
+    # Measure the database read path, not the stack cache
+    habit_stacks.stack_cache.max_size = 0
+    app = FastAPI()
+    app.include_router(habit_stacks.router, prefix="/api")
+    transport = httpx.ASGITransport(app=app)
+
+    print(f"{'habits':>6} {'mode':>6} {'p50 ms':>8} {'p99 ms':>8} {'cpu ms/req':>11}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for habit_count in (10, 100, 1000):
+            store = EmbeddedStackStore()
+            await store.insert_stacks([build_stack(habit_count)])
+            habit_stacks.initialize_store(store)
+            for mode, fast in (("model", False), ("fast", True)):
+                habit_stacks.FAST_READS = fast
+                await run(client, min(args.requests, 50))  # warm up
+                p50, p99, cpu = await run(client, args.requests)
+                print(f"{habit_count:>6} {mode:>6} {p50 * 1000:8.3f} {p99 * 1000:8.3f} {cpu * 1000:11.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
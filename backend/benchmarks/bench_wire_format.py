@@ -0,0 +1,74 @@
+"""
+Benchmark of response size and encode cost for each negotiated wire format
+
+Encodes lists of 100 and 10,000 stack documents (as read from storage,
+with datetime fields) to JSON and MessagePack, with and without gzip,
+and reports bytes on the wire and CPU time per encode. Run from the
+backend directory:
+
+    python -m benchmarks.bench_wire_format --habits 5
+"""
+
+import argparse
+import gzip
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from services.serialization import GZIP_LEVEL, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPES, encode
+from services.ranking import assign_ranks
+
+FORMATS = (
+    ("json", JSON_MEDIA_TYPE, False),
+    ("json+gzip", JSON_MEDIA_TYPE, True),
+    ("msgpack", MSGPACK_MEDIA_TYPES[0], False),
+    ("msgpack+gzip", MSGPACK_MEDIA_TYPES[0], True),
+)
+
+
+def build_stacks(count: int, habit_count: int) -> list:
+    now = datetime.utcnow()
+    stacks = []
+    for i in range(count):
+        habits = [
+            {"id": str(uuid.uuid4()), "name": f"Habit {j} of stack {i}", "description": None, "order": j}
+            for j in range(habit_count)
+        ]
+        stacks.append({
+            "id": str(uuid.uuid4()),
+            "name": f"Morning routine {i}",
+            "description": "Start the day with small wins",
+            "habits": assign_ranks(habits),
+            "created_at": now - timedelta(days=i),
+            "updated_at": now,
+        })
+    return stacks
+
+
+def measure(stacks: list, media_type: str, compress: bool, repeat: int):
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        body = encode(stacks, media_type)
+        if compress:
+            body = gzip.compress(body, GZIP_LEVEL, mtime=0)
+    return len(body), (time.process_time() - cpu_start) / repeat
+
+
+def main(args):
+    print(f"{'stacks':>7} {'format':>13} {'bytes':>11} {'vs json':>8} {'cpu ms':>9}")
+    for count in (100, 10_000):
+        stacks = build_stacks(count, args.habits)
+        repeat = max(1, args.repeat * 100 // count)
+        baseline = None
+        for name, media_type, compress in FORMATS:
+            measure(stacks, media_type, compress, 1)  # warm up
+            size, cpu = measure(stacks, media_type, compress, repeat)
+            baseline = baseline or size
+            print(f"{count:>7} {name:>13} {size:>11} {size / baseline:>7.1%} {cpu * 1000:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--habits", type=int, default=5, help="habits per stack")
+    parser.add_argument("--repeat", type=int, default=200, help="encodes of the 100-stack list")
+    main(parser.parse_args())
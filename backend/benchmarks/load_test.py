@@ -0,0 +1,201 @@
+"""
+Concurrent load test for the Habit Stack Builder API
+
+Drives the API with a configurable number of concurrent clients and a
+mixed workload, then reports requests/sec and p50/p95/p99 latency per
+route. By default the app runs in-process on the embedded storage engine;
+``--mongo-url`` runs it against a real mongod and ``--base-url`` targets
+an already running server.
+
+Run from the backend directory:
+
+    python -m benchmarks.load_test --workload mixed --concurrency 32 --duration 10
+    python -m benchmarks.load_test --workload hot-append --output hot.json --compare baseline.json
+
+Workloads:
+    mixed       95% reads (single stack / first page), 5% stack updates
+    hot-append  every client appends habits to the same stack, with 10% reads
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies[route].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[route] += 1
+        return response
+
+    def summary(self, elapsed):
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            cuts = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors[route],
+                "rps": round(len(samples) / elapsed, 1),
+                "p50_ms": round(cuts[49] * 1000, 3),
+                "p95_ms": round(cuts[94] * 1000, 3),
+                "p99_ms": round(cuts[98] * 1000, 3),
+            }
+        total = sum(len(samples) for samples in self.latencies.values())
+        return {"total_requests": total, "total_rps": round(total / elapsed, 1), "routes": routes}
+
+
+async def seed(client, count):
+    stacks = [
+        {"name": f"Load test stack {i}", "habits": [{"name": f"Habit {j}", "order": j} for j in range(5)]}
+        for i in range(count)
+    ]
+    response = await client.post("/api/habit-stacks:batch", json=stacks)
+    response.raise_for_status()
+    return [item["id"] for item in response.json()["results"]]
+
+
+async def mixed_client(client, recorder, stack_ids, deadline, read_ratio):
+    while time.perf_counter() < deadline:
+        stack_id = random.choice(stack_ids)
+        if random.random() < read_ratio:
+            if random.random() < 0.8:
+                await recorder.call(client, "GET /habit-stacks/{id}", "GET", f"/api/habit-stacks/{stack_id}")
+            else:
+                await recorder.call(client, "GET /habit-stacks", "GET", "/api/habit-stacks", params={"limit": 20})
+        else:
+            await recorder.call(
+                client, "PUT /habit-stacks/{id}", "PUT", f"/api/habit-stacks/{stack_id}",
+                json={"name": f"Renamed {random.randint(0, 1_000_000)}"}
+            )
+
+
+async def hot_append_client(client, recorder, stack_ids, deadline, read_ratio):
+    hot_stack = stack_ids[0]
+    while time.perf_counter() < deadline:
+        if random.random() < read_ratio:
+            await recorder.call(client, "GET /habit-stacks/{id}", "GET", f"/api/habit-stacks/{hot_stack}")
+        else:
+            await recorder.call(
+                client, "POST /habit-stacks/{id}/habits", "POST", f"/api/habit-stacks/{hot_stack}/habits",
+                json={"name": "Appended habit"}
+            )
+
+
+WORKLOADS = {
+    "mixed": (mixed_client, 0.95),
+    "hot-append": (hot_append_client, 0.10),
+}
+
+
+async def build_client(args):
+    if args.base_url:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        return httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30)
+
+    import server
+    from routes.habit_stacks import initialize_store
+    from storage.embedded import EmbeddedStackStore
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from storage.mongo import MotorStackStore
+
+        database = AsyncIOMotorClient(args.mongo_url)[args.db_name]
+        await database.habit_stacks.drop()
+        store = MotorStackStore(database)
+    else:
+        store = EmbeddedStackStore()
+    await store.initialize()
+    initialize_store(store)
+    transport = httpx.ASGITransport(app=server.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30)
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path}:")
+    for route, stats in current["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            print(f"  {route}: no baseline")
+            continue
+        rps_change = (stats["rps"] - before["rps"]) / before["rps"] * 100 if before["rps"] else 0.0
+        p99_change = (stats["p99_ms"] - before["p99_ms"]) / before["p99_ms"] * 100 if before["p99_ms"] else 0.0
+        print(f"  {route}: rps {rps_change:+.1f}%, p99 {p99_change:+.1f}%")
+
+
+async def main(args):
+    random.seed(args.seed)
+    client_factory, default_read_ratio = WORKLOADS[args.workload]
+    read_ratio = args.read_ratio if args.read_ratio is not None else default_read_ratio
+
+    async with await build_client(args) as client:
+        stack_ids = await seed(client, args.stacks)
+        recorder = Recorder()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            client_factory(client, recorder, stack_ids, deadline, read_ratio)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    result = {
+        "workload": args.workload,
+        "concurrency": args.concurrency,
+        "read_ratio": read_ratio,
+        "duration_seconds": round(elapsed, 3),
+        "target": args.base_url or ("mongo" if args.mongo_url else "embedded"),
+        "python": platform.python_version(),
+        "timestamp": datetime.utcnow().isoformat(),
+        **recorder.summary(elapsed),
+    }
+
+    print(f"{args.workload}: {result['total_requests']} requests, {result['total_rps']} req/s")
+    print(f"{'route':<32} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, stats in result["routes"].items():
+        print(f"{route:<32} {stats['rps']:>9} {stats['p50_ms']:>8} {stats['p95_ms']:>8} "
+              f"{stats['p99_ms']:>8} {stats['errors']:>7}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--stacks", type=int, default=200, help="number of stacks to seed")
+    parser.add_argument("--read-ratio", type=float, help="override the workload's read share")
+    parser.add_argument("--base-url", help="target a running server instead of the in-process app")
+    parser.add_argument("--mongo-url", help="run in-process against this mongod instead of in memory")
+    parser.add_argument("--db-name", default=os.environ.get("LOAD_TEST_DB_NAME", "habit_stack_load_test"))
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,12 +1,14 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import datetime
+from typing import Dict, List, Optional
+from datetime import date, datetime
 import uuid
 
 class Habit(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     order: int = 0
+    # Lexicographic position within the stack; see services.ranking
+    rank: Optional[str] = None
 
 class HabitCreate(BaseModel):
     name: str
@@ -14,10 +16,18 @@ class HabitCreate(BaseModel):
 
 class HabitUpdate(BaseModel):
     name: Optional[str] = None
+    # Position follows rank; kept so that requests setting it are rejected
+    # instead of silently ignored
     order: Optional[int] = None
 
+class HabitMove(BaseModel):
+    before: Optional[str] = None
+    after: Optional[str] = None
+
 class HabitStack(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    # Owner; set from the request's credentials, never from the body
+    user_id: Optional[str] = None
     name: str
     habits: List[Habit] = []
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -35,4 +45,74 @@ class PredefinedRoutine(BaseModel):
     id: str
     name: str
     description: str
-    habits: List[Habit]
\ No newline at end of file
+    habits: List[Habit]
+
+class HabitStackBatchUpdate(HabitStackUpdate):
+    id: str
+
+class BatchItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+class BatchResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+class ImportResult(BaseModel):
+    accepted: int
+    rejected: int
+    errors: List[ImportLineError]
+    errors_truncated: bool = False
+    duration_seconds: float
+    rows_per_second: float
+
+class CheckInCreate(BaseModel):
+    # Defaults to today (UTC)
+    day: Optional[date] = None
+
+class StreakSummary(BaseModel):
+    completions: int = 0
+    current_streak: int = 0
+    longest_streak: int = 0
+    last_day: Optional[date] = None
+
+class HabitStreak(StreakSummary):
+    habit_id: str
+
+class StackStreaks(StreakSummary):
+    stack_id: str
+    habits: List[HabitStreak] = []
+
+class CheckInResult(BaseModel):
+    day: date
+    recorded: bool
+    habit: HabitStreak
+    stack: StreakSummary
+
+class CheckInHistory(BaseModel):
+    habit_id: str
+    start: date
+    end: date
+    days: List[date]
+
+class StackAnalytics(BaseModel):
+    stack_id: str
+    start: date
+    end: date
+    habit_ids: List[str]
+    completion_rate: float
+    habit_rates: List[float]
+    # Monday first
+    weekday_rates: List[Optional[float]]
+    # Keyed by window length in days, one value per day from start
+    rolling_rates: Dict[str, List[Optional[float]]]
+    # Habits done per day, from start
+    heatmap: List[int]
+    consecutive_correlations: List[Optional[float]]
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
-from motor.motor_asyncio import AsyncIOMotorClient
-from datetime import datetime
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, Body, Header
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from datetime import date, datetime, timedelta
+import asyncio
+import logging
 import os
+import zlib
 
 from models.habit_stack import (
     HabitStack, 
@@ -10,215 +13,899 @@ from models.habit_stack import (
     HabitStackUpdate, 
     PredefinedRoutine,
     Habit,
-    HabitCreate
+    HabitCreate,
+    HabitUpdate,
+    HabitMove,
+    HabitStackBatchUpdate,
+    BatchItemResult,
+    BatchResult,
+    ImportResult,
+    CheckInCreate,
+    CheckInHistory,
+    CheckInResult,
+    HabitStreak,
+    StackStreaks,
+    StreakSummary,
+    StackAnalytics
 )
+from services.auth import current_user
+from services.cache import StackCache
+from services.coalescer import WriteCoalescer
+from services.etags import (
+    etag_matches,
+    make_etag,
+    not_modified,
+    stack_etag,
+)
+from services.export import gzip_stream, ndjson_batches
+from services.importer import NDJSONImporter, gunzip_stream
+from services.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    decode_habit_cursor,
+    decode_search_cursor,
+    encode_cursor,
+    encode_habit_cursor,
+    encode_search_cursor,
+    parse_fields,
+)
+from services.ranking import (
+    MAX_RANK_LENGTH,
+    ahead_of_clock,
+    assign_ranks,
+    observe_rank,
+    order_habits,
+    plan_move,
+    rank_between,
+    slot_ranks,
+)
+from services.routines import DEFAULT_CATALOG_PATH, load_routine_catalog
+from services.search import DEFAULT_SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE
+from services.serialization import PreencodedResponse, json_response
+from services.streaks import as_of
+from storage.base import HabitOp, StackStore
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Database will be initialized by the main server
-db = None
-
-def initialize_db(database):
-    global db
-    db = database
-
-# Predefined routines data
-PREDEFINED_ROUTINES = [
-    PredefinedRoutine(
-        id="morning-routine",
-        name="Morning Routine",
-        description="Start your day with purpose",
-        habits=[
-            Habit(id="wake-up", name="Wake up at 6 AM", order=0),
-            Habit(id="drink-water", name="Drink a glass of water", order=1),
-            Habit(id="brush-teeth", name="Brush teeth", order=2)
-        ]
-    ),
-    PredefinedRoutine(
-        id="workout-routine",
-        name="Workout Routine",
-        description="Build physical strength",
-        habits=[
-            Habit(id="warm-up", name="Warm up for 5 minutes", order=0),
-            Habit(id="cardio", name="Cardio for 20 minutes", order=1),
-            Habit(id="strength", name="Strength training", order=2)
-        ]
-    ),
-    PredefinedRoutine(
-        id="evening-routine",
-        name="Evening Routine",
-        description="Wind down and prepare for tomorrow",
-        habits=[
-            Habit(id="dinner", name="Eat dinner", order=0),
-            Habit(id="plan-tomorrow", name="Plan tomorrow", order=1),
-            Habit(id="read", name="Read for 30 minutes", order=2)
-        ]
-    ),
-    PredefinedRoutine(
-        id="study-routine",
-        name="Study Routine",
-        description="Focus on learning and growth",
-        habits=[
-            Habit(id="review-notes", name="Review previous notes", order=0),
-            Habit(id="new-material", name="Study new material", order=1),
-            Habit(id="practice", name="Practice problems", order=2)
-        ]
-    )
-]
+# Storage engine will be initialized by the main server
+store: StackStore = None
+
+# Optional group commit for habit pushes and pulls; 0 disables it
+WRITE_COALESCE_WINDOW_MS = float(os.environ.get('WRITE_COALESCE_WINDOW_MS', '0'))
+habit_writes: Optional[WriteCoalescer] = None
+
+def initialize_store(stack_store):
+    global store, habit_writes
+    store = stack_store
+    habit_writes = None
+    if WRITE_COALESCE_WINDOW_MS > 0:
+        habit_writes = WriteCoalescer(store.apply_habit_ops, WRITE_COALESCE_WINDOW_MS / 1000)
+
+async def _push_habit(user_id, stack_id, habit, updated_at):
+    if habit_writes:
+        return await habit_writes.submit(HabitOp("push", user_id, stack_id, updated_at, habit=habit))
+    return await store.push_habit(user_id, stack_id, habit, updated_at)
+
+async def _pull_habit(user_id, stack_id, habit_id, updated_at):
+    if habit_writes:
+        return await habit_writes.submit(HabitOp("pull", user_id, stack_id, updated_at, habit_id=habit_id))
+    return await store.pull_habit(user_id, stack_id, habit_id, updated_at)
+
+# Seconds clients are asked to wait when storage is overloaded
+OVERLOAD_RETRY_AFTER = os.environ.get('OVERLOAD_RETRY_AFTER', '1')
+
+def _server_error(message, e):
+    """503 with Retry-After when storage is overloaded or unreachable, 500 otherwise"""
+    if store.is_overloaded(e):
+        logger.warning(f"{message}: storage overloaded: {e}")
+        return HTTPException(
+            status_code=503,
+            detail=f"{message}: storage temporarily unavailable",
+            headers={"Retry-After": OVERLOAD_RETRY_AFTER}
+        )
+    return HTTPException(status_code=500, detail=f"{message}: {str(e)}")
+
+# Read endpoints encode documents straight from MongoDB, skipping the
+# HabitStack round trip and response_model validation
+FAST_READS = os.environ.get('FAST_READS', 'true').lower() in ('1', 'true', 'yes')
+
+# Read-through cache for single stacks; STACK_CACHE_SIZE=0 disables it
+stack_cache = StackCache(
+    max_size=int(os.environ.get('STACK_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('STACK_CACHE_TTL', '300')),
+    max_staleness=float(os.environ.get('STACK_CACHE_MAX_STALENESS', '1.0'))
+)
+
+async def _fetch_updated_at(user_id, stack_id):
+    doc = await store.get_stack(user_id, stack_id, ["updated_at"])
+    return doc["updated_at"] if doc else None
+
+async def _record_change(user_id, *stack_ids):
+    """Invalidate cached stacks and bump the user's version used for listing ETags"""
+    for stack_id in stack_ids:
+        stack_cache.invalidate(user_id, stack_id)
+    await store.bump_version(user_id)
+
+# Batch endpoints split their writes into chunks of this many documents
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', '500'))
+MAX_BATCH_ITEMS = int(os.environ.get('MAX_BATCH_ITEMS', '10000'))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+IMPORT_MAX_IN_FLIGHT = int(os.environ.get('IMPORT_MAX_IN_FLIGHT', '4'))
+IMPORT_MAX_LINE_BYTES = int(os.environ.get('IMPORT_MAX_LINE_BYTES', '1048576'))
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+def _batch_result(results):
+    succeeded = sum(1 for r in results if r.error is None)
+    return BatchResult(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+# Error of the items in chunks after a failed one, which are not attempted
+BATCH_SKIPPED_ERROR = "Not attempted after an earlier chunk failed"
+
+def _chunk_error(message, e):
+    """Log a chunk's storage error and describe it for each item of the chunk
+
+    A chunk that raised may still be partly written.
+    """
+    if store.is_overloaded(e):
+        logger.warning(f"{message}: storage overloaded: {e}")
+        return f"{message}: storage temporarily unavailable; the chunk may be partly written"
+    logger.exception(message)
+    return f"{message}: {e}; the chunk may be partly written"
+
+def _chunk_items(offset, ids, status, error):
+    return [
+        BatchItemResult(index=offset + i, id=item_id, status=status, error=error)
+        for i, item_id in enumerate(ids)
+    ]
+
+def _check_batch_size(items):
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(items)} items (max {MAX_BATCH_ITEMS})"
+        )
+
+# Moves are optimistic; give up after this many concurrent modifications
+MOVE_RETRIES = int(os.environ.get('MOVE_RETRIES', '3'))
+
+# Rebalances run after the response; keep references so they aren't collected
+_background_tasks = set()
+
+async def _rebalance_ranks(user_id, stack_id):
+    """Respace a stack's ranks once repeated moves have made them long"""
+    try:
+        doc = await store.get_stack(user_id, stack_id)
+        if not doc:
+            return
+        habits = assign_ranks(order_habits(doc)["habits"])
+        updated_doc = await store.update_stack(
+            user_id,
+            stack_id,
+            {"habits": habits, "updated_at": datetime.utcnow()},
+            expected_updated_at=doc["updated_at"]
+        )
+        # On a conflict the next long move schedules another attempt
+        if updated_doc:
+            await _record_change(user_id, stack_id)
+    except Exception:
+        logger.exception(f"Rebalancing habit ranks of stack {stack_id} failed")
+
+async def _keep_appended_last(user_id, doc, habit_id):
+    """Move an appended habit after any rank issued by a clock ahead of this worker's
+
+    Returns the stack as written. Habits appended concurrently, with ranks
+    from this worker or from clocks behind it, keep their order.
+    """
+    for _ in range(MOVE_RETRIES):
+        habits = order_habits(doc)["habits"]
+        if not any(habit["id"] == habit_id for habit in habits):
+            return doc
+        last = habits[-1]
+        if last["id"] == habit_id or not ahead_of_clock(last["rank"]):
+            return doc
+        observe_rank(last["rank"])
+        updated_doc = await store.update_habit(
+            user_id,
+            doc["id"],
+            habit_id,
+            {"rank": rank_between(last["rank"], None)},
+            datetime.utcnow(),
+            expected_updated_at=doc["updated_at"]
+        )
+        if updated_doc:
+            return updated_doc
+        doc = await store.get_stack(user_id, doc["id"])
+        if not doc:
+            return None
+    return doc
+
+def _schedule_rebalance(user_id, stack_id):
+    task = asyncio.create_task(_rebalance_ranks(user_id, stack_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _ordered(docs):
+    async for doc in docs:
+        yield order_habits(doc)
+
+# Check-in history requests may span at most this many days
+MAX_HISTORY_DAYS = int(os.environ.get('MAX_HISTORY_DAYS', '366'))
+MAX_ANALYTICS_DAYS = int(os.environ.get('MAX_ANALYTICS_DAYS', '3660'))
+
+async def _require_habit(user_id, stack_id, habit_id):
+    found = await store.has_habit(user_id, stack_id, habit_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Habit stack not found")
+    if not found:
+        raise HTTPException(status_code=404, detail="Habit not found in stack")
+
+# Predefined routines are validated and serialized once at import
+ROUTINE_CATALOG = load_routine_catalog(
+    os.environ.get('PREDEFINED_ROUTINES_FILE', DEFAULT_CATALOG_PATH)
+)
+PREDEFINED_ROUTINES = ROUTINE_CATALOG.routines
+
+# The catalog only changes on deploy, so clients may cache it for a day
+ROUTINES_CACHE_CONTROL = "public, max-age=86400"
 
 @router.get("/predefined-routines", response_model=List[PredefinedRoutine])
-async def get_predefined_routines():
+async def get_predefined_routines(if_none_match: Optional[str] = Header(None)):
     """Get all predefined routines"""
-    return PREDEFINED_ROUTINES
+    headers = {"ETag": ROUTINE_CATALOG.etag, "Cache-Control": ROUTINES_CACHE_CONTROL}
+    if etag_matches(if_none_match, ROUTINE_CATALOG.etag):
+        return Response(status_code=304, headers=headers)
+    return PreencodedResponse(ROUTINE_CATALOG.bodies, headers=headers)
 
 @router.get("/habit-stacks", response_model=List[HabitStack])
-async def get_habit_stacks():
-    """Get all saved habit stacks"""
+async def get_habit_stacks(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(current_user),
+):
+    """Get a page of the user's habit stacks, newest first
+
+    The cursor for the next page is returned in the ``X-Next-Cursor`` header.
+    ``fields`` restricts each item to a comma separated list of fields.
+    """
     try:
-        cursor = db.habit_stacks.find()
-        habit_stacks = []
-        async for doc in cursor:
-            # Convert MongoDB ObjectId to string and ensure proper format
-            doc['_id'] = str(doc['_id'])
-            habit_stack = HabitStack(**doc)
-            habit_stacks.append(habit_stack)
-        return habit_stacks
+        requested_fields = parse_fields(fields)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        # The page only changes when the user's stacks do, so answer 304s
+        # from their version counter before running the listing query
+        version = await store.get_version(user_id)
+        etag = make_etag(version, user_id, limit, cursor, fields)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        # Fetch one extra document to know whether another page exists
+        docs = await store.list_stacks(user_id, limit + 1, after=after, fields=requested_fields)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching habit stacks: {str(e)}")
+        raise _server_error("Error fetching habit stacks", e)
+
+    headers = {"ETag": etag}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    docs = [order_habits(doc) for doc in docs]
+
+    if requested_fields is not None:
+        items = [{field: doc.get(field) for field in requested_fields} for doc in docs]
+        return json_response(items, headers=headers)
+
+    if FAST_READS:
+        return json_response(docs, headers=headers)
+
+    response.headers.update(headers)
+    return [HabitStack(**doc) for doc in docs]
 
 @router.post("/habit-stacks", response_model=HabitStack)
-async def create_habit_stack(habit_stack_data: HabitStackCreate):
+async def create_habit_stack(habit_stack_data: HabitStackCreate, user_id: str = Depends(current_user)):
     """Create a new habit stack"""
     try:
         # Create the habit stack object
         habit_stack = HabitStack(
+            user_id=user_id,
             name=habit_stack_data.name,
-            habits=[Habit(**habit.dict()) for habit in habit_stack_data.habits]
+            habits=[Habit(**habit) for habit in assign_ranks([h.dict() for h in habit_stack_data.habits])]
         )
         
         # Insert into database
-        result = await db.habit_stacks.insert_one(habit_stack.dict())
+        errors = await store.insert_stacks([habit_stack.dict()])
         
-        if result.inserted_id:
-            return habit_stack
+        if not errors:
+            await _record_change(user_id)
+            return HabitStack(**order_habits(habit_stack.dict()))
         else:
-            raise HTTPException(status_code=500, detail="Failed to create habit stack")
+            raise HTTPException(status_code=500, detail=f"Failed to create habit stack: {errors[0]}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error creating habit stack", e)
+
+@router.post("/habit-stacks:batch", response_model=BatchResult)
+async def create_habit_stacks_batch(
+    stacks_data: List[HabitStackCreate],
+    chunk_size: int = Query(BATCH_CHUNK_SIZE, ge=1, le=MAX_BATCH_ITEMS),
+    user_id: str = Depends(current_user)
+):
+    """Create many habit stacks, writing one chunk per storage call
+
+    If a chunk fails, its items are reported as failed and later chunks as
+    skipped; the items of earlier chunks keep their results and ids.
+    """
+    _check_batch_size(stacks_data)
+    results = []
+    written = False
+    error = None
+    try:
+        try:
+            for offset, chunk in _chunks(stacks_data, chunk_size):
+                if error:
+                    results += _chunk_items(offset, [None] * len(chunk), "skipped", BATCH_SKIPPED_ERROR)
+                    continue
+                docs = [
+                    HabitStack(
+                        user_id=user_id,
+                        name=data.name,
+                        habits=[Habit(**habit) for habit in assign_ranks([h.dict() for h in data.habits])]
+                    ).dict()
+                    for data in chunk
+                ]
+                # Set first: a chunk that fails may still be partly written
+                written = True
+                try:
+                    failed = await store.insert_stacks(docs)
+                except Exception as e:
+                    error = _chunk_error("Error creating habit stacks", e)
+                    results += _chunk_items(offset, [doc["id"] for doc in docs], "failed", error)
+                    continue
+                for i, doc in enumerate(docs):
+                    error = failed.get(i)
+                    results.append(BatchItemResult(
+                        index=offset + i,
+                        id=doc["id"],
+                        status="failed" if error else "created",
+                        error=error
+                    ))
+        finally:
+            # Chunks written before a failure change the listing too
+            if written:
+                await _record_change(user_id)
+        return _batch_result(results)
+    except Exception as e:
+        raise _server_error("Error creating habit stacks", e)
+
+@router.patch("/habit-stacks:batch", response_model=BatchResult)
+async def update_habit_stacks_batch(
+    updates: List[HabitStackBatchUpdate],
+    chunk_size: int = Query(BATCH_CHUNK_SIZE, ge=1, le=MAX_BATCH_ITEMS),
+    user_id: str = Depends(current_user)
+):
+    """Update many habit stacks, writing one chunk per storage call
+
+    Chunk failures are reported per item as for the batch create.
+    """
+    _check_batch_size(updates)
+    results = []
+    written = []
+    error = None
+    try:
+        try:
+            for offset, chunk in _chunks(updates, chunk_size):
+                ids = [update.id for update in chunk]
+                if error:
+                    results += _chunk_items(offset, ids, "skipped", BATCH_SKIPPED_ERROR)
+                    continue
+                now = datetime.utcnow()
+                changes = []
+                for update in chunk:
+                    update_dict = {"updated_at": now}
+                    if update.name is not None:
+                        update_dict["name"] = update.name
+                    if update.habits is not None:
+                        # The list order is authoritative, so re-rank to match it
+                        update_dict["habits"] = assign_ranks([habit.dict() for habit in update.habits])
+                    changes.append((update.id, update_dict))
+
+                # Recorded first: a chunk that fails may still be partly written
+                written += ids
+                try:
+                    failed = await store.update_stacks(user_id, changes)
+                except Exception as e:
+                    error = _chunk_error("Error updating habit stacks", e)
+                    results += _chunk_items(offset, ids, "failed", error)
+                    continue
+                for i, update in enumerate(chunk):
+                    error = failed.get(update.id)
+                    results.append(BatchItemResult(
+                        index=offset + i,
+                        id=update.id,
+                        status="failed" if error else "updated",
+                        error=error
+                    ))
+        finally:
+            # Chunks written before a failure change the listing too
+            if written:
+                await _record_change(user_id, *written)
+        return _batch_result(results)
+    except Exception as e:
+        raise _server_error("Error updating habit stacks", e)
+
+@router.delete("/habit-stacks:batch", response_model=BatchResult)
+async def delete_habit_stacks_batch(
+    stack_ids: List[str] = Body(...),
+    chunk_size: int = Query(BATCH_CHUNK_SIZE, ge=1, le=MAX_BATCH_ITEMS),
+    user_id: str = Depends(current_user)
+):
+    """Delete many habit stacks by id
+
+    Chunk failures are reported per item as for the batch create.
+    """
+    _check_batch_size(stack_ids)
+    results = []
+    written = []
+    error = None
+    try:
+        try:
+            for offset, chunk in _chunks(stack_ids, chunk_size):
+                if error:
+                    results += _chunk_items(offset, chunk, "skipped", BATCH_SKIPPED_ERROR)
+                    continue
+                # Recorded first: a chunk that fails may still be partly written
+                written += chunk
+                try:
+                    existing = await store.delete_stacks(user_id, chunk)
+                except Exception as e:
+                    error = _chunk_error("Error deleting habit stacks", e)
+                    results += _chunk_items(offset, chunk, "failed", error)
+                    continue
+                for i, stack_id in enumerate(chunk):
+                    found = stack_id in existing
+                    results.append(BatchItemResult(
+                        index=offset + i,
+                        id=stack_id,
+                        status="deleted" if found else "failed",
+                        error=None if found else "Habit stack not found"
+                    ))
+        finally:
+            # Chunks written before a failure change the listing too
+            if written:
+                await _record_change(user_id, *written)
+        return _batch_result(results)
+    except Exception as e:
+        raise _server_error("Error deleting habit stacks", e)
+
+@router.get("/habit-stacks/export")
+async def export_habit_stacks(
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=10000),
+    compress: bool = False,
+    user_id: str = Depends(current_user)
+):
+    """Stream every habit stack of the user as NDJSON, optionally gzip-compressed
+
+    Documents are encoded and sent one cursor batch at a time, so memory use
+    does not grow with the size of the collection.
+    """
+    body = ndjson_batches(_ordered(store.iter_stacks(user_id, batch_size)), batch_size)
+    if compress:
+        return StreamingResponse(
+            gzip_stream(body),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="habit-stacks.ndjson.gz"'}
+        )
+    return StreamingResponse(
+        body,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="habit-stacks.ndjson"'}
+    )
+
+@router.post("/habit-stacks/import", response_model=ImportResult)
+async def import_habit_stacks(
+    request: Request,
+    batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=10000),
+    max_in_flight: int = Query(IMPORT_MAX_IN_FLIGHT, ge=1, le=64),
+    user_id: str = Depends(current_user)
+):
+    """Import habit stacks from an NDJSON body of HabitStackCreate objects
+
+    The body is parsed as it arrives (gzip bodies are accepted with
+    ``Content-Encoding: gzip``) and written in batches.
+    """
+    chunks = request.stream()
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        chunks = gunzip_stream(chunks)
+    importer = NDJSONImporter(
+        store, user_id, batch_size=batch_size, max_in_flight=max_in_flight, max_line_bytes=IMPORT_MAX_LINE_BYTES
+    )
+    try:
+        result = await importer.run(chunks)
+    except zlib.error as e:
+        # Rows before the corrupt chunk were already written
+        if importer.accepted:
+            await _record_change(user_id)
+        raise HTTPException(status_code=400, detail=f"Invalid gzip body: {str(e)}")
+    if result.accepted:
+        await _record_change(user_id)
+    return result
+
+@router.get("/habit-stacks/search")
+async def search_habit_stacks(
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(DEFAULT_SEARCH_PAGE_SIZE, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(current_user),
+):
+    """Search the user's stack and habit names, best matches first
+
+    Each hit has ``id``, ``score`` and either ``fields`` or ``id``, ``name``
+    and ``updated_at``. The next page's cursor is in ``X-Next-Cursor``.
+    """
+    try:
+        requested_fields = parse_fields(fields)
+        after = decode_search_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        version = await store.get_version(user_id)
+        etag = make_etag(version, user_id, "search", q, limit, cursor, fields)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        hits = await store.search_stacks(user_id, q, limit + 1, after=after, fields=requested_fields)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating habit stack: {str(e)}")
+        raise _server_error("Error searching habit stacks", e)
+
+    headers = {"ETag": etag}
+    if len(hits) > limit:
+        hits = hits[:limit]
+        headers["X-Next-Cursor"] = encode_search_cursor(hits[-1])
+    return json_response([order_habits(hit) for hit in hits], headers=headers)
 
 @router.get("/habit-stacks/{stack_id}", response_model=HabitStack)
-async def get_habit_stack(stack_id: str):
+async def get_habit_stack(
+    stack_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    user_id: str = Depends(current_user)
+):
     """Get a specific habit stack by ID"""
     try:
-        doc = await db.habit_stacks.find_one({"id": stack_id})
-        if doc:
-            doc['_id'] = str(doc['_id'])
-            return HabitStack(**doc)
-        else:
-            raise HTTPException(status_code=404, detail="Habit stack not found")
+        doc = await stack_cache.get(user_id, stack_id, _fetch_updated_at)
+        if doc is None:
+            if if_none_match:
+                # Decide on a 304 from the version fields alone
+                version = await store.get_stack(user_id, stack_id, ["id", "updated_at"])
+                if not version:
+                    raise HTTPException(status_code=404, detail="Habit stack not found")
+                etag = stack_etag(version["id"], version["updated_at"])
+                if etag_matches(if_none_match, etag):
+                    return not_modified(etag)
+
+            doc = await store.get_stack(user_id, stack_id)
+            if not doc:
+                raise HTTPException(status_code=404, detail="Habit stack not found")
+            doc = order_habits(doc)
+            stack_cache.put(user_id, doc)
+
+        etag = stack_etag(doc["id"], doc["updated_at"])
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        if FAST_READS:
+            return json_response(doc, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        return HabitStack(**doc)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error fetching habit stack", e)
+
+@router.get("/habit-stacks/{stack_id}/habits", response_model=List[Habit])
+async def get_stack_habits(
+    stack_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(current_user),
+):
+    """Get a page of a stack's habits in stack order
+
+    Lets clients read stacks too large to fetch whole; pair it with
+    ``fields`` on the stack endpoints to skip ``habits`` there. ``order`` is
+    the habit's position in the stack and the next page's cursor is in the
+    ``X-Next-Cursor`` header.
+    """
+    try:
+        after, position = decode_habit_cursor(cursor) if cursor else (None, 0)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        # Fetch one extra habit to know whether another page exists
+        habits = await store.list_habits(user_id, stack_id, limit + 1, after=after)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching habit stack: {str(e)}")
+        raise _server_error("Error fetching habits", e)
+    if habits is None:
+        raise HTTPException(status_code=404, detail="Habit stack not found")
+
+    headers = {}
+    if len(habits) > limit:
+        habits = habits[:limit]
+        headers["X-Next-Cursor"] = encode_habit_cursor(habits[-1], position + limit)
+    habits = [{**habit, "order": position + i} for i, habit in enumerate(habits)]
+    return json_response(habits, headers=headers)
 
 @router.put("/habit-stacks/{stack_id}", response_model=HabitStack)
-async def update_habit_stack(stack_id: str, update_data: HabitStackUpdate):
+async def update_habit_stack(stack_id: str, update_data: HabitStackUpdate, user_id: str = Depends(current_user)):
     """Update an existing habit stack"""
     try:
-        # Find the existing stack
-        existing_stack = await db.habit_stacks.find_one({"id": stack_id})
-        if not existing_stack:
-            raise HTTPException(status_code=404, detail="Habit stack not found")
-        
         # Prepare update data
         update_dict = {}
         if update_data.name is not None:
             update_dict["name"] = update_data.name
         if update_data.habits is not None:
-            update_dict["habits"] = [habit.dict() for habit in update_data.habits]
+            # The list order is authoritative, so re-rank to match it
+            update_dict["habits"] = assign_ranks([habit.dict() for habit in update_data.habits])
         
         update_dict["updated_at"] = datetime.utcnow()
         
-        # Update in database
-        result = await db.habit_stacks.update_one(
-            {"id": stack_id},
-            {"$set": update_dict}
-        )
-        
-        if result.modified_count > 0:
-            # Return updated stack
-            updated_doc = await db.habit_stacks.find_one({"id": stack_id})
-            updated_doc['_id'] = str(updated_doc['_id'])
-            return HabitStack(**updated_doc)
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update habit stack")
+        # Update and fetch the result in a single atomic round trip
+        updated_doc = await store.update_stack(user_id, stack_id, update_dict)
+        if not updated_doc:
+            raise HTTPException(status_code=404, detail="Habit stack not found")
+        await _record_change(user_id, stack_id)
+        updated_doc = order_habits(updated_doc)
+        stack_cache.put(user_id, updated_doc)
+        return HabitStack(**updated_doc)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating habit stack: {str(e)}")
+        raise _server_error("Error updating habit stack", e)
 
 @router.delete("/habit-stacks/{stack_id}")
-async def delete_habit_stack(stack_id: str):
+async def delete_habit_stack(stack_id: str, user_id: str = Depends(current_user)):
     """Delete a habit stack"""
     try:
-        result = await db.habit_stacks.delete_one({"id": stack_id})
-        if result.deleted_count > 0:
+        if await store.delete_stacks(user_id, [stack_id]):
+            await _record_change(user_id, stack_id)
             return {"message": "Habit stack deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Habit stack not found")
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting habit stack: {str(e)}")
+        raise _server_error("Error deleting habit stack", e)
 
 @router.post("/habit-stacks/{stack_id}/habits", response_model=HabitStack)
-async def add_habit_to_stack(stack_id: str, habit_data: HabitCreate):
+async def add_habit_to_stack(stack_id: str, habit_data: HabitCreate, user_id: str = Depends(current_user)):
     """Add a new habit to an existing stack"""
     try:
-        # Find the existing stack
-        existing_stack = await db.habit_stacks.find_one({"id": stack_id})
-        if not existing_stack:
-            raise HTTPException(status_code=404, detail="Habit stack not found")
-        
-        # Create new habit
-        new_habit = Habit(**habit_data.dict())
-        
-        # Add to existing habits
-        existing_habits = existing_stack.get("habits", [])
-        existing_habits.append(new_habit.dict())
+        # Slot ranks sort after every existing rank, so no read is needed
+        # unless the stack turns out to hold ranks from a clock ahead of ours
+        new_habit = Habit(**habit_data.dict(), rank=slot_ranks(1)[0])
         
-        # Update in database
-        result = await db.habit_stacks.update_one(
-            {"id": stack_id},
-            {"$set": {"habits": existing_habits, "updated_at": datetime.utcnow()}}
+        updated_doc = await _push_habit(user_id, stack_id, new_habit.dict(), datetime.utcnow())
+        if updated_doc:
+            updated_doc = await _keep_appended_last(user_id, updated_doc, new_habit.id)
+        if not updated_doc:
+            raise HTTPException(status_code=404, detail="Habit stack not found")
+        await _record_change(user_id, stack_id)
+        updated_doc = order_habits(updated_doc)
+        stack_cache.put(user_id, updated_doc)
+        return HabitStack(**updated_doc)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error adding habit to stack", e)
+
+@router.put("/habit-stacks/{stack_id}/habits/{habit_id}", response_model=HabitStack)
+async def update_habit_in_stack(
+    stack_id: str, habit_id: str, habit_data: HabitUpdate, user_id: str = Depends(current_user)
+):
+    """Update a single habit in a stack
+
+    A habit's position follows its rank; use the move endpoint to change it.
+    """
+    if habit_data.order is not None:
+        raise HTTPException(
+            status_code=400,
+            detail="order cannot be set; move the habit with POST /habit-stacks/{stack_id}/habits/{habit_id}/move"
         )
-        
-        if result.modified_count > 0:
-            # Return updated stack
-            updated_doc = await db.habit_stacks.find_one({"id": stack_id})
-            updated_doc['_id'] = str(updated_doc['_id'])
-            return HabitStack(**updated_doc)
+    try:
+        updated_doc = await store.update_habit(
+            user_id, stack_id, habit_id, habit_data.dict(exclude_none=True), datetime.utcnow()
+        )
+        if not updated_doc:
+            raise HTTPException(status_code=404, detail="Habit stack or habit not found")
+        await _record_change(user_id, stack_id)
+        updated_doc = order_habits(updated_doc)
+        stack_cache.put(user_id, updated_doc)
+        return HabitStack(**updated_doc)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error updating habit in stack", e)
+
+@router.post("/habit-stacks/{stack_id}/habits/{habit_id}/move", response_model=HabitStack)
+async def move_habit_in_stack(stack_id: str, habit_id: str, move: HabitMove, user_id: str = Depends(current_user)):
+    """Move a habit right before or after another one
+
+    Only the moved habit's rank is rewritten. The write is conditional on the
+    stack being unchanged since it was read, and retried on a conflict.
+    """
+    if (move.before is None) == (move.after is None):
+        raise HTTPException(status_code=400, detail="Specify exactly one of before or after")
+    if habit_id in (move.before, move.after):
+        raise HTTPException(status_code=400, detail="A habit cannot be moved relative to itself")
+    try:
+        for _ in range(MOVE_RETRIES):
+            doc = await store.get_stack(user_id, stack_id)
+            if not doc:
+                raise HTTPException(status_code=404, detail="Habit stack not found")
+            try:
+                rank, habits = plan_move(doc["habits"], habit_id, before=move.before, after=move.after)
+            except KeyError as e:
+                raise HTTPException(status_code=404, detail=f"Habit not found in stack: {e.args[0]}")
+
+            now = datetime.utcnow()
+            if habits is None:
+                updated_doc = await store.update_habit(
+                    user_id, stack_id, habit_id, {"rank": rank}, now, expected_updated_at=doc["updated_at"]
+                )
+            else:
+                # Unranked or tied habits: rank the whole stack once
+                updated_doc = await store.update_stack(
+                    user_id, stack_id, {"habits": habits, "updated_at": now}, expected_updated_at=doc["updated_at"]
+                )
+            if updated_doc:
+                break
         else:
-            raise HTTPException(status_code=500, detail="Failed to add habit to stack")
+            raise HTTPException(status_code=409, detail="Habit stack changed during the move, please retry")
+
+        await _record_change(user_id, stack_id)
+        if len(rank) > MAX_RANK_LENGTH:
+            _schedule_rebalance(user_id, stack_id)
+        updated_doc = order_habits(updated_doc)
+        stack_cache.put(user_id, updated_doc)
+        return HabitStack(**updated_doc)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error adding habit to stack: {str(e)}")
+        raise _server_error("Error moving habit in stack", e)
 
 @router.delete("/habit-stacks/{stack_id}/habits/{habit_id}")
-async def remove_habit_from_stack(stack_id: str, habit_id: str):
+async def remove_habit_from_stack(stack_id: str, habit_id: str, user_id: str = Depends(current_user)):
     """Remove a habit from a stack"""
     try:
-        # Find the existing stack
-        existing_stack = await db.habit_stacks.find_one({"id": stack_id})
-        if not existing_stack:
-            raise HTTPException(status_code=404, detail="Habit stack not found")
-        
-        # Filter out the habit to remove
-        existing_habits = existing_stack.get("habits", [])
-        updated_habits = [habit for habit in existing_habits if habit.get("id") != habit_id]
-        
-        # Update in database
-        result = await db.habit_stacks.update_one(
-            {"id": stack_id},
-            {"$set": {"habits": updated_habits, "updated_at": datetime.utcnow()}}
-        )
+        removed = await _pull_habit(user_id, stack_id, habit_id, datetime.utcnow())
         
-        if result.modified_count > 0:
+        if removed:
+            await _record_change(user_id, stack_id)
             return {"message": "Habit removed successfully"}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to remove habit from stack")
+        elif removed is False:
+            raise HTTPException(status_code=404, detail="Habit not found in stack")
+        raise HTTPException(status_code=404, detail="Habit stack not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error removing habit from stack", e)
+
+@router.post("/habit-stacks/{stack_id}/habits/{habit_id}/check-ins", response_model=CheckInResult)
+async def check_in_habit(
+    stack_id: str,
+    habit_id: str,
+    check_in: Optional[CheckInCreate] = None,
+    user_id: str = Depends(current_user)
+):
+    """Record that a habit was done on a day; repeating a day is a no-op"""
+    today = datetime.utcnow().date()
+    day = (check_in.day if check_in else None) or today
+    # Allow a day of slack for clients ahead of UTC
+    if day > today + timedelta(days=1):
+        raise HTTPException(status_code=400, detail="Cannot check in for a future day")
+    try:
+        await _require_habit(user_id, stack_id, habit_id)
+        recorded, habit_summary, stack_summary = await store.add_check_in(stack_id, habit_id, day.isoformat())
+        return CheckInResult(
+            day=day,
+            recorded=recorded,
+            habit=HabitStreak(habit_id=habit_id, **as_of(habit_summary, today)),
+            stack=StreakSummary(**as_of(stack_summary, today))
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error recording check-in", e)
+
+@router.get("/habit-stacks/{stack_id}/streaks", response_model=StackStreaks)
+async def get_stack_streaks(stack_id: str, user_id: str = Depends(current_user)):
+    """Get current and longest streaks for a stack and each of its habits
+
+    Summaries are maintained on every check-in, so this never reads history.
+    """
+    try:
+        doc = await store.get_stack(user_id, stack_id, ["habits"])
+        if not doc:
+            raise HTTPException(status_code=404, detail="Habit stack not found")
+        today = datetime.utcnow().date()
+        summaries = await store.get_streaks(stack_id)
+        return StackStreaks(
+            stack_id=stack_id,
+            habits=[
+                HabitStreak(habit_id=habit["id"], **as_of(summaries.get(habit["id"]), today))
+                for habit in order_habits(doc)["habits"]
+            ],
+            **as_of(summaries.get(None), today)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error fetching streaks", e)
+
+@router.get("/habit-stacks/{stack_id}/habits/{habit_id}/check-ins", response_model=CheckInHistory)
+async def get_check_in_history(
+    stack_id: str,
+    habit_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: str = Depends(current_user)
+):
+    """List the days a habit was done, by default over the last 30 days"""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= MAX_HISTORY_DAYS:
+        raise HTTPException(status_code=400, detail=f"History is limited to {MAX_HISTORY_DAYS} days per request")
+    try:
+        await _require_habit(user_id, stack_id, habit_id)
+        days = await store.list_check_ins(stack_id, habit_id, start.isoformat(), end.isoformat())
+        return CheckInHistory(habit_id=habit_id, start=start, end=end, days=days)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise _server_error("Error fetching check-ins", e)
+
+@router.get("/habit-stacks/{stack_id}/analytics", response_model=StackAnalytics)
+async def get_stack_analytics(
+    stack_id: str,
+    days: int = Query(365, ge=1, le=MAX_ANALYTICS_DAYS),
+    end: Optional[date] = None,
+    user_id: str = Depends(current_user)
+):
+    """Completion analytics over the ``days`` days ending at ``end`` (default today)
+
+    History is loaded with one query and the metrics are computed with NumPy
+    in a worker process.
+    """
+    # NumPy only loads in the analytics worker processes
+    from services.analytics_pool import run_analytics
+
+    end = end or datetime.utcnow().date()
+    start = end - timedelta(days=days - 1)
+    try:
+        doc = await store.get_stack(user_id, stack_id, ["habits"])
+        if not doc:
+            raise HTTPException(status_code=404, detail="Habit stack not found")
+        habit_ids = [habit["id"] for habit in order_habits(doc)["habits"]]
+        days_by_habit = await store.list_stack_check_ins(stack_id, start.isoformat(), end.isoformat())
+        result = await run_analytics(habit_ids, days_by_habit, start, end)
+        return json_response({"stack_id": stack_id, **result})
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error removing habit from stack: {str(e)}")
\ No newline at end of file
+        raise _server_error("Error computing analytics", e)
@@ -1,9 +1,14 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Request
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.responses import PlainTextResponse
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
+import signal
+import sys
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List
@@ -13,19 +18,233 @@ from datetime import datetime
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+from services.admission import AdmissionController, AdmissionMiddleware
+from services.metrics import MetricsMiddleware, metrics
+from services.serialization import ContentNegotiationMiddleware, NegotiatedResponse
 
-# Import routes after database is initialized
-from routes.habit_stacks import router as habit_stacks_router, initialize_db
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
 
-# Initialize database in routes
-initialize_db(db)
+# Storage engine: "mongo" (default) or "embedded" for single-node deployments
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'mongo').lower()
+
+# Connection pool settings for the Mongo engine
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+
+# Where the Mongo engine keeps habits: "embedded" in each stack document
+# (default) or "collection" for very large stacks. Switching to
+# "collection" migrates existing stacks in the background.
+MONGO_HABITS_LAYOUT = os.environ.get('MONGO_HABITS_LAYOUT', 'embedded').lower()
+
+# Serve as soon as the app is up: the Mongo client connects on the first
+# query, and index creation and pool warm-up run in the background. For
+# autoscaled and serverless deployments where cold start is user-facing.
+LAZY_STARTUP = _env_flag('LAZY_STARTUP')
+
+# Start the analytics worker processes in the background once the server is
+# ready, rather than on the first analytics request. Off by default, since
+# the workers load NumPy and compete with a cold start for CPU.
+ANALYTICS_PREWARM = _env_flag('ANALYTICS_PREWARM')
+
+# Readiness probe and shutdown drain. On SIGTERM readiness fails for
+# SHUTDOWN_DRAIN_DELAY seconds before the server is told to stop, so load
+# balancers take the worker out of rotation while it still serves. In-flight
+# requests are then finished by uvicorn, for up to its
+# --timeout-graceful-shutdown; the lifespan shutdown only runs after that.
+READINESS_TIMEOUT = float(os.environ.get('READINESS_TIMEOUT', '1.0'))
+SHUTDOWN_DRAIN_DELAY = float(os.environ.get('SHUTDOWN_DRAIN_DELAY', '5'))
+
+# Admission control: per-class concurrency budgets (scaled down while
+# request or database latency climbs) and a bounded wait queue; excess load gets a
+# fast 429/503 with Retry-After
+ADMISSION_CONTROL = _env_flag('ADMISSION_CONTROL', default=True)
+ADMISSION_READ_CONCURRENCY = int(os.environ.get('ADMISSION_READ_CONCURRENCY', '64'))
+ADMISSION_WRITE_CONCURRENCY = int(os.environ.get('ADMISSION_WRITE_CONCURRENCY', '32'))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '256'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '1.0'))
+
+# On-demand request profiling, off unless a secret or sample rate is set:
+# requests carrying an X-Profile header signed with PROFILE_SECRET (see
+# services/profiling.py) and a PROFILE_SAMPLE_RATE share of all requests
+# are profiled. Profiles are collapsed stacks written to PROFILE_DIR.
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+
+admission = AdmissionController(
+    read_concurrency=ADMISSION_READ_CONCURRENCY,
+    write_concurrency=ADMISSION_WRITE_CONCURRENCY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT
+) if ADMISSION_CONTROL else None
+if admission is not None:
+    metrics.mongo_observers.append(admission.observe_latency)
+
+# Created by the lifespan handler
+client = None
+store = None
+
+# Import routes; they get their storage engine at startup
+import routes.habit_stacks as habit_stacks
+from routes.habit_stacks import router as habit_stacks_router, initialize_store, stack_cache
+
+def create_store():
+    """Build the configured storage engine and, for Mongo, its client"""
+    if STORAGE_ENGINE == 'embedded':
+        from storage.embedded import EmbeddedStackStore
+
+        return EmbeddedStackStore(
+            journal_path=os.environ.get('EMBEDDED_JOURNAL_PATH') or None,
+            fsync=_env_flag('EMBEDDED_FSYNC')
+        ), None
+    if STORAGE_ENGINE == 'mongo':
+        # Imported here so the embedded engine never loads Motor or pymongo
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from services.mongo_metrics import MongoCommandMetrics, PoolCheckoutMetrics
+        from storage.mongo import MotorStackStore
+
+        # MongoDB connection
+        mongo_client = AsyncIOMotorClient(
+            os.environ['MONGO_URL'],
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            event_listeners=[MongoCommandMetrics(metrics), PoolCheckoutMetrics(metrics)]
+        )
+        database = mongo_client[os.environ['DB_NAME']]
+        if MONGO_HABITS_LAYOUT == 'collection':
+            from storage.mongo_habits import HabitCollectionStackStore
+
+            return HabitCollectionStackStore(database), mongo_client
+        if MONGO_HABITS_LAYOUT != 'embedded':
+            raise RuntimeError(f"Unknown MONGO_HABITS_LAYOUT: {MONGO_HABITS_LAYOUT}")
+        return MotorStackStore(database), mongo_client
+    raise RuntimeError(f"Unknown STORAGE_ENGINE: {STORAGE_ENGINE}")
+
+async def prepare_store():
+    """Create indexes and open pooled connections ahead of the first requests"""
+    await store.initialize()
+    # Open pooled connections now so the first requests don't pay for them
+    await store.warm_up(MONGO_MIN_POOL_SIZE)
+    # Optional diagnostics: refuse to start if any route query scans the collection
+    if _env_flag('CHECK_QUERY_PLANS'):
+        plans = await store.check_query_plans()
+        logger.info(f"Query plans OK for {len(plans)} route queries")
+
+async def prepare_in_background():
+    """LAZY_STARTUP: prepare the store and migrate while requests are served"""
+    try:
+        await prepare_store()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Deferred storage startup failed; queries run without warm-up")
+        return
+    await migrate_in_background()
+
+async def warm_up_analytics():
+    """Start the analytics workers; NumPy loads in them, not in this process"""
+    from services.analytics_pool import warm_up_pool
+
+    try:
+        await warm_up_pool()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Analytics workers failed to start; they start on the first request")
+
+async def migrate_in_background():
+    """Bring stored data to the engine's layout without holding up startup"""
+    try:
+        migrated = await store.migrate()
+        if migrated:
+            logger.info(f"Migrated {migrated} habit stacks to the {store.name} layout")
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Background migration failed; it resumes on the next start")
+
+def install_drain_handler(server_class, delay):
+    """Fail readiness on SIGTERM and let ``server_class`` stop ``delay`` seconds later
+
+    uvicorn registers ``Server.handle_exit`` with loop.add_signal_handler
+    before the lifespan starts, so the drain wraps that method on the class
+    rather than chaining a signal handler. Any other signal, or a SIGTERM
+    while not ready, is passed on at once.
+    """
+    handle_exit = server_class.handle_exit
+    if getattr(handle_exit, 'drains', False):
+        return
+
+    def draining_handle_exit(self, sig, frame):
+        if sig != signal.SIGTERM or not getattr(app.state, 'ready', False):
+            handle_exit(self, sig, frame)
+            return
+        app.state.ready = False
+        logger.info(f"SIGTERM received; failing readiness for {delay}s before stopping")
+        asyncio.get_running_loop().call_later(delay, handle_exit, self, sig, frame)
+
+    draining_handle_exit.drains = True
+    server_class.handle_exit = draining_handle_exit
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, store
+    logger.info("Starting Habit Stack Builder API...")
+    app.state.ready = False
+    store, client = create_store()
+    initialize_store(store)
+    logger.info(f"Storage engine: {store.name}")
+    if client is not None:
+        logger.info(f"Database: {os.environ['DB_NAME']}")
+
+    # The embedded engine must replay its journal before it can serve
+    if LAZY_STARTUP and client is not None:
+        background = asyncio.create_task(prepare_in_background())
+    else:
+        await prepare_store()
+        background = asyncio.create_task(migrate_in_background())
+    analytics_warm_up = asyncio.create_task(warm_up_analytics()) if ANALYTICS_PREWARM else None
+    app.state.ready = True
+
+    yield
+
+    # The server has stopped accepting and finished in-flight requests
+    app.state.ready = False
+    # Let the migration release its lease before the client goes away
+    background.cancel()
+    await asyncio.gather(background, return_exceptions=True)
+    if analytics_warm_up is not None:
+        analytics_warm_up.cancel()
+        await asyncio.gather(analytics_warm_up, return_exceptions=True)
+    analytics_pool = sys.modules.get('services.analytics_pool')
+    if analytics_pool is not None:
+        analytics_pool.shutdown_pool()
+    await store.close()
+    if client is not None:
+        client.close()
+    logger.info("Database connection closed.")
 
 # Create the main app without a prefix
-app = FastAPI(title="Habit Stack Builder API", version="1.0.0")
+# Responses are JSON or MessagePack (Accept), gzip-compressed when large
+app = FastAPI(
+    title="Habit Stack Builder API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=NegotiatedResponse
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -49,20 +268,50 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "Habit Stack Builder API",
-        "timestamp": datetime.utcnow()
+        "timestamp": datetime.utcnow(),
+        "stack_cache": stack_cache.stats(),
+        "write_coalescing": habit_stacks.habit_writes.stats() if habit_stacks.habit_writes else None,
+        "admission": admission.stats() if admission else None,
+        "analytics_pool": _analytics_pool_stats()
     }
 
+def _analytics_pool_stats():
+    # The pool module is only loaded once analytics were requested or prewarmed
+    analytics_pool = sys.modules.get('services.analytics_pool')
+    return analytics_pool.stats() if analytics_pool is not None else None
+
+@api_router.get("/health/live")
+async def liveness_check():
+    """Liveness probe: the process is up and serving the event loop"""
+    return {"status": "alive"}
+
+@api_router.get("/health/ready")
+async def readiness_check(request: Request):
+    """Readiness probe: startup finished, not draining, and storage answers"""
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "not ready"})
+    try:
+        await asyncio.wait_for(store.ping(), READINESS_TIMEOUT)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": str(e)})
+    return {"status": "ready", "storage_engine": store.name}
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics for this worker"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Legacy status routes for backwards compatibility
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    await store.add_status_check(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+    status_checks = await store.list_status_checks(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
 # Include the habit stacks router
@@ -71,14 +320,36 @@ api_router.include_router(habit_stacks_router)
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so shed requests still get CORS headers and show up in metrics
+if admission is not None:
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+
+app.add_middleware(ContentNegotiationMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Profile-Id", "X-Profiled-Status", "X-Profiled-Duration-Ms"],
 )
 
+# Only installed when configured, so unprofiled deployments pay nothing
+if PROFILE_SECRET or PROFILE_SAMPLE_RATE:
+    from services.profiling import ProfilingMiddleware
+
+    app.add_middleware(
+        ProfilingMiddleware,
+        secret=PROFILE_SECRET,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        directory=PROFILE_DIR or None,
+        interval=PROFILE_INTERVAL
+    )
+
+# Outermost, so latency includes every other middleware
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -86,12 +357,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Starting Habit Stack Builder API...")
-    logger.info(f"Database: {os.environ['DB_NAME']}")
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
-    logger.info("Database connection closed.")
\ No newline at end of file
+# uvicorn has imported this module to load the app but not yet registered
+# its signal handlers, so the drain is hooked in now
+if 'uvicorn.server' in sys.modules and SHUTDOWN_DRAIN_DELAY > 0:
+    install_drain_handler(sys.modules['uvicorn.server'].Server, SHUTDOWN_DRAIN_DELAY)
@@ -0,0 +1,265 @@
+import asyncio
+import math
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Pattern, Tuple
+
+from starlette.responses import JSONResponse
+
+# Latency smoothing and AIMD steps for the capacity factor
+LATENCY_ALPHA = 0.2
+CAPACITY_DECREASE = 0.9
+CAPACITY_INCREASE = 0.02
+# The baseline may drift up by this factor per adjustment, so a lasting
+# latency shift is eventually accepted as the new normal
+BASELINE_DRIFT = 1.002
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Routes whose run time follows the size of the payload (batches, streaming
+# import and export, analytics in the worker pool) rather than congestion;
+# they are admitted like any other but do not feed the latency signal
+UNMEASURED_PATHS = re.compile(r"^/api/habit-stacks(:batch|/export|/import|/[^/]+/analytics)$")
+
+
+class LatencyTracker:
+    """Smoothed recent latency of one signal and its baseline
+
+    The baseline follows the lowest recent latency; the signal is congested
+    while recent latency exceeds ``tolerance`` times the baseline by more
+    than ``min_slack`` seconds.
+    """
+
+    def __init__(self, min_slack: float):
+        self.min_slack = min_slack
+        self.recent = None
+        self.baseline = None
+
+    def observe(self, seconds: float) -> None:
+        recent = self.recent
+        self.recent = seconds if recent is None else recent + LATENCY_ALPHA * (seconds - recent)
+
+    def congested(self, tolerance: float) -> bool:
+        """Move the baseline and report congestion; called once per adjustment"""
+        recent = self.recent
+        if recent is None:
+            return False
+        baseline = self.baseline
+        baseline = recent if baseline is None else min(recent, baseline * BASELINE_DRIFT)
+        self.baseline = baseline
+        return recent > max(tolerance * baseline, baseline + self.min_slack)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {
+            "recent_latency_ms": None if self.recent is None else round(self.recent * 1000, 3),
+            "baseline_latency_ms": None if self.baseline is None else round(self.baseline * 1000, 3),
+        }
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RouteClassLimiter:
+    """Concurrency budget with a bounded FIFO wait queue for one class of routes"""
+
+    def __init__(self, name: str, controller: "AdmissionController", max_concurrency: int, max_queue: int):
+        self.name = name
+        self.controller = controller
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self.max_concurrency * self.controller.capacity))
+
+    async def acquire(self) -> None:
+        """Take a slot, queueing for at most the controller's ``queue_timeout``
+
+        Raises Overloaded with 429 when the queue is full and 503 when the
+        wait times out, so clients get a fast answer instead of a late 500.
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        retry_after = self.controller.retry_after
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(429, retry_after, f"Too many {self.name} requests, retry later")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self.controller.queue_timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # A slot was handed over just as the wait ended
+                self.release()
+            else:
+                self._remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Overloaded(503, retry_after, f"Timed out waiting for a {self.name} slot")
+            raise
+        self.admitted += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _remove(self, future: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def _wake(self) -> None:
+        # Slots are handed to waiters directly, so newcomers cannot jump the queue
+        while self._waiters and self.in_flight < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionController:
+    """Per-class concurrency limits scaled by observed latency
+
+    ``capacity`` (between ``min_capacity`` and 1) multiplies every class's
+    budget. It shrinks multiplicatively while recent database command
+    latency or admitted request latency is above ``tolerance`` times its
+    baseline, and grows back additively otherwise. Request latency covers
+    every storage engine, including the embedded one, which issues no
+    database commands; it gets a wider ``request_min_slack`` as routes
+    differ in cost.
+    """
+
+    def __init__(
+        self,
+        read_concurrency: int,
+        write_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        tolerance: float = 2.0,
+        min_slack: float = 0.005,
+        request_min_slack: float = 0.05,
+        min_capacity: float = 0.1,
+        adjust_interval: float = 0.1,
+    ):
+        self.queue_timeout = queue_timeout
+        self.retry_after = max(1, math.ceil(queue_timeout))
+        self.tolerance = tolerance
+        self.min_capacity = min_capacity
+        self.adjust_interval = adjust_interval
+        self.capacity = 1.0
+        self.database = LatencyTracker(min_slack)
+        self.requests = LatencyTracker(request_min_slack)
+        self._last_adjust = time.monotonic()
+        self.limiters = {
+            "read": RouteClassLimiter("read", self, read_concurrency, max_queue),
+            "write": RouteClassLimiter("write", self, write_concurrency, max_queue),
+        }
+
+    def observe_latency(self, seconds: float) -> None:
+        """Feed one database command latency
+
+        Called from pymongo's listener threads, so it only updates floats.
+        """
+        self.database.observe(seconds)
+        self._adjust()
+
+    def observe_request_latency(self, seconds: float) -> None:
+        """Feed the latency of one admitted request, excluding its queue wait"""
+        self.requests.observe(seconds)
+        self._adjust()
+
+    def _adjust(self) -> None:
+        now = time.monotonic()
+        if now - self._last_adjust < self.adjust_interval:
+            return
+        self._last_adjust = now
+        # Both trackers move their baselines on every adjustment
+        congested = [tracker.congested(self.tolerance) for tracker in (self.database, self.requests)]
+        if any(congested):
+            self.capacity = max(self.min_capacity, self.capacity * CAPACITY_DECREASE)
+        else:
+            self.capacity = min(1.0, self.capacity + CAPACITY_INCREASE)
+            # Slots freed by the higher limit go to queued requests right away
+            for limiter in self.limiters.values():
+                limiter._wake()
+
+    def limiter_for(self, method: str) -> RouteClassLimiter:
+        return self.limiters["read" if method in READ_METHODS else "write"]
+
+    def stats(self):
+        return {
+            "capacity": round(self.capacity, 3),
+            "database": self.database.stats(),
+            "requests": self.requests.stats(),
+            **{name: limiter.stats() for name, limiter in self.limiters.items()},
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting API requests through an AdmissionController
+
+    Health probes and metrics are never queued or shed. Requests whose
+    path matches ``unmeasured`` are admitted but their latency is not
+    observed.
+    """
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        exempt: Tuple[str, ...] = ("/api/health", "/api/metrics"),
+        unmeasured: Pattern[str] = UNMEASURED_PATHS,
+    ):
+        self.app = app
+        self.controller = controller
+        self.exempt = exempt
+        self.unmeasured = unmeasured
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.controller.limiter_for(scope["method"])
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            response = JSONResponse(
+                {"detail": e.reason}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        measured = not self.unmeasured.match(scope["path"])
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+            if measured:
+                self.controller.observe_request_latency(time.perf_counter() - start)
@@ -0,0 +1,84 @@
+"""
+Worker processes for analytics
+
+Kept apart from services.analytics so the server process never loads
+NumPy: requests hand their history to a worker, which imports the
+analytics module itself.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+# Worker processes for analytics, so number crunching never blocks the event loop
+ANALYTICS_WORKERS = int(os.environ.get('ANALYTICS_WORKERS', '2'))
+
+# Forking a process that runs Motor's threads can leave a child holding a
+# lock nobody will release, so workers come from a fork server (or are
+# spawned where there is none). The fork server imports the analytics
+# module once and every worker inherits it.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+PRELOAD_MODULES = ["services.analytics"]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_workers = 0
+
+
+def start_pool(workers: int = ANALYTICS_WORKERS) -> ProcessPoolExecutor:
+    global _pool, _workers
+    if _pool is None:
+        _workers = workers
+        context = multiprocessing.get_context(START_METHOD)
+        if START_METHOD == "forkserver":
+            context.set_forkserver_preload(PRELOAD_MODULES)
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return _pool
+
+
+def get_pool() -> ProcessPoolExecutor:
+    return start_pool()
+
+
+def _ready() -> int:
+    return os.getpid()
+
+
+def _compute(habit_ids: List[str], packed: Dict[str, str], start: date, end: date) -> Dict[str, Any]:
+    """Worker entry point; only worker processes import services.analytics"""
+    from services.analytics import _compute_packed
+
+    return _compute_packed(habit_ids, packed, start, end)
+
+
+async def run_analytics(
+    habit_ids: List[str], days_by_habit: Dict[str, List[str]], start: date, end: date
+) -> Dict[str, Any]:
+    """Run ``compute_analytics`` in the worker pool"""
+    packed = {habit_id: "".join(days) for habit_id, days in days_by_habit.items()}
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), _compute, habit_ids, packed, start, end)
+
+
+async def warm_up_pool() -> None:
+    """Start every worker now so the first analytics request doesn't wait for them"""
+    pool = start_pool()
+    loop = asyncio.get_running_loop()
+    # Submitting starts the processes, which blocks; keep it off the event loop
+    futures = await asyncio.to_thread(lambda: [pool.submit(_ready) for _ in range(_workers)])
+    await asyncio.gather(*(asyncio.wrap_future(future, loop=loop) for future in futures))
+
+
+def stats() -> Dict[str, int]:
+    # The executor starts processes on demand and keeps no public count
+    started = len(_pool._processes or {}) if _pool is not None else 0
+    return {"workers": _workers or ANALYTICS_WORKERS, "started": started}
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,59 @@
+import os
+import re
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+# With JWT_SECRET set, requests must carry "Authorization: Bearer <token>"
+# signed with it (or, for RS*/ES* algorithms, JWT_SECRET is the public key)
+# and the user is the token's "sub" claim. Without it the X-User-Id header
+# names the user, which is only safe behind a gateway that sets it.
+JWT_SECRET = os.environ.get('JWT_SECRET', '')
+JWT_ALGORITHMS = [name.strip() for name in os.environ.get('JWT_ALGORITHMS', 'HS256').split(',')]
+JWT_AUDIENCE = os.environ.get('JWT_AUDIENCE') or None
+
+# User of requests without X-User-Id when JWT is off; empty rejects them
+DEFAULT_USER_ID = os.environ.get('DEFAULT_USER_ID', 'default')
+
+_USER_ID = re.compile(r"[\w.@|:+-]{1,128}")
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+def _token_user(authorization: Optional[str]) -> str:
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise _unauthorized("Missing bearer token")
+    # Imported on first use, so deployments without JWT never load it
+    import jwt
+
+    try:
+        claims = jwt.decode(
+            token,
+            JWT_SECRET,
+            algorithms=JWT_ALGORITHMS,
+            audience=JWT_AUDIENCE,
+            options={"require": ["exp", "sub"]},
+        )
+    except jwt.PyJWTError as e:
+        raise _unauthorized(f"Invalid token: {str(e)}")
+    if not _USER_ID.fullmatch(claims["sub"]):
+        raise _unauthorized("Invalid token: unsupported sub claim")
+    return claims["sub"]
+
+
+async def current_user(
+    authorization: Optional[str] = Header(None),
+    x_user_id: Optional[str] = Header(None),
+) -> str:
+    """Dependency returning the id of the user making the request"""
+    if JWT_SECRET:
+        return _token_user(authorization)
+    user_id = x_user_id or DEFAULT_USER_ID
+    if not user_id:
+        raise _unauthorized("Missing X-User-Id header")
+    if not _USER_ID.fullmatch(user_id):
+        raise HTTPException(status_code=400, detail="Invalid X-User-Id header")
+    return user_id
@@ -0,0 +1,109 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Entries are keyed by (user_id, stack_id)
+CacheKey = Tuple[str, str]
+
+
+class _Entry:
+    __slots__ = ("doc", "stored_at", "validated_at")
+
+    def __init__(self, doc: Dict[str, Any], now: float):
+        self.doc = doc
+        self.stored_at = now
+        self.validated_at = now
+
+
+class StackCache:
+    """Bounded LRU cache of habit stack documents keyed by owner and stack ``id``
+
+    Entries are only ever served to, revalidated for or invalidated by
+    their owner; other users' lookups of the same stack id miss.
+
+    Entries live for at most ``ttl`` seconds. Once an entry is older than
+    ``max_staleness`` seconds its ``updated_at`` is checked against the
+    database before it is served again, which bounds how stale a worker can
+    be after another worker wrote the stack. A ``max_size`` of 0 disables
+    the cache.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0, max_staleness: float = 1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_staleness = max_staleness
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    async def get(
+        self,
+        user_id: str,
+        stack_id: str,
+        fetch_updated_at: Callable[[str, str], Awaitable[Optional[Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        """Return the user's cached document, or None if it must be loaded from the database
+
+        ``fetch_updated_at(user_id, stack_id)`` revalidates stale entries.
+        """
+        key = (user_id, stack_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        if now - entry.stored_at > self.ttl:
+            self._drop(key, entry)
+            self.misses += 1
+            return None
+
+        if now - entry.validated_at > self.max_staleness:
+            self.revalidations += 1
+            updated_at = await fetch_updated_at(user_id, stack_id)
+            if updated_at != entry.doc["updated_at"]:
+                self._drop(key, entry)
+                self.misses += 1
+                return None
+            entry.validated_at = time.monotonic()
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.doc
+
+    def put(self, user_id: str, doc: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        key = (user_id, doc["id"])
+        self._entries[key] = _Entry(doc, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: str, stack_id: str) -> None:
+        self._entries.pop((user_id, stack_id), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "revalidations": self.revalidations,
+        }
+
+    def _drop(self, key: CacheKey, entry: _Entry) -> None:
+        # Another coroutine may have replaced the entry while we awaited
+        if self._entries.get(key) is entry:
+            del self._entries[key]
@@ -0,0 +1,110 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Set, Tuple
+
+from storage.base import HabitOp
+
+StackKey = Tuple[str, str]
+
+
+class WriteCoalescer:
+    """Group commit for habit pushes and pulls
+
+    Operations queue per stack. Stacks with no write in flight are flushed
+    ``window`` seconds after the first operation arrives (or as soon as
+    ``max_batch`` operations are ready), together in one ``apply`` call
+    (``StackStore.apply_habit_ops``), and each caller gets its own
+    operation's result. While a stack's batch is being written, its new
+    operations keep queueing and go out as the next batch as soon as the
+    write returns, so batches grow with load instead of the queue. Batches
+    for different stacks run concurrently; a stack is only ever in one
+    batch at a time, so its operations keep their order.
+    """
+
+    def __init__(
+        self,
+        apply: Callable[[Sequence[HabitOp]], Awaitable[List[Any]]],
+        window: float,
+        max_batch: int = 1000,
+    ):
+        self.apply = apply
+        self.window = window
+        self.max_batch = max_batch
+        self._queues: Dict[StackKey, List[Tuple[HabitOp, asyncio.Future]]] = {}
+        # Stacks with a batch in flight, and the queued operations of the others
+        self._busy: Set[StackKey] = set()
+        self._ready = 0
+        self._timer = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.operations = 0
+
+    async def submit(self, op: HabitOp) -> Any:
+        """Queue ``op`` and wait for the result of the batch it lands in"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (op.user_id, op.stack_id)
+        self._queues.setdefault(key, []).append((op, future))
+        if key not in self._busy:
+            self._ready += 1
+            if self._ready >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Send the queued operations of every idle stack, ``max_batch`` at a time"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch: List[Tuple[HabitOp, asyncio.Future]] = []
+        keys: List[StackKey] = []
+        for key in [key for key in self._queues if key not in self._busy]:
+            queue = self._queues[key]
+            taken = queue[:self.max_batch - len(batch)]
+            del queue[:len(taken)]
+            if not queue:
+                del self._queues[key]
+            batch += taken
+            keys.append(key)
+            self._busy.add(key)
+            self._ready -= len(taken)
+            if len(batch) >= self.max_batch:
+                self._start(keys, batch)
+                batch, keys = [], []
+        if batch:
+            self._start(keys, batch)
+
+    def _start(self, keys: List[StackKey], batch: List[Tuple[HabitOp, asyncio.Future]]) -> None:
+        task = asyncio.create_task(self._run(keys, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, keys: List[StackKey], batch: List[Tuple[HabitOp, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.operations += len(batch)
+        try:
+            results = await self.apply([op for op, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._busy.difference_update(keys)
+            waiting = sum(len(self._queues.get(key, ())) for key in keys)
+            if waiting:
+                # What queued behind this batch goes out right away
+                self._ready += waiting
+                self._flush()
+
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000,
+            "batches": self.batches,
+            "operations": self.operations,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+        }
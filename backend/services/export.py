@@ -0,0 +1,26 @@
+import zlib
+from typing import AsyncIterable, AsyncIterator
+
+from services.serialization import dumps
+
+
+async def ndjson_batches(cursor, batch_size: int) -> AsyncIterator[bytes]:
+    """Encode documents from a Motor cursor as NDJSON, one chunk per batch"""
+    lines = []
+    async for doc in cursor:
+        lines.append(dumps(doc))
+        if len(lines) >= batch_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+async def gzip_stream(chunks: AsyncIterable[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Gzip a byte stream, flushing after every chunk so output is not held back"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
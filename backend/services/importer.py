@@ -0,0 +1,155 @@
+import asyncio
+import time
+import zlib
+from typing import AsyncIterable, AsyncIterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from models.habit_stack import Habit, HabitStack, HabitStackCreate, ImportLineError, ImportResult
+from services.ranking import assign_ranks
+
+
+async def gunzip_stream(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    decompressor = zlib.decompressobj(31)
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+async def iter_lines(
+    chunks: AsyncIterable[bytes], max_line_bytes: int = 1 << 20
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """Yield ``(line_number, line)`` pairs from a chunked byte stream
+
+    Only the unfinished tail of the stream is buffered. Lines longer than
+    ``max_line_bytes`` are dropped as they arrive and yielded as None.
+    """
+    pending = bytearray()
+    too_long = False
+    line_number = 0
+    async for chunk in chunks:
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            line_number += 1
+            if too_long or len(pending) + end - start > max_line_bytes:
+                yield line_number, None
+            elif pending:
+                pending += chunk[start:end]
+                yield line_number, bytes(pending)
+            else:
+                yield line_number, chunk[start:end]
+            pending.clear()
+            too_long = False
+            start = end + 1
+        if not too_long:
+            pending += chunk[start:]
+            if len(pending) > max_line_bytes:
+                pending.clear()
+                too_long = True
+    if too_long:
+        yield line_number + 1, None
+    elif pending:
+        yield line_number + 1, bytes(pending)
+
+
+def _describe(error: ValidationError) -> str:
+    messages = []
+    for err in error.errors(include_url=False):
+        location = ".".join(str(part) for part in err["loc"])
+        messages.append(f"{location}: {err['msg']}" if location else err["msg"])
+    return "; ".join(messages)
+
+
+class NDJSONImporter:
+    """Validate NDJSON habit stacks and write them in bounded, concurrent batches
+
+    At most ``max_in_flight`` batch inserts run at once. When that
+    limit is reached, reading the request body pauses until a batch finishes,
+    which pushes back on the client instead of buffering the upload.
+    """
+
+    def __init__(
+        self,
+        store,
+        user_id: str,
+        batch_size: int = 1000,
+        max_in_flight: int = 4,
+        max_errors: int = 100,
+        max_line_bytes: int = 1 << 20,
+    ):
+        self.store = store
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.max_line_bytes = max_line_bytes
+        self.max_errors = max_errors
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks: List[asyncio.Task] = []
+        self.accepted = 0
+        self.rejected = 0
+        self.errors: List[ImportLineError] = []
+
+    def _reject(self, line: int, error: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(ImportLineError(line=line, error=error))
+
+    async def _write(self, docs: List[dict], lines: List[int]) -> None:
+        try:
+            errors = await self.store.insert_stacks(docs)
+            self.accepted += len(docs) - len(errors)
+            for index, error in errors.items():
+                self._reject(lines[index], error)
+        except Exception as e:
+            for line in lines:
+                self._reject(line, f"Write failed: {str(e)}")
+        finally:
+            self._slots.release()
+
+    async def _flush(self, docs: List[dict], lines: List[int]) -> None:
+        await self._slots.acquire()
+        self._tasks.append(asyncio.create_task(self._write(docs, lines)))
+        self._tasks = [task for task in self._tasks if not task.done()]
+
+    async def run(self, chunks: AsyncIterable[bytes]) -> ImportResult:
+        start = time.perf_counter()
+        docs, lines = [], []
+        try:
+            async for line_number, line in iter_lines(chunks, self.max_line_bytes):
+                if line is None:
+                    self._reject(line_number, f"Line is longer than {self.max_line_bytes} bytes")
+                    continue
+                if not line.strip():
+                    continue
+                try:
+                    data = HabitStackCreate.model_validate_json(line)
+                except ValidationError as e:
+                    self._reject(line_number, _describe(e))
+                    continue
+                docs.append(HabitStack(
+                    user_id=self.user_id,
+                    name=data.name,
+                    habits=[Habit(**habit) for habit in assign_ranks([h.dict() for h in data.habits])]
+                ).dict())
+                lines.append(line_number)
+                if len(docs) >= self.batch_size:
+                    await self._flush(docs, lines)
+                    docs, lines = [], []
+            if docs:
+                await self._flush(docs, lines)
+        finally:
+            # Never leave batches running in the background, even on a bad body
+            await asyncio.gather(*self._tasks)
+
+        duration = time.perf_counter() - start
+        return ImportResult(
+            accepted=self.accepted,
+            rejected=self.rejected,
+            errors=self.errors,
+            errors_truncated=self.rejected > len(self.errors),
+            duration_seconds=round(duration, 3),
+            rows_per_second=round((self.accepted + self.rejected) / duration, 1) if duration else 0.0
+        )
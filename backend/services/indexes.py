@@ -0,0 +1,146 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from services.pagination import LIST_SORT
+from services.search import SEARCH_WEIGHTS
+
+logger = logging.getLogger(__name__)
+
+# Every query matches one user_id first, so every index starts with it: a
+# user's queries read one index range whatever the total number of stacks,
+# and {user_id: 1, id: 1} (the unique index below) can serve as shard key.
+
+# Both engines tokenize the same way: no stemming and no stop words. The
+# user_id prefix requires an equality match on it in every $text query.
+TEXT_INDEX = IndexModel(
+    [("user_id", ASCENDING), ("name", TEXT), ("habits.name", TEXT)],
+    name="user_name_text",
+    weights=SEARCH_WEIGHTS,
+    default_language="none",
+)
+
+# Habit names when habits live in their own collection (storage.mongo_habits)
+HABIT_TEXT_INDEX = IndexModel(
+    [("user_id", ASCENDING), ("name", TEXT)],
+    name="user_name_text",
+    weights={"name": SEARCH_WEIGHTS["habits.name"]},
+    default_language="none",
+)
+
+# Indexes every habit_stacks query relies on
+HABIT_STACK_INDEXES = [
+    IndexModel([("user_id", ASCENDING), ("id", ASCENDING)], name="user_id_unique", unique=True),
+    IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)], name="user_updated_at_id"),
+    IndexModel([("user_id", ASCENDING), ("habits.id", ASCENDING)], name="user_habits_id"),
+    TEXT_INDEX,
+]
+
+# Indexes from before stacks had owners, dropped on startup
+RETIRED_INDEXES = ["id_unique", "updated_at_id", "habits_id", "name_text"]
+
+# Indexes of the habits collection used by storage.mongo_habits; ``_id`` is
+# "<stack_id>|<habit_id>"
+HABIT_INDEXES = [
+    IndexModel(
+        [("user_id", ASCENDING), ("stack_id", ASCENDING), ("rank", ASCENDING), ("order", ASCENDING), ("id", ASCENDING)],
+        name="user_stack_rank",
+    ),
+    HABIT_TEXT_INDEX,
+]
+
+RETIRED_HABIT_INDEXES = ["stack_rank", "name_text"]
+
+# Representative filters (and sorts) issued by the routes, used for plan checks
+ROUTE_QUERIES = {
+    "get_habit_stacks": ({"user_id": ""}, LIST_SORT),
+    "get_habit_stacks_cursor": (
+        {"user_id": "", "$or": [
+            {"updated_at": {"$lt": datetime(1970, 1, 1)}},
+            {"updated_at": datetime(1970, 1, 1), "id": {"$lt": ""}},
+        ]},
+        LIST_SORT,
+    ),
+    "get_habit_stack": ({"user_id": "", "id": ""}, None),
+    "update_habit_stack": ({"user_id": "", "id": ""}, None),
+    "delete_habit_stack": ({"user_id": "", "id": ""}, None),
+    "add_habit_to_stack": ({"user_id": "", "id": ""}, None),
+    "update_habit_in_stack": ({"user_id": "", "id": "", "habits.id": ""}, None),
+    "remove_habit_from_stack": ({"user_id": "", "id": "", "habits.id": ""}, None),
+    "find_by_habit_id": ({"user_id": "", "habits.id": ""}, None),
+    "search_habit_stacks": ({"user_id": "", "$text": {"$search": "morning"}}, None),
+    "assign_legacy_owner": ({"user_id": {"$exists": False}}, None),
+}
+
+HABIT_ROUTE_QUERIES = {
+    "get_stack_habits": ({"user_id": "", "stack_id": ""}, [("rank", 1), ("order", 1), ("id", 1)]),
+    "delete_stack_habits": ({"user_id": "", "stack_id": {"$in": [""]}}, None),
+    "search_habit_names": ({"user_id": "", "$text": {"$search": "morning"}}, None),
+}
+
+
+class QueryPlanError(RuntimeError):
+    pass
+
+
+async def ensure_indexes(
+    database,
+    collection_name: str = "habit_stacks",
+    indexes: List[IndexModel] = HABIT_STACK_INDEXES,
+    retired: List[str] = RETIRED_INDEXES,
+) -> List[str]:
+    """Create the declared indexes if needed and return the ones that were missing
+
+    ``create_indexes`` is a no-op for indexes that already exist with the same
+    definition, so this is safe to run on every startup. ``retired`` indexes
+    are dropped once their replacements exist, except a text index, which
+    has to go first as a collection holds only one.
+    """
+    collection = database[collection_name]
+    existing = await collection.index_information()
+    missing = [index.document["name"] for index in indexes if index.document["name"] not in existing]
+    if missing:
+        logger.warning(f"Missing {collection_name} indexes, creating: {', '.join(missing)}")
+    retired = [name for name in retired if name in existing]
+    text = [name for name in retired if any(kind == TEXT for _, kind in existing[name]["key"])]
+    for name in text:
+        await collection.drop_index(name)
+    await collection.create_indexes(indexes)
+    for name in retired:
+        if name not in text:
+            await collection.drop_index(name)
+    if retired:
+        logger.warning(f"Dropped retired {collection_name} indexes: {', '.join(retired)}")
+    return missing
+
+
+def _plan_stages(plan: Dict[str, Any]):
+    """Yield every stage name in an explain plan tree"""
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def check_query_plans(
+    database, collection_name: str = "habit_stacks", queries: Dict[str, Any] = ROUTE_QUERIES
+) -> Dict[str, List[str]]:
+    """Explain every route query and raise if any of them needs a COLLSCAN"""
+    collection = database[collection_name]
+    plans = {}
+    for route, (query, sort) in queries.items():
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        plans[route] = list(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+
+    scans = [route for route, stages in plans.items() if "COLLSCAN" in stages]
+    if scans:
+        raise QueryPlanError(f"Collection scan in query plans for: {', '.join(scans)}")
+    return plans
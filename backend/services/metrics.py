@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow scans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram rendered in Prometheus text format"""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> Iterable[str]:
+        prefix = f"{labels}," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}'
+        suffix = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{suffix} {self.total}"
+        yield f"{name}_count{suffix} {self.count}"
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class Metrics:
+    """Process-wide counters, gauges and histograms
+
+    Updates are plain dict and integer operations so recording a request
+    costs a few microseconds. Pymongo listeners run on Motor's executor
+    threads and take ``_lock``; the event loop only reads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.request_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.in_flight = 0
+        self.mongo_latency: Dict[str, Histogram] = {}
+        self.mongo_errors: Dict[str, int] = {}
+        self.pool_wait = Histogram()
+        self.pool_checkout_failures = 0
+        # Called with each command's latency in seconds, e.g. by admission control
+        self.mongo_observers: List[Callable[[float], None]] = []
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float) -> None:
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.request_latency.get((method, route))
+        if histogram is None:
+            histogram = self.request_latency[(method, route)] = Histogram()
+        histogram.observe(seconds)
+
+    def observe_mongo(self, command: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            histogram = self.mongo_latency.get(command)
+            if histogram is None:
+                histogram = self.mongo_latency[command] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                self.mongo_errors[command] = self.mongo_errors.get(command, 0) + 1
+        for observer in self.mongo_observers:
+            observer(seconds)
+
+    def observe_pool_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.pool_wait.observe(seconds)
+
+    def observe_pool_checkout_failure(self) -> None:
+        with self._lock:
+            self.pool_checkout_failures += 1
+
+    def render(self) -> str:
+        lines: List[str] = []
+        lines.append("# HELP http_requests_total HTTP requests by method, route and status")
+        lines.append("# TYPE http_requests_total counter")
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f"http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}")
+
+        lines.append("# HELP http_request_duration_seconds HTTP request latency")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), histogram in sorted(self.request_latency.items()):
+            lines.extend(histogram.render("http_request_duration_seconds", _labels(method=method, route=route)))
+
+        lines.append("# HELP http_requests_in_flight HTTP requests currently being served")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append(f"http_requests_in_flight {self.in_flight}")
+
+        with self._lock:
+            lines.append("# HELP mongodb_command_duration_seconds MongoDB command latency")
+            lines.append("# TYPE mongodb_command_duration_seconds histogram")
+            for command, histogram in sorted(self.mongo_latency.items()):
+                lines.extend(histogram.render("mongodb_command_duration_seconds", _labels(command=command)))
+
+            lines.append("# HELP mongodb_command_errors_total Failed MongoDB commands")
+            lines.append("# TYPE mongodb_command_errors_total counter")
+            for command, count in sorted(self.mongo_errors.items()):
+                lines.append(f"mongodb_command_errors_total{{{_labels(command=command)}}} {count}")
+
+            lines.append("# HELP mongodb_pool_checkout_wait_seconds Time spent waiting for a pooled connection")
+            lines.append("# TYPE mongodb_pool_checkout_wait_seconds histogram")
+            lines.extend(self.pool_wait.render("mongodb_pool_checkout_wait_seconds", ""))
+
+            lines.append("# HELP mongodb_pool_checkout_failures_total Failed connection checkouts")
+            lines.append("# TYPE mongodb_pool_checkout_failures_total counter")
+            lines.append(f"mongodb_pool_checkout_failures_total {self.pool_checkout_failures}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route request counts and latency
+
+    Routes are labelled with their path template (``/api/habit-stacks/{stack_id}``)
+    so label cardinality stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app, registry: Metrics = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        registry = self.registry
+        registry.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            registry.in_flight -= 1
+            route = scope.get("route")
+            registry.observe_request(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                status,
+                time.perf_counter() - start,
+            )
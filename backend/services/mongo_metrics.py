@@ -0,0 +1,79 @@
+"""
+Pymongo listeners feeding the metrics registry
+
+Kept apart from ``services.metrics`` so only the Mongo engine pays for
+importing pymongo.
+"""
+
+import threading
+import time
+
+from pymongo import monitoring
+
+from services.metrics import Metrics, metrics
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Pymongo listener recording command latency and failures"""
+
+    def __init__(self, registry: Metrics = metrics):
+        self.registry = registry
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.registry.observe_mongo(event.command_name, event.duration_micros / 1e6, failed=False)
+
+    def failed(self, event):
+        self.registry.observe_mongo(event.command_name, event.duration_micros / 1e6, failed=True)
+
+
+class PoolCheckoutMetrics(monitoring.ConnectionPoolListener):
+    """Pymongo listener recording how long operations wait for a connection
+
+    Checkout start and finish happen on the same executor thread, so the
+    start time is kept in a thread local.
+    """
+
+    def __init__(self, registry: Metrics = metrics):
+        self.registry = registry
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            self.registry.observe_pool_wait(time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        self.registry.observe_pool_checkout_failure()
+
+    # The remaining pool events are not needed
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
@@ -0,0 +1,122 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.habit_stack import HabitStack
+
+# Listing is ordered newest first; ``id`` breaks ties between equal timestamps
+LIST_SORT = [("updated_at", -1), ("id", -1)]
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Fields that are always returned so the next cursor can be built
+CURSOR_FIELDS = ("id", "updated_at")
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def _encode_payload(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_payload(cursor: str) -> Dict[str, Any]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    """Build an opaque cursor pointing just after ``doc``"""
+    return _encode_payload({"u": doc["updated_at"].isoformat(), "i": doc["id"]})
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by ``encode_cursor``"""
+    try:
+        payload = _decode_payload(cursor)
+        return datetime.fromisoformat(payload["u"]), str(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+def encode_search_cursor(hit: Dict[str, Any]) -> str:
+    """Build an opaque cursor pointing just after a search hit"""
+    return _encode_payload({"s": hit["score"], "i": hit["id"]})
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, str]:
+    """Decode a cursor produced by ``encode_search_cursor``"""
+    try:
+        payload = _decode_payload(cursor)
+        return float(payload["s"]), str(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+def encode_habit_cursor(habit: Dict[str, Any], position: int) -> str:
+    """Build an opaque cursor pointing just after ``habit``, the habit before ``position``"""
+    return _encode_payload({"r": habit.get("rank") or "", "o": habit.get("order", 0), "i": habit["id"], "p": position})
+
+
+def decode_habit_cursor(cursor: str) -> Tuple[Tuple[str, int, str], int]:
+    """Decode a cursor produced by ``encode_habit_cursor`` into a ``habit_key`` and position"""
+    try:
+        payload = _decode_payload(cursor)
+        return (str(payload["r"]), int(payload["o"]), str(payload["i"])), int(payload["p"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+
+
+def habit_after_filter(after: Tuple[str, int, str]) -> Dict[str, Any]:
+    """Return the query filter selecting habits after a ``habit_key`` position
+
+    An empty rank stands for unranked habits, which MongoDB sorts first.
+    """
+    rank, order, habit_id = after
+    rank = rank or None
+    return {
+        "$or": [
+            {"rank": {"$gt": rank}} if rank else {"rank": {"$type": "string"}},
+            {"rank": rank, "order": {"$gt": order}},
+            {"rank": rank, "order": order, "id": {"$gt": habit_id}},
+        ]
+    }
+
+
+def after_filter(after: Optional[Tuple[datetime, str]]) -> Dict[str, Any]:
+    """Return the query filter selecting documents after an (updated_at, id) position"""
+    if not after:
+        return {}
+    updated_at, stack_id = after
+    return {
+        "$or": [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "id": {"$lt": stack_id}},
+        ]
+    }
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma separated ``fields`` parameter into a list of field names"""
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in HabitStack.model_fields]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def build_projection(fields: Optional[List[str]]) -> Dict[str, int]:
+    """Build a MongoDB projection, always keeping the cursor fields
+
+    Without ``fields`` every ``HabitStack`` field is returned.
+    """
+    projection = {"_id": 0}
+    for field in (*CURSOR_FIELDS, *(fields or HabitStack.model_fields)):
+        projection[field] = 1
+    return projection
@@ -0,0 +1,221 @@
+"""
+On-demand profiling of single requests
+
+A profiled request is sampled every ``interval`` seconds from a helper
+thread. While the request's task runs, the sample is the event loop
+thread's stack; while it is suspended, it is the chain of coroutines the
+task is awaiting, ending in the awaited future. Time spent waiting on
+Motor, the analytics pool or a lock is therefore attributed to the code
+that awaited it, which cProfile cannot do for a coroutine. Samples are
+aggregated as collapsed stacks, the input of flamegraph.pl, speedscope
+and inferno.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+# "inline" replaces the response body with the profile
+PROFILE_OUTPUT_HEADER = b"x-profile-output"
+
+
+def sign_profile_request(secret: str, method: str, path: str, ttl: float = 300) -> str:
+    """Value of the X-Profile header profiling ``method path`` for ``ttl`` seconds"""
+    expires = int(time.time() + ttl)
+    return f"{expires}.{_signature(secret, expires, method, path)}"
+
+
+def _signature(secret: str, expires: int, method: str, path: str) -> str:
+    message = f"{expires}:{method.upper()} {path}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_profile_token(secret: str, token: str, method: str, path: str) -> bool:
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(secret, int(expires), method, path))
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({Path(code.co_filename).name}:{frame.f_lineno})".replace(";", ":")
+
+
+class AsyncStackSampler:
+    """Samples the stack of one asyncio task from a daemon thread"""
+
+    def __init__(self, task, interval: float = 0.005):
+        self.coro = task.get_coro()
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._loop_thread = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            stack = self.sample()
+            if stack:
+                self.samples[";".join(stack)] += 1
+
+    def sample(self) -> Tuple[str, ...]:
+        """Current stack of the task, outermost frame first"""
+        root = self.coro.cr_frame
+        if root is None:
+            return ()
+        if self.coro.cr_running:
+            frames = []
+            frame = sys._current_frames().get(self._loop_thread)
+            while frame is not None:
+                frames.append(frame)
+                if frame is root:
+                    return tuple(_label(f) for f in reversed(frames))
+                frame = frame.f_back
+            return ()
+
+        stack = []
+        awaited = self.coro
+        while awaited is not None:
+            frame = getattr(awaited, "cr_frame", None) or getattr(awaited, "gi_frame", None)
+            if frame is None:
+                # A future or other awaitable: where the task is waiting
+                stack.append(f"<await {type(awaited).__name__}>")
+                break
+            stack.append(_label(frame))
+            awaited = getattr(awaited, "cr_await", None) or getattr(awaited, "gi_yieldfrom", None)
+        return tuple(stack)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.samples.items()))
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that ask for it or are sampled
+
+    A request is profiled when its X-Profile header carries a valid
+    signature for its method and path (see ``sign_profile_request``) or,
+    with ``sample_rate``, at random. Profiles are written to ``directory``
+    and named in the X-Profile-Id response header; signed requests sending
+    ``X-Profile-Output: inline`` get the profile as the response body
+    instead, with the original status and wall time in X-Profiled-Status
+    and X-Profiled-Duration-Ms. Requests shorter than ``interval`` may
+    produce an empty profile.
+    """
+
+    def __init__(
+        self,
+        app,
+        secret: str = "",
+        sample_rate: float = 0.0,
+        directory: Optional[str] = None,
+        interval: float = 0.005,
+        max_concurrent: int = 1,
+        exempt: Tuple[str, ...] = ("/api/health", "/api/metrics"),
+    ):
+        self.app = app
+        self.secret = secret
+        self.directory = Path(directory) if directory else None
+        # Sampled profiles have no client to return them to
+        self.sample_rate = sample_rate if self.directory else 0.0
+        self.interval = interval
+        self.max_concurrent = max_concurrent
+        self.exempt = exempt
+        self.active = 0
+        if sample_rate and not self.directory:
+            logger.warning("PROFILE_SAMPLE_RATE needs PROFILE_DIR; request sampling is off")
+
+    def _requested(self, scope) -> Tuple[bool, bool]:
+        """(profile, inline) for a request"""
+        if self.secret:
+            headers = dict(scope["headers"])
+            token = headers.get(PROFILE_HEADER)
+            if token and verify_profile_token(self.secret, token.decode("latin-1"), scope["method"], scope["path"]):
+                return True, headers.get(PROFILE_OUTPUT_HEADER) == b"inline" or self.directory is None
+        return bool(self.sample_rate) and random.random() < self.sample_rate, False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+        profile, inline = self._requested(scope)
+        if not profile or self.active >= self.max_concurrent:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{int(time.time() * 1000)}-{scope['method']}-{uuid.uuid4().hex[:8]}"
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if inline:
+                    return
+                if self.directory is not None:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            elif inline:
+                return
+            await send(message)
+
+        sampler = AsyncStackSampler(asyncio.current_task(), self.interval)
+        self.active += 1
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            self.active -= 1
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        collapsed = sampler.collapsed()
+        logger.info(f"Profiled {scope['method']} {scope['path']} ({status}, {elapsed_ms:.1f} ms) as {profile_id}")
+
+        if inline:
+            body = collapsed.encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"x-profiled-status", str(status).encode()),
+                    (b"x-profiled-duration-ms", f"{elapsed_ms:.1f}".encode()),
+                    (b"x-profile-id", profile_id.encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+        else:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            await asyncio.to_thread((self.directory / f"{profile_id}.collapsed").write_text, collapsed)
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Print an X-Profile header value for one request")
+    parser.add_argument("method")
+    parser.add_argument("path", help="request path without the query string, e.g. /api/habit-stacks/<id>")
+    parser.add_argument("--ttl", type=float, default=300, help="seconds the header stays valid")
+    args = parser.parse_args()
+    print(sign_profile_request(os.environ["PROFILE_SECRET"], args.method, args.path, args.ttl))
@@ -0,0 +1,172 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Base-62 digits in ASCII order, so ranks compare correctly as plain strings
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+_INDEX = {digit: i for i, digit in enumerate(DIGITS)}
+
+# Slot ranks are fixed-width encodings of a nanosecond clock
+SLOT_WIDTH = 11
+
+# Ranks longer than this trigger a background rebalance of the stack
+MAX_RANK_LENGTH = 24
+
+_slot_lock = threading.Lock()
+_last_slot = 0
+
+
+def _encode(value: int) -> str:
+    digits = []
+    for _ in range(SLOT_WIDTH):
+        value, remainder = divmod(value, BASE)
+        digits.append(DIGITS[remainder])
+    rank = "".join(reversed(digits))
+    # Ranks never end in "0", which guarantees there is room below every rank
+    return rank + "1" if rank.endswith("0") else rank
+
+
+def _slot(rank: str) -> int:
+    """The clock value of a rank's slot-width prefix"""
+    value = 0
+    for digit in rank[:SLOT_WIDTH].ljust(SLOT_WIDTH, "0"):
+        value = value * BASE + _INDEX[digit]
+    return value
+
+
+def slot_ranks(count: int) -> List[str]:
+    """Reserve ``count`` increasing ranks that sort after every rank issued so far
+
+    Ranks come from a nanosecond clock, so appends from different workers
+    land after existing habits without reading the stack first, as long as
+    the workers' clocks agree. A rank from a clock that is ahead (another
+    host's, or this one's before it stepped back) can still sort after new
+    ones; ``ahead_of_clock`` detects that and ``observe_rank`` moves this
+    worker's clock past it.
+    """
+    global _last_slot
+    with _slot_lock:
+        start = max(time.time_ns(), _last_slot + 1)
+        _last_slot = start + count - 1
+    return [_encode(start + i) for i in range(count)]
+
+
+def ahead_of_clock(rank: str) -> bool:
+    """Whether ``rank`` sorts after every slot rank this worker would issue now"""
+    return _slot(rank) > max(time.time_ns(), _last_slot)
+
+
+def observe_rank(rank: str) -> None:
+    """Make later slot ranks of this worker sort after ``rank``"""
+    global _last_slot
+    with _slot_lock:
+        _last_slot = max(_last_slot, _slot(rank))
+
+
+def rank_between(before: Optional[str], after: Optional[str]) -> str:
+    """Return a rank strictly between ``before`` and ``after`` (None means open)
+
+    With no upper bound the rank keeps the slot-width prefix of ``before``
+    and only grows its tail, so it still sorts before every slot rank
+    issued later.
+    """
+    low = before or ""
+    if after is None:
+        head = low[:SLOT_WIDTH].ljust(SLOT_WIDTH, "0")
+        return head + _midpoint(low[SLOT_WIDTH:], None)
+    if not low < after:
+        raise ValueError(f"Invalid rank interval: {before!r} >= {after!r}")
+    return _midpoint(low, after)
+
+
+def _midpoint(low: str, high: Optional[str]) -> str:
+    if high is not None:
+        # Copy the shared prefix, treating missing low digits as "0"
+        n = 0
+        while n < len(high) and (low[n] if n < len(low) else "0") == high[n]:
+            n += 1
+        if n > 0:
+            return high[:n] + _midpoint(low[n:], high[n:])
+    low_digit = _INDEX[low[0]] if low else 0
+    high_digit = _INDEX[high[0]] if high is not None else BASE
+    if high_digit - low_digit > 1:
+        return DIGITS[(low_digit + high_digit) // 2]
+    if high is not None and len(high) > 1:
+        return high[0]
+    return DIGITS[low_digit] + _midpoint(low[1:], None)
+
+
+def assign_ranks(habits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Give habits fresh ranks following their list order"""
+    return [{**habit, "rank": rank} for habit, rank in zip(habits, slot_ranks(len(habits)))]
+
+
+def habit_key(habit: Dict[str, Any]) -> Tuple[str, int, str]:
+    """Total order of a stack's habits: rank, then the stored ``order``, then id
+
+    Agrees with ``order_habits`` whenever unranked habits' ``order`` follows
+    their array order, and has no ties, so it can key habit cursors.
+    """
+    return habit.get("rank") or "", habit.get("order", 0), habit["id"]
+
+
+def _sort_key(habit: Dict[str, Any]) -> str:
+    # Habits stored before ranks existed sort first, in array order
+    return habit.get("rank") or ""
+
+
+def order_habits(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Present a stack with habits sorted by rank and ``order`` matching position
+
+    Moves only rewrite one habit's rank, so the stored array may be out of
+    order. Stacks that are already in order are returned untouched.
+    """
+    habits = doc.get("habits")
+    if not habits:
+        return doc
+    keys = [_sort_key(habit) for habit in habits]
+    if all(keys[i] <= keys[i + 1] for i in range(len(keys) - 1)) and all(
+        habit.get("order") == i for i, habit in enumerate(habits)
+    ):
+        return doc
+    ordered = sorted(habits, key=_sort_key)
+    return {**doc, "habits": [{**habit, "order": i} for i, habit in enumerate(ordered)]}
+
+
+def plan_move(
+    habits: List[Dict[str, Any]],
+    habit_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+) -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+    """Work out the rank placing ``habit_id`` right before ``before`` or right after ``after``
+
+    Returns ``(rank, None)`` when only the moved habit has to change. If the
+    stack has unranked habits or tied neighbours every habit is re-ranked,
+    and the full list to write is returned as well. Raises KeyError with
+    the id of a habit that is not in the stack.
+    """
+    ordered = order_habits({"habits": habits})["habits"]
+    ids = {habit["id"] for habit in ordered}
+    for wanted in (habit_id, before, after):
+        if wanted is not None and wanted not in ids:
+            raise KeyError(wanted)
+
+    moved = next(habit for habit in ordered if habit["id"] == habit_id)
+    rest = [habit for habit in ordered if habit["id"] != habit_id]
+    anchor = before if before is not None else after
+    index = next(i for i, habit in enumerate(rest) if habit["id"] == anchor)
+    if before is None:
+        index += 1
+
+    if all(habit.get("rank") for habit in ordered):
+        low = rest[index - 1]["rank"] if index > 0 else None
+        high = rest[index]["rank"] if index < len(rest) else None
+        try:
+            return rank_between(low, high), None
+        except ValueError:
+            pass
+    rest.insert(index, moved)
+    reranked = [{**habit, "order": i} for i, habit in enumerate(assign_ranks(rest))]
+    return reranked[index]["rank"], reranked
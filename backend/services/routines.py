@@ -0,0 +1,34 @@
+import hashlib
+from pathlib import Path
+from typing import List, NamedTuple, Union
+
+from pydantic import TypeAdapter
+
+from models.habit_stack import PredefinedRoutine
+from services.serialization import WireBodies, preencode
+
+DEFAULT_CATALOG_PATH = Path(__file__).parent.parent / "data" / "predefined_routines.json"
+
+_routines_adapter = TypeAdapter(List[PredefinedRoutine])
+
+
+class RoutineCatalog(NamedTuple):
+    routines: List[PredefinedRoutine]
+    body: bytes
+    # ``body`` in every negotiable wire format, for PreencodedResponse
+    bodies: WireBodies
+    etag: str
+
+
+def load_routine_catalog(path: Union[str, Path] = DEFAULT_CATALOG_PATH) -> RoutineCatalog:
+    """Load, validate and pre-serialize the predefined routines catalog
+
+    Validation and encoding (JSON, MessagePack, gzip) happen once here;
+    requests are served the resulting bytes as-is.
+    """
+    raw = Path(path).read_bytes()
+    routines = _routines_adapter.validate_json(raw)
+    body = _routines_adapter.dump_json(routines)
+    bodies = preencode(_routines_adapter.dump_python(routines, mode="json"))
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    return RoutineCatalog(routines=routines, body=body, bodies=bodies, etag=etag)
@@ -0,0 +1,71 @@
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Matches in the stack name count more than matches in habit names
+SEARCH_WEIGHTS = {"name": 3, "habits.name": 1}
+
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+# Fields returned for each hit unless the client asks for others
+SEARCH_FIELDS = ["id", "name", "updated_at"]
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def term_weights(doc: Dict[str, Any]) -> Counter:
+    """Weighted term frequencies of a stack's searchable text"""
+    weights = Counter()
+    for token in tokenize(doc.get("name", "")):
+        weights[token] += SEARCH_WEIGHTS["name"]
+    for habit in doc.get("habits", []):
+        for token in tokenize(habit.get("name", "")):
+            weights[token] += SEARCH_WEIGHTS["habits.name"]
+    return weights
+
+
+def after_score(score: float, stack_id: str, after: Optional[Tuple[float, str]]) -> bool:
+    """Whether a hit sorts after the (score, id) position of the previous page"""
+    if after is None:
+        return True
+    last_score, last_id = after
+    return score < last_score or (score == last_score and stack_id > last_id)
+
+
+class InvertedIndex:
+    """Term postings for the embedded engine, updated on every write
+
+    A query only visits the postings of its own terms, so its cost depends on
+    how many stacks match rather than on the size of the collection.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._terms: Dict[str, Counter] = {}
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        self.remove(doc["id"])
+        weights = term_weights(doc)
+        self._terms[doc["id"]] = weights
+        for term, weight in weights.items():
+            self._postings[term][doc["id"]] = weight
+
+    def remove(self, stack_id: str) -> None:
+        for term in self._terms.pop(stack_id, ()):
+            postings = self._postings[term]
+            postings.pop(stack_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query: str) -> Dict[str, float]:
+        """Return a relevance score for every stack matching any query term"""
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            for stack_id, weight in self._postings.get(term, {}).items():
+                scores[stack_id] += weight
+        return scores
@@ -0,0 +1,190 @@
+import gzip
+import json
+import os
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from fastapi import Response
+
+from models.habit_stack import HabitStack
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - JSON only
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Negotiated responses at least this many bytes are gzip-compressed for
+# clients that accept it; GZIP_MIN_SIZE=0 disables compression. Level 1
+# costs half the CPU of level 6 for a few percent more bytes
+# (benchmarks/bench_wire_format.py)
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '1'))
+
+# (media type, gzip accepted) for the current request
+_wire_format: ContextVar[Tuple[str, bool]] = ContextVar("wire_format", default=(JSON_MEDIA_TYPE, False))
+
+# Query projection matching the HabitStack response shape, without ``_id``
+STACK_PROJECTION = {"_id": 0, **{field: 1 for field in HabitStack.model_fields}}
+
+
+def _default(value: Any):
+    # Matches pydantic's ISO 8601 output for naive datetimes
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode trusted data (e.g. documents read back from MongoDB) to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+def packb(content: Any) -> bytes:
+    """Encode trusted data to MessagePack, with datetimes as the same strings JSON uses"""
+    return msgpack.packb(content, default=_default, use_bin_type=True, datetime=False)
+
+
+def encode(content: Any, media_type: str) -> bytes:
+    if media_type == JSON_MEDIA_TYPE:
+        return dumps(content)
+    return packb(content)
+
+
+def _qualities(header: str) -> Iterator[Tuple[str, float]]:
+    """Parse an Accept-style header into (value, q) pairs"""
+    for part in header.split(","):
+        value, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, number = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        yield value.strip().lower(), quality
+
+
+def negotiate(accept: str, accept_encoding: str) -> Tuple[str, bool]:
+    """Pick the response media type and whether gzip is accepted
+
+    MessagePack is only chosen when the client names it explicitly and
+    does not prefer JSON; everything else gets JSON.
+    """
+    media_type = JSON_MEDIA_TYPE
+    if msgpack is not None and accept:
+        qualities = dict(_qualities(accept))
+        msgpack_quality = max(qualities.get(name, 0.0) for name in MSGPACK_MEDIA_TYPES)
+        if msgpack_quality > 0 and msgpack_quality >= qualities.get(JSON_MEDIA_TYPE, 0.0):
+            media_type = MSGPACK_MEDIA_TYPES[0]
+    gzip_ok = False
+    if GZIP_MIN_SIZE > 0 and accept_encoding:
+        encodings = dict(_qualities(accept_encoding))
+        gzip_ok = encodings.get("gzip", encodings.get("*", 0.0)) > 0
+    return media_type, gzip_ok
+
+
+class NegotiatedResponse(Response):
+    """Response encoded in the format ContentNegotiationMiddleware picked
+
+    Used as the app's default response class, so ``response_model`` routes
+    and ``json_response`` fast paths share it. Bodies of at least
+    ``GZIP_MIN_SIZE`` bytes are gzip-compressed when the client accepts it.
+    """
+
+    media_type = JSON_MEDIA_TYPE
+
+    def __init__(self, content: Any = None, status_code: int = 200, headers=None, media_type=None, background=None):
+        self.media_type, self._gzip = _wire_format.get()
+        self._compressed = False
+        super().__init__(content, status_code, headers, self.media_type, background)
+        self.headers["vary"] = "Accept, Accept-Encoding"
+        if self._compressed:
+            self.headers["content-encoding"] = "gzip"
+        if self.media_type != JSON_MEDIA_TYPE or self._compressed:
+            # Other encodings of the same document are only weakly equal
+            etag = self.headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                self.headers["etag"] = f"W/{etag}"
+
+    def render(self, content: Any) -> bytes:
+        body = encode(content, self.media_type)
+        if self._gzip and len(body) >= GZIP_MIN_SIZE:
+            body = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            self._compressed = True
+        return body
+
+
+WireBodies = Dict[Tuple[str, bool], bytes]
+
+
+def preencode(content: Any) -> WireBodies:
+    """Encode ``content`` once for every (media type, gzip accepted) a request can negotiate"""
+    media_types = (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPES[0]) if msgpack is not None else (JSON_MEDIA_TYPE,)
+    bodies = {}
+    for media_type in media_types:
+        body = encode(content, media_type)
+        bodies[(media_type, False)] = body
+        if GZIP_MIN_SIZE > 0 and len(body) >= GZIP_MIN_SIZE:
+            body = gzip.compress(body, GZIP_LEVEL, mtime=0)
+        bodies[(media_type, True)] = body
+    return bodies
+
+
+class PreencodedResponse(NegotiatedResponse):
+    """NegotiatedResponse serving bodies built ahead of time by ``preencode``
+
+    For content that never changes, so requests skip encoding and
+    compression while still getting the negotiated format.
+    """
+
+    def render(self, content: WireBodies) -> bytes:
+        body = content[(self.media_type, self._gzip)]
+        self._compressed = body is not content[(self.media_type, False)]
+        return body
+
+
+def json_response(content: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Build a negotiated response without running it through ``response_model``
+
+    Documents are encoded straight from storage, so they are not copied
+    into models first.
+    """
+    return NegotiatedResponse(content, headers=headers)
+
+
+class ContentNegotiationMiddleware:
+    """ASGI middleware recording the client's Accept and Accept-Encoding choice
+
+    NegotiatedResponse reads it when encoding, so endpoints need no changes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept":
+                accept = value.decode("latin-1")
+            elif name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        token = _wire_format.set(negotiate(accept, accept_encoding))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _wire_format.reset(token)
@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# Check-ins are stored per day as ISO strings, which sort chronologically
+
+
+def previous_day(day: str) -> str:
+    return (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+
+def next_day(day: str) -> str:
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def run_length(start: str, end: str) -> int:
+    """Days from ``start`` to ``end``, both included"""
+    return (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+
+
+def month_bucket(day: str) -> str:
+    """Check-ins are bucketed by habit and month"""
+    return day[:7]
+
+
+def empty_summary() -> Dict[str, Any]:
+    return {"completions": 0, "current_streak": 0, "longest_streak": 0, "last_day": None}
+
+
+def advance(summary: Optional[Dict[str, Any]], day: str) -> Tuple[Dict[str, Any], bool]:
+    """Apply a new check-in on ``day`` to a streak summary
+
+    Returns the updated summary and whether ``day`` predates the last
+    check-in, in which case the streaks must be recomputed from history.
+    """
+    summary = dict(summary or empty_summary())
+    last_day = summary["last_day"]
+    backfill = last_day is not None and day < last_day
+    summary["completions"] += 1
+    if last_day is None or not day <= last_day:
+        extends = last_day == previous_day(day)
+        summary["current_streak"] = summary["current_streak"] + 1 if extends else 1
+        summary["last_day"] = day
+    summary["longest_streak"] = max(summary["longest_streak"], summary["current_streak"])
+    return summary, backfill
+
+
+def summarize(days: Iterable[str], completions: int) -> Dict[str, Any]:
+    """Compute a streak summary from the full set of check-in days"""
+    summary = empty_summary()
+    streak = 0
+    for day in sorted(set(days)):
+        streak = streak + 1 if summary["last_day"] == previous_day(day) else 1
+        summary["longest_streak"] = max(summary["longest_streak"], streak)
+        summary["last_day"] = day
+    summary["current_streak"] = streak
+    summary["completions"] = completions
+    return summary
+
+
+def as_of(summary: Optional[Dict[str, Any]], today: date) -> Dict[str, Any]:
+    """Report a summary's current streak as broken once a whole day was missed"""
+    summary = dict(summary or empty_summary())
+    last_day = summary["last_day"]
+    if last_day is None or date.fromisoformat(last_day) < today - timedelta(days=1):
+        summary["current_streak"] = 0
+    return summary
@@ -0,0 +1,247 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from services.ranking import habit_key
+
+# Documents are plain dicts shaped like ``HabitStack``. Engines never return
+# engine specific fields such as MongoDB's ``_id``.
+StackDoc = Dict[str, Any]
+
+# Owner given to stacks stored before stacks had owners
+LEGACY_USER_ID = os.environ.get('LEGACY_USER_ID', 'default')
+
+
+class HabitOp(NamedTuple):
+    """A habit push or pull, as queued by the write coalescer"""
+
+    kind: str  # "push" or "pull"
+    user_id: str
+    stack_id: str
+    updated_at: datetime
+    habit: Optional[Dict[str, Any]] = None
+    habit_id: Optional[str] = None
+
+
+class StackStore(ABC):
+    """Storage operations the habit stack routes rely on
+
+    Every stack belongs to a user (its ``user_id``). Stack operations take
+    the owner first and treat other users' stacks as missing; check-ins
+    hang off a stack, so routes check its owner before touching them.
+    """
+
+    name = "base"
+
+    async def initialize(self) -> None:
+        """Prepare the engine (indexes, journal replay, ...) before serving"""
+
+    async def close(self) -> None:
+        """Release connections and files held by the engine"""
+
+    async def warm_up(self, connections: int) -> None:
+        """Open connections ahead of the first requests"""
+
+    async def ping(self) -> None:
+        """Raise if the engine cannot currently serve requests"""
+
+    async def check_query_plans(self) -> Dict[str, List[str]]:
+        """Verify the engine's query plans; engines without a planner have none"""
+        return {}
+
+    async def migrate(self) -> int:
+        """Convert stored data to the engine's layout while serving; returns the stacks converted"""
+        return 0
+
+    def is_overloaded(self, error: Exception) -> bool:
+        """Whether ``error`` means the engine is saturated or unreachable rather than broken"""
+        return False
+
+    # Stacks
+
+    @abstractmethod
+    async def list_stacks(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[Tuple[datetime, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        """Return up to ``limit`` of a user's stacks ordered by (updated_at, id) descending
+
+        ``after`` is the (updated_at, id) of the last stack of the previous
+        page. With ``fields``, only those fields plus ``id`` and
+        ``updated_at`` are returned.
+        """
+
+    @abstractmethod
+    async def search_stacks(
+        self,
+        user_id: str,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        """Return up to ``limit`` of a user's stacks whose name or habit names match ``query``
+
+        Hits carry a relevance ``score`` and are ordered by (score descending,
+        id ascending); ``after`` is the (score, id) of the previous page's last
+        hit. With ``fields``, only those fields plus ``id`` and ``score`` are
+        returned.
+        """
+
+    @abstractmethod
+    async def get_stack(self, user_id: str, stack_id: str, fields: Optional[List[str]] = None) -> Optional[StackDoc]:
+        """Return one stack, or None if it does not exist"""
+
+    @abstractmethod
+    def iter_stacks(self, user_id: str, batch_size: int) -> AsyncIterator[StackDoc]:
+        """Iterate over every stack of a user, fetching ``batch_size`` at a time"""
+
+    @abstractmethod
+    async def insert_stacks(self, docs: Sequence[StackDoc]) -> Dict[int, str]:
+        """Insert stacks independently and return errors keyed by position
+
+        Each document carries its owner's ``user_id``.
+        """
+
+    @abstractmethod
+    async def update_stack(
+        self, user_id: str, stack_id: str, changes: Dict[str, Any], expected_updated_at: Optional[datetime] = None
+    ) -> Optional[StackDoc]:
+        """Set top-level fields and return the updated stack, or None if missing
+
+        With ``expected_updated_at`` the write only applies if the stack was
+        not modified since then, and None is also returned on a conflict.
+        """
+
+    @abstractmethod
+    async def update_stacks(self, user_id: str, updates: Sequence[Tuple[str, Dict[str, Any]]]) -> Dict[str, str]:
+        """Apply ``(stack_id, changes)`` pairs and return errors keyed by stack id"""
+
+    @abstractmethod
+    async def delete_stacks(self, user_id: str, stack_ids: Sequence[str]) -> Set[str]:
+        """Delete stacks and return the ids that existed"""
+
+    # Habits
+
+    @abstractmethod
+    async def push_habit(self, user_id: str, stack_id: str, habit: Dict[str, Any], updated_at: datetime) -> Optional[StackDoc]:
+        """Append a habit and return the updated stack, or None if the stack is missing"""
+
+    @abstractmethod
+    async def update_habit(
+        self,
+        user_id: str,
+        stack_id: str,
+        habit_id: str,
+        changes: Dict[str, Any],
+        updated_at: datetime,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Optional[StackDoc]:
+        """Update one habit in place, returning None if the stack or habit is missing
+
+        ``expected_updated_at`` works as for ``update_stack``.
+        """
+
+    @abstractmethod
+    async def pull_habit(self, user_id: str, stack_id: str, habit_id: str, updated_at: datetime) -> Optional[bool]:
+        """Remove a habit; None if the stack is missing, False if the habit is"""
+
+    async def apply_habit_ops(self, ops: Sequence[HabitOp]) -> List[Any]:
+        """Apply pushes and pulls in order and return each one's result
+
+        Results are what ``push_habit`` and ``pull_habit`` would return.
+        Engines may merge the operations into fewer writes. This default
+        applies each stack's operations one by one, and different stacks
+        concurrently.
+        """
+        by_stack: Dict[Tuple[str, str], List[int]] = {}
+        for position, op in enumerate(ops):
+            by_stack.setdefault((op.user_id, op.stack_id), []).append(position)
+        results: List[Any] = [None] * len(ops)
+
+        async def apply_stack(positions: List[int]) -> None:
+            for position in positions:
+                op = ops[position]
+                if op.kind == "push":
+                    results[position] = await self.push_habit(op.user_id, op.stack_id, op.habit, op.updated_at)
+                else:
+                    results[position] = await self.pull_habit(op.user_id, op.stack_id, op.habit_id, op.updated_at)
+
+        await asyncio.gather(*(apply_stack(positions) for positions in by_stack.values()))
+        return results
+
+    async def has_habit(self, user_id: str, stack_id: str, habit_id: str) -> Optional[bool]:
+        """Whether the stack holds the habit; None if the stack is missing"""
+        doc = await self.get_stack(user_id, stack_id, ["habits"])
+        if doc is None:
+            return None
+        return any(habit["id"] == habit_id for habit in doc["habits"])
+
+    async def list_habits(
+        self, user_id: str, stack_id: str, limit: int, after: Optional[Tuple[str, int, str]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """A page of a stack's habits in ``habit_key`` order, after the key ``after``
+
+        Returns None if the stack is missing. This default reads the whole
+        stack; engines storing habits separately read only the page.
+        """
+        doc = await self.get_stack(user_id, stack_id, ["habits"])
+        if doc is None:
+            return None
+        habits = sorted(doc["habits"], key=habit_key)
+        start = bisect_right(habits, after, key=habit_key) if after else 0
+        return habits[start:start + limit]
+
+    # Check-ins
+
+    @abstractmethod
+    async def add_check_in(
+        self, stack_id: str, habit_id: str, day: str
+    ) -> Tuple[bool, Dict[str, Any], Dict[str, Any]]:
+        """Record that a habit was done on ``day`` (YYYY-MM-DD) and update its streaks
+
+        Returns whether the check-in was new, then the habit's and the
+        stack's streak summaries after it. Summaries are updated as part
+        of the check-in, so reading them never scans the history. Engines
+        that cannot write the check-in and its summaries atomically must
+        make repeating a check-in complete any summary update a failed
+        attempt left out.
+        """
+
+    @abstractmethod
+    async def get_streaks(self, stack_id: str) -> Dict[Optional[str], Dict[str, Any]]:
+        """Return a stack's streak summaries keyed by habit id, with None for the stack"""
+
+    @abstractmethod
+    async def list_check_ins(self, stack_id: str, habit_id: str, start: str, end: str) -> List[str]:
+        """Return the days between ``start`` and ``end`` (inclusive) a habit was done"""
+
+    @abstractmethod
+    async def list_stack_check_ins(self, stack_id: str, start: str, end: str) -> Dict[str, List[str]]:
+        """Return check-in days between ``start`` and ``end`` for every habit of a stack"""
+
+    # Change tracking
+
+    @abstractmethod
+    async def get_version(self, user_id: str) -> str:
+        """Return an opaque token that changes whenever any of a user's stacks changes"""
+
+    @abstractmethod
+    async def bump_version(self, user_id: str) -> None:
+        """Record that a user's stacks changed; must run after the write it describes"""
+
+    # Legacy status checks
+
+    @abstractmethod
+    async def add_status_check(self, doc: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    async def list_status_checks(self, limit: int) -> List[Dict[str, Any]]:
+        pass
@@ -0,0 +1,386 @@
+import heapq
+import json
+import logging
+import os
+import uuid
+from bisect import bisect_left, insort
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from services.pagination import CURSOR_FIELDS
+from services.search import SEARCH_FIELDS, InvertedIndex, after_score
+from services.streaks import advance, empty_summary, summarize
+from storage.base import LEGACY_USER_ID, StackDoc, StackStore
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value: Any):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj: Dict[str, Any]):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def _copy(doc: StackDoc, fields: Optional[Sequence[str]] = None) -> StackDoc:
+    """Copy a stored document deep enough that callers cannot mutate the store"""
+    keys = fields if fields is not None else doc.keys()
+    copied = {key: doc[key] for key in keys if key in doc}
+    if "habits" in copied:
+        copied["habits"] = [dict(habit) for habit in copied["habits"]]
+    return copied
+
+
+class Journal:
+    """Append-only JSON lines journal of whole-document writes
+
+    Every record is a full ``put`` or a ``del``, so replaying the journal is
+    idempotent and a torn final line (from a crash mid-write) can simply be
+    dropped.
+    """
+
+    def __init__(self, path: Union[str, Path], fsync: bool = False):
+        self.path = Path(path)
+        self.fsync = fsync
+        self.records = 0
+        self._file = None
+
+    def replay(self):
+        if not self.path.exists():
+            return
+        valid_bytes = 0
+        with self.path.open("rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated record")
+                    record = json.loads(line, object_hook=_decode)
+                except ValueError:
+                    logger.warning(f"Dropping torn record at the end of {self.path}")
+                    break
+                valid_bytes += len(line)
+                self.records += 1
+                yield record
+        # Cut off the torn tail so new records start on a clean line
+        if valid_bytes < self.path.stat().st_size:
+            with self.path.open("r+b") as f:
+                f.truncate(valid_bytes)
+
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("a", encoding="utf-8")
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(record, default=_encode, separators=(",", ":")) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records += 1
+
+    def rewrite(self, records: List[Dict[str, Any]]) -> None:
+        """Atomically replace the journal with a compacted set of records"""
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, default=_encode, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.records = len(records)
+        self.open()
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class EmbeddedStackStore(StackStore):
+    """In-process engine for single-node deployments
+
+    Stacks live in a dict, with a sorted (updated_at, id) listing index and
+    a search index per user.
+    With ``journal_path`` every write is appended to a journal that is
+    replayed on startup and compacted once it holds ``compact_ratio`` times
+    more records than live documents. State is per process, so run a single
+    worker with this engine.
+    """
+
+    name = "embedded"
+
+    def __init__(
+        self,
+        journal_path: Optional[Union[str, Path]] = None,
+        fsync: bool = False,
+        compact_ratio: float = 4.0,
+    ):
+        self._stacks: Dict[str, StackDoc] = {}
+        # Per user: (updated_at, id) of their stacks, oldest first, and a search index
+        self._order: Dict[str, List[Tuple[datetime, str]]] = {}
+        self._search: Dict[str, InvertedIndex] = {}
+        self._status_checks: List[Dict[str, Any]] = []
+        # Check-in days per stack and habit, and the streak summaries they feed
+        self._check_ins: Dict[str, Dict[str, Set[str]]] = {}
+        self._summaries: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+        self._check_in_count = 0
+        # A fresh epoch per process keeps versions unique across restarts
+        self._epoch = uuid.uuid4().hex[:8]
+        self._versions: Dict[str, int] = {}
+        self._journal = Journal(journal_path, fsync=fsync) if journal_path else None
+        self._compact_ratio = compact_ratio
+
+    async def initialize(self) -> None:
+        if not self._journal:
+            return
+        for record in self._journal.replay():
+            self._apply(record)
+        self._journal.open()
+        logger.info(f"Embedded store loaded {len(self._stacks)} stacks from {self._journal.path}")
+
+    async def close(self) -> None:
+        if self._journal:
+            self._journal.close()
+
+    # Internal state changes; every write goes through _write
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        op = record["op"]
+        if op == "put":
+            self._put(record["doc"])
+        elif op == "del":
+            self._delete(record["id"])
+        elif op == "status":
+            self._status_checks.append(record["doc"])
+        elif op == "check_in":
+            self._check_in(record["stack_id"], record["habit_id"], record["day"])
+        elif op == "del_check_ins":
+            self._delete_check_ins(record["stack_id"], record["habit_id"])
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._apply(record)
+        if self._journal:
+            self._journal.append(record)
+            live = len(self._stacks) + len(self._status_checks) + self._check_in_count
+            if self._journal.records > self._compact_ratio * max(live, 1000):
+                self._compact()
+
+    def _compact(self) -> None:
+        records = [{"op": "put", "doc": doc} for doc in self._stacks.values()]
+        records += [{"op": "status", "doc": doc} for doc in self._status_checks]
+        records += [
+            {"op": "check_in", "stack_id": stack_id, "habit_id": habit_id, "day": day}
+            for stack_id, habits in self._check_ins.items()
+            for habit_id, days in habits.items()
+            for day in sorted(days)
+        ]
+        self._journal.rewrite(records)
+
+    def _put(self, doc: StackDoc) -> None:
+        # Journals written before stacks had owners
+        user_id = doc.setdefault("user_id", LEGACY_USER_ID)
+        previous = self._stacks.get(doc["id"])
+        if previous is not None:
+            self._unindex(previous)
+        self._stacks[doc["id"]] = doc
+        insort(self._order.setdefault(user_id, []), (doc["updated_at"], doc["id"]))
+        self._search.setdefault(user_id, InvertedIndex()).add(doc)
+
+    def _delete(self, stack_id: str) -> None:
+        doc = self._stacks.pop(stack_id, None)
+        if doc is not None:
+            self._unindex(doc)
+            self._search[doc["user_id"]].remove(stack_id)
+        for habit_id in list(self._check_ins.get(stack_id, ())):
+            self._delete_check_ins(stack_id, habit_id)
+        self._check_ins.pop(stack_id, None)
+        self._summaries.pop((stack_id, None), None)
+
+    def _delete_check_ins(self, stack_id: str, habit_id: str) -> None:
+        self._check_in_count -= len(self._check_ins.get(stack_id, {}).pop(habit_id, ()))
+        self._summaries.pop((stack_id, habit_id), None)
+
+    def _check_in(self, stack_id: str, habit_id: str, day: str) -> None:
+        habits = self._check_ins.setdefault(stack_id, {})
+        habits.setdefault(habit_id, set()).add(day)
+        self._check_in_count += 1
+        for key in ((stack_id, habit_id), (stack_id, None)):
+            summary, backfill = advance(self._summaries.get(key), day)
+            if backfill:
+                days = habits[habit_id] if key[1] else set().union(*habits.values())
+                summary = summarize(days, summary["completions"])
+            self._summaries[key] = summary
+
+    def _unindex(self, doc: StackDoc) -> None:
+        order = self._order[doc["user_id"]]
+        key = (doc["updated_at"], doc["id"])
+        position = bisect_left(order, key)
+        if position < len(order) and order[position] == key:
+            del order[position]
+
+    def _owned(self, user_id: str, stack_id: str) -> Optional[StackDoc]:
+        doc = self._stacks.get(stack_id)
+        return doc if doc is not None and doc["user_id"] == user_id else None
+
+    # StackStore
+
+    async def list_stacks(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[Tuple[datetime, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        order = self._order.get(user_id, [])
+        end = bisect_left(order, after) if after else len(order)
+        keys = order[max(end - limit, 0):end]
+        projection = list(dict.fromkeys((*CURSOR_FIELDS, *fields))) if fields else None
+        return [_copy(self._stacks[stack_id], projection) for _, stack_id in reversed(keys)]
+
+    async def search_stacks(
+        self,
+        user_id: str,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        index = self._search.get(user_id)
+        if index is None:
+            return []
+        hits = [
+            (score, stack_id) for stack_id, score in index.search(query).items()
+            if after_score(score, stack_id, after)
+        ]
+        projection = list(dict.fromkeys(("id", *(fields or SEARCH_FIELDS))))
+        return [
+            {**_copy(self._stacks[stack_id], projection), "score": score}
+            for score, stack_id in heapq.nsmallest(limit, hits, key=lambda hit: (-hit[0], hit[1]))
+        ]
+
+    async def get_stack(self, user_id: str, stack_id: str, fields: Optional[List[str]] = None) -> Optional[StackDoc]:
+        doc = self._owned(user_id, stack_id)
+        return _copy(doc, fields) if doc is not None else None
+
+    async def iter_stacks(self, user_id: str, batch_size: int) -> AsyncIterator[StackDoc]:
+        for _, stack_id in list(self._order.get(user_id, ())):
+            doc = self._owned(user_id, stack_id)
+            if doc is not None:
+                yield _copy(doc)
+
+    async def insert_stacks(self, docs: Sequence[StackDoc]) -> Dict[int, str]:
+        errors = {}
+        for index, doc in enumerate(docs):
+            if doc["id"] in self._stacks:
+                errors[index] = f"Duplicate stack id: {doc['id']}"
+                continue
+            self._write({"op": "put", "doc": _copy(doc)})
+        return errors
+
+    async def update_stack(
+        self, user_id: str, stack_id: str, changes: Dict[str, Any], expected_updated_at: Optional[datetime] = None
+    ) -> Optional[StackDoc]:
+        doc = self._owned(user_id, stack_id)
+        if doc is None or (expected_updated_at is not None and doc["updated_at"] != expected_updated_at):
+            return None
+        self._write({"op": "put", "doc": _copy({**doc, **changes})})
+        return _copy(self._stacks[stack_id])
+
+    async def update_stacks(self, user_id: str, updates: Sequence[Tuple[str, Dict[str, Any]]]) -> Dict[str, str]:
+        errors = {}
+        for stack_id, changes in updates:
+            if await self.update_stack(user_id, stack_id, changes) is None:
+                errors[stack_id] = "Habit stack not found"
+        return errors
+
+    async def delete_stacks(self, user_id: str, stack_ids: Sequence[str]) -> Set[str]:
+        deleted = set()
+        for stack_id in stack_ids:
+            if self._owned(user_id, stack_id) is not None:
+                self._write({"op": "del", "id": stack_id})
+                deleted.add(stack_id)
+        return deleted
+
+    async def push_habit(self, user_id: str, stack_id: str, habit: Dict[str, Any], updated_at: datetime) -> Optional[StackDoc]:
+        doc = self._owned(user_id, stack_id)
+        if doc is None:
+            return None
+        return await self.update_stack(
+            user_id, stack_id, {"habits": [*doc["habits"], dict(habit)], "updated_at": updated_at}
+        )
+
+    async def update_habit(
+        self,
+        user_id: str,
+        stack_id: str,
+        habit_id: str,
+        changes: Dict[str, Any],
+        updated_at: datetime,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Optional[StackDoc]:
+        doc = self._owned(user_id, stack_id)
+        if doc is None or not any(habit["id"] == habit_id for habit in doc["habits"]):
+            return None
+        habits = [{**habit, **changes} if habit["id"] == habit_id else habit for habit in doc["habits"]]
+        return await self.update_stack(
+            user_id, stack_id, {"habits": habits, "updated_at": updated_at}, expected_updated_at
+        )
+
+    async def pull_habit(self, user_id: str, stack_id: str, habit_id: str, updated_at: datetime) -> Optional[bool]:
+        doc = self._owned(user_id, stack_id)
+        if doc is None:
+            return None
+        habits = [habit for habit in doc["habits"] if habit["id"] != habit_id]
+        if len(habits) == len(doc["habits"]):
+            return False
+        await self.update_stack(user_id, stack_id, {"habits": habits, "updated_at": updated_at})
+        if habit_id in self._check_ins.get(stack_id, ()):
+            self._write({"op": "del_check_ins", "stack_id": stack_id, "habit_id": habit_id})
+        return True
+
+    async def add_check_in(
+        self, stack_id: str, habit_id: str, day: str
+    ) -> Tuple[bool, Dict[str, Any], Dict[str, Any]]:
+        recorded = day not in self._check_ins.get(stack_id, {}).get(habit_id, ())
+        if recorded:
+            self._write({"op": "check_in", "stack_id": stack_id, "habit_id": habit_id, "day": day})
+        return (
+            recorded,
+            dict(self._summaries.get((stack_id, habit_id), empty_summary())),
+            dict(self._summaries.get((stack_id, None), empty_summary())),
+        )
+
+    async def get_streaks(self, stack_id: str) -> Dict[Optional[str], Dict[str, Any]]:
+        return {
+            habit_id: dict(self._summaries[(stack_id, habit_id)])
+            for habit_id in (None, *self._check_ins.get(stack_id, {}))
+            if (stack_id, habit_id) in self._summaries
+        }
+
+    async def list_check_ins(self, stack_id: str, habit_id: str, start: str, end: str) -> List[str]:
+        days = self._check_ins.get(stack_id, {}).get(habit_id, ())
+        return sorted(day for day in days if start <= day <= end)
+
+    async def list_stack_check_ins(self, stack_id: str, start: str, end: str) -> Dict[str, List[str]]:
+        return {
+            habit_id: [day for day in days if start <= day <= end]
+            for habit_id, days in self._check_ins.get(stack_id, {}).items()
+        }
+
+    async def get_version(self, user_id: str) -> str:
+        return f"{self._epoch}-{self._versions.get(user_id, 0)}"
+
+    async def bump_version(self, user_id: str) -> None:
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    async def add_status_check(self, doc: Dict[str, Any]) -> None:
+        self._write({"op": "status", "doc": dict(doc)})
+
+    async def list_status_checks(self, limit: int) -> List[Dict[str, Any]]:
+        return [dict(doc) for doc in self._status_checks[:limit]]
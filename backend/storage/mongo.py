@@ -0,0 +1,583 @@
+import asyncio
+import copy
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout
+
+from services.indexes import check_query_plans, ensure_indexes
+from services.pagination import LIST_SORT, after_filter, build_projection
+from services.search import SEARCH_FIELDS
+from services.streaks import empty_summary, month_bucket, next_day, previous_day, run_length
+from services.serialization import STACK_PROJECTION
+from storage.base import LEGACY_USER_ID, HabitOp, StackDoc, StackStore
+
+# Collection holding change counters, one per user for habit stacks
+VERSIONS_COLLECTION = "collection_versions"
+
+# Append-only check-in days, one document per habit and month
+CHECK_INS_COLLECTION = "check_ins"
+# Streak summaries, one per habit plus one per stack. Completions are kept
+# as ``counts`` of days, per month in a habit's summary and per habit in
+# the stack's, and reported as their sum
+SUMMARIES_COLLECTION = "check_in_summaries"
+
+SUMMARY_PROJECTION = {"_id": 0, "habit_id": 1, "counts": 1, "current_streak": 1, "longest_streak": 1, "last_day": 1}
+
+
+def _summary_id(stack_id: str, habit_id: Optional[str] = None) -> str:
+    return f"{stack_id}|{habit_id}" if habit_id else stack_id
+
+
+def _version_id(user_id: str) -> str:
+    return f"habit_stacks|{user_id}"
+
+
+def _bucket_id(stack_id: str, habit_id: str, month: str) -> str:
+    return f"{stack_id}|{habit_id}|{month}"
+
+
+def _field_key(key: str) -> str:
+    """Escape ``key`` (a habit id, say) for use as one segment of a dotted field path"""
+    return key.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def _summary_fields(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """A stored summary in the shape of ``streaks.empty_summary``"""
+    summary = empty_summary()
+    summary.update({field: doc[field] for field in ("current_streak", "longest_streak", "last_day") if field in doc})
+    summary["completions"] = sum(doc.get("counts", {}).values())
+    return summary
+
+
+def _owned_filter(keys) -> Dict[str, Any]:
+    """Filter matching (user_id, stack_id) pairs, one index range per user"""
+    by_user: Dict[str, List[str]] = {}
+    for user_id, stack_id in keys:
+        by_user.setdefault(user_id, []).append(stack_id)
+    return {"$or": [{"user_id": user_id, "id": {"$in": ids}} for user_id, ids in by_user.items()]}
+
+
+def _search_pipeline(
+    user_id: str, query: str, limit: int, after: Optional[Tuple[float, str]], projection: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Aggregation returning one page of ``$text`` hits, best first
+
+    The keyset cursor is applied before the sort, and the sort is directly
+    followed by the limit, so the server keeps only a top-``limit`` heap of
+    the matches past the cursor instead of sorting all of them. Documents
+    are projected after the limit.
+    """
+    pipeline = [
+        # The text index is prefixed by user_id, which needs an equality match
+        {"$match": {"user_id": user_id, "$text": {"$search": query}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after:
+        score, stack_id = after
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "id": {"$gt": stack_id}},
+        ]}})
+    return pipeline + [
+        {"$sort": {"score": -1, "id": 1}},
+        {"$limit": limit},
+        {"$project": projection},
+    ]
+
+
+def _advance_pipeline(
+    stack_id: str, habit_id: Optional[str], day: str, count_key: str, count: int
+) -> List[Dict[str, Any]]:
+    """Update pipeline applying ``streaks.advance`` to a summary in place
+
+    Instead of adding one to the completions, the check-in raises
+    ``counts.<count_key>`` to ``count``, a total read back from the
+    check-in's bucket. Totals only grow and the streak ignores a day it
+    has seen, so the update can be repeated without counting twice.
+    """
+    count_field = f"counts.{_field_key(count_key)}"
+    return [
+        {"$set": {
+            "stack_id": {"$literal": stack_id},
+            "habit_id": {"$literal": habit_id},
+            count_field: {"$max": [{"$ifNull": [f"${count_field}", 0]}, count]},
+            "current_streak": {"$switch": {
+                "branches": [
+                    # Same day or a backfill: leave the streak alone
+                    {"case": {"$gte": ["$last_day", day]}, "then": "$current_streak"},
+                    {"case": {"$eq": ["$last_day", previous_day(day)]}, "then": {"$add": ["$current_streak", 1]}},
+                ],
+                "default": 1,
+            }},
+            "last_day": {"$max": ["$last_day", day]},
+        }},
+        {"$set": {"longest_streak": {"$max": [{"$ifNull": ["$longest_streak", 0]}, "$current_streak"]}}},
+    ]
+
+
+class MotorStackStore(StackStore):
+    """MongoDB engine backed by a Motor database
+
+    Every stack query filters on ``user_id`` first, matching the
+    ``(user_id, ...)`` indexes and a ``{user_id: 1, id: 1}`` shard key.
+    """
+
+    name = "mongo"
+
+    def __init__(self, database):
+        self.db = database
+
+    async def initialize(self) -> None:
+        await ensure_indexes(self.db)
+
+    async def warm_up(self, connections: int) -> None:
+        # Concurrent pings make the pool open that many connections now
+        await asyncio.gather(*(self.db.command("ping") for _ in range(max(connections, 1))))
+
+    async def ping(self) -> None:
+        await self.db.command("ping")
+
+    async def check_query_plans(self) -> Dict[str, List[str]]:
+        return await check_query_plans(self.db)
+
+    async def migrate(self) -> int:
+        """Give stacks stored before stacks had owners to ``LEGACY_USER_ID``"""
+        # Missing owners are indexed as null, so this reads one index range
+        result = await self.db.habit_stacks.update_many(
+            {"user_id": {"$exists": False}}, {"$set": {"user_id": LEGACY_USER_ID}}
+        )
+        return result.modified_count
+
+    def is_overloaded(self, error: Exception) -> bool:
+        # ConnectionFailure covers pool checkout, server selection and network
+        # timeouts as well as lost connections; ExecutionTimeout is maxTimeMS
+        return isinstance(error, (ConnectionFailure, ExecutionTimeout))
+
+    async def list_stacks(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[Tuple[datetime, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        cursor = self.db.habit_stacks.find({"user_id": user_id, **after_filter(after)}, build_projection(fields))
+        return await cursor.sort(LIST_SORT).limit(limit).to_list(limit)
+
+    async def search_stacks(
+        self,
+        user_id: str,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        projection = {"_id": 0, "id": 1, "score": 1}
+        for field in fields or SEARCH_FIELDS:
+            projection[field] = 1
+        pipeline = _search_pipeline(user_id, query, limit, after, projection)
+        return await self.db.habit_stacks.aggregate(pipeline).to_list(limit)
+
+    async def get_stack(self, user_id: str, stack_id: str, fields: Optional[List[str]] = None) -> Optional[StackDoc]:
+        projection = {"_id": 0, **{field: 1 for field in fields}} if fields else STACK_PROJECTION
+        return await self.db.habit_stacks.find_one({"user_id": user_id, "id": stack_id}, projection)
+
+    async def iter_stacks(self, user_id: str, batch_size: int) -> AsyncIterator[StackDoc]:
+        async for doc in self.db.habit_stacks.find({"user_id": user_id}, STACK_PROJECTION, batch_size=batch_size):
+            yield doc
+
+    async def insert_stacks(self, docs: Sequence[StackDoc]) -> Dict[int, str]:
+        if not docs:
+            return {}
+        try:
+            # insert_many adds _id to the dicts it is given, so pass copies
+            await self.db.habit_stacks.insert_many([dict(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            return {err["index"]: err["errmsg"] for err in e.details.get("writeErrors", [])}
+        return {}
+
+    async def update_stack(
+        self, user_id: str, stack_id: str, changes: Dict[str, Any], expected_updated_at: Optional[datetime] = None
+    ) -> Optional[StackDoc]:
+        query = {"user_id": user_id, "id": stack_id}
+        if expected_updated_at is not None:
+            query["updated_at"] = expected_updated_at
+        return await self.db.habit_stacks.find_one_and_update(
+            query,
+            {"$set": changes},
+            projection=STACK_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def update_stacks(self, user_id: str, updates: Sequence[Tuple[str, Dict[str, Any]]]) -> Dict[str, str]:
+        ids = [stack_id for stack_id, _ in updates]
+        existing = {
+            doc["id"] async for doc in self.db.habit_stacks.find(
+                {"user_id": user_id, "id": {"$in": ids}}, {"_id": 0, "id": 1}
+            )
+        }
+        errors = {stack_id: "Habit stack not found" for stack_id in ids if stack_id not in existing}
+        operations = [
+            UpdateOne({"user_id": user_id, "id": stack_id}, {"$set": changes})
+            for stack_id, changes in updates if stack_id in existing
+        ]
+        operation_ids = [stack_id for stack_id, _ in updates if stack_id in existing]
+        if operations:
+            try:
+                await self.db.habit_stacks.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                for err in e.details.get("writeErrors", []):
+                    errors[operation_ids[err["index"]]] = err["errmsg"]
+        return errors
+
+    async def delete_stacks(self, user_id: str, stack_ids: Sequence[str]) -> Set[str]:
+        if len(stack_ids) == 1:
+            result = await self.db.habit_stacks.delete_one({"user_id": user_id, "id": stack_ids[0]})
+            existing = set(stack_ids) if result.deleted_count else set()
+        else:
+            existing = {
+                doc["id"] async for doc in self.db.habit_stacks.find(
+                    {"user_id": user_id, "id": {"$in": list(stack_ids)}}, {"_id": 0, "id": 1}
+                )
+            }
+            if existing:
+                await self.db.habit_stacks.delete_many({"user_id": user_id, "id": {"$in": list(existing)}})
+        if existing:
+            await self._delete_check_ins([(stack_id, None) for stack_id in existing])
+        return existing
+
+    async def push_habit(self, user_id: str, stack_id: str, habit: Dict[str, Any], updated_at: datetime) -> Optional[StackDoc]:
+        # Append server-side so concurrent additions are never lost
+        return await self.db.habit_stacks.find_one_and_update(
+            {"user_id": user_id, "id": stack_id},
+            {"$push": {"habits": habit}, "$set": {"updated_at": updated_at}},
+            projection=STACK_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def apply_habit_ops(self, ops: Sequence[HabitOp]) -> List[Any]:
+        """Group commit: one write per run of pushes or pulls on a stack
+
+        Consecutive pushes (or pulls) on a stack become a single ``$push``
+        with ``$each`` (or ``$pull`` with ``$in``). Stacks are written
+        concurrently, and each write returns the habit ids the stack held
+        just before it, which decide the per-operation results.
+        """
+        # Batches may mix users; stacks are keyed by (user_id, stack_id).
+        # Per stack, a list of (kind, [(position, op)]) segments in arrival order
+        segments: Dict[Tuple[str, str], List[Tuple[str, List[Tuple[int, HabitOp]]]]] = {}
+        for position, op in enumerate(ops):
+            stack_segments = segments.setdefault((op.user_id, op.stack_id), [])
+            if stack_segments and stack_segments[-1][0] == op.kind:
+                stack_segments[-1][1].append((position, op))
+            else:
+                stack_segments.append((op.kind, [(position, op)]))
+
+        results: List[Any] = [None] * len(ops)
+        await asyncio.gather(*(
+            self._apply_stack_segments(user_id, stack_id, stack_segments, results)
+            for (user_id, stack_id), stack_segments in segments.items()
+        ))
+
+        pushed = list(dict.fromkeys(
+            (op.user_id, op.stack_id) for op, result in zip(ops, results) if op.kind == "push" and result
+        ))
+        if pushed:
+            docs = {
+                (doc["user_id"], doc["id"]): doc
+                async for doc in self.db.habit_stacks.find(_owned_filter(pushed), STACK_PROJECTION)
+            }
+            for i, op in enumerate(ops):
+                if op.kind == "push" and results[i]:
+                    doc = docs.get((op.user_id, op.stack_id))
+                    results[i] = copy.deepcopy(doc) if doc is not None else None
+        pulled = [(op.stack_id, op.habit_id) for op, result in zip(ops, results) if op.kind == "pull" and result]
+        if pulled:
+            await self._delete_check_ins(pulled)
+        return results
+
+    async def _apply_stack_segments(
+        self,
+        user_id: str,
+        stack_id: str,
+        stack_segments: List[Tuple[str, List[Tuple[int, HabitOp]]]],
+        results: List[Any],
+    ) -> None:
+        """Write one stack's segments in order, filling in ``results`` by position
+
+        Pushes are marked True until the stack is read back.
+        """
+        stack = {"user_id": user_id, "id": stack_id}
+        for kind, items in stack_segments:
+            updated_at = items[-1][1].updated_at
+            if kind == "push":
+                before = await self.db.habit_stacks.find_one_and_update(
+                    stack,
+                    {"$push": {"habits": {"$each": [op.habit for _, op in items]}}, "$set": {"updated_at": updated_at}},
+                    projection={"_id": 0, "id": 1}
+                )
+                for position, _ in items:
+                    results[position] = True if before is not None else None
+                continue
+
+            habit_ids = [op.habit_id for _, op in items]
+            # Only match stacks still holding one of the habits, so a pull
+            # that removes nothing leaves updated_at alone
+            before = await self.db.habit_stacks.find_one_and_update(
+                {**stack, "habits.id": {"$in": habit_ids}},
+                {"$pull": {"habits": {"id": {"$in": habit_ids}}}, "$set": {"updated_at": updated_at}},
+                projection={"_id": 0, "habits.id": 1}
+            )
+            if before is None:
+                exists = await self.db.habit_stacks.count_documents(stack, limit=1)
+                for position, _ in items:
+                    results[position] = False if exists else None
+                continue
+            present = {habit["id"] for habit in before["habits"]}
+            for position, op in items:
+                # A repeated pull of the same habit finds it gone
+                results[position] = op.habit_id in present
+                present.discard(op.habit_id)
+
+    async def update_habit(
+        self,
+        user_id: str,
+        stack_id: str,
+        habit_id: str,
+        changes: Dict[str, Any],
+        updated_at: datetime,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Optional[StackDoc]:
+        # Positional update touches only the matched array element
+        update_dict = {f"habits.$.{field}": value for field, value in changes.items()}
+        update_dict["updated_at"] = updated_at
+        query = {"user_id": user_id, "id": stack_id, "habits.id": habit_id}
+        if expected_updated_at is not None:
+            query["updated_at"] = expected_updated_at
+        return await self.db.habit_stacks.find_one_and_update(
+            query,
+            {"$set": update_dict},
+            projection=STACK_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def pull_habit(self, user_id: str, stack_id: str, habit_id: str, updated_at: datetime) -> Optional[bool]:
+        # Only match stacks that still contain the habit so the pull is atomic
+        result = await self.db.habit_stacks.update_one(
+            {"user_id": user_id, "id": stack_id, "habits.id": habit_id},
+            {"$pull": {"habits": {"id": habit_id}}, "$set": {"updated_at": updated_at}}
+        )
+        if result.modified_count > 0:
+            await self._delete_check_ins([(stack_id, habit_id)])
+            return True
+        # Nothing matched: work out which of the two was missing
+        if await self.db.habit_stacks.count_documents({"user_id": user_id, "id": stack_id}, limit=1):
+            return False
+        return None
+
+    async def has_habit(self, user_id: str, stack_id: str, habit_id: str) -> Optional[bool]:
+        # Project just the matching habit instead of the whole array
+        doc = await self.db.habit_stacks.find_one(
+            {"user_id": user_id, "id": stack_id}, {"_id": 0, "habits": {"$elemMatch": {"id": habit_id}}}
+        )
+        if doc is None:
+            return None
+        return bool(doc.get("habits"))
+
+    async def add_check_in(
+        self, stack_id: str, habit_id: str, day: str
+    ) -> Tuple[bool, Dict[str, Any], Dict[str, Any]]:
+        # Three writes: the day into its bucket, then the habit's summary
+        # from the bucket's count of days, then the stack's from the
+        # habit's total. Each can be repeated without counting twice, so a
+        # repeat of a check-in whose writer failed part way completes it.
+        month = month_bucket(day)
+        before = await self.db[CHECK_INS_COLLECTION].find_one_and_update(
+            {"_id": _bucket_id(stack_id, habit_id, month)},
+            {
+                "$addToSet": {"days": day},
+                "$setOnInsert": {"stack_id": stack_id, "habit_id": habit_id, "month": month},
+            },
+            projection={"_id": 0, "days": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        days = set(before["days"]) if before else set()
+        recorded = day not in days
+        days.add(day)
+        if not recorded:
+            applied = await self._applied_summaries(stack_id, habit_id, day, len(days))
+            if applied:
+                return False, applied[0], applied[1]
+
+        habit = await self._advance_summary(stack_id, habit_id, day, month, len(days))
+        total = await self._advance_summary(stack_id, None, day, habit_id, habit["completions"])
+        return recorded, habit, total
+
+    async def _applied_summaries(
+        self, stack_id: str, habit_id: str, day: str, month_days: int
+    ) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """The summaries of a repeated check-in, unless its first attempt left them behind"""
+        docs = {}
+        async for doc in self.db[SUMMARIES_COLLECTION].find(
+            {"_id": {"$in": [_summary_id(stack_id, habit_id), _summary_id(stack_id)]}}, SUMMARY_PROJECTION
+        ):
+            docs[doc.get("habit_id")] = doc
+        if habit_id not in docs or None not in docs:
+            return None
+        habit, total = _summary_fields(docs[habit_id]), _summary_fields(docs[None])
+        behind = (
+            docs[habit_id]["counts"].get(month_bucket(day), 0) < month_days
+            or docs[None]["counts"].get(_field_key(habit_id), 0) < habit["completions"]
+            or habit["last_day"] < day
+            or total["last_day"] < day
+        )
+        return None if behind else (habit, total)
+
+    async def _advance_summary(
+        self, stack_id: str, habit_id: Optional[str], day: str, count_key: str, count: int
+    ) -> Dict[str, Any]:
+        doc = await self.db[SUMMARIES_COLLECTION].find_one_and_update(
+            {"_id": _summary_id(stack_id, habit_id)},
+            _advance_pipeline(stack_id, habit_id, day, count_key, count),
+            projection=SUMMARY_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc["last_day"] > day:
+            doc = await self._merge_backfill(stack_id, habit_id, day) or doc
+        return _summary_fields(doc)
+
+    async def _merge_backfill(self, stack_id: str, habit_id: Optional[str], day: str) -> Optional[Dict[str, Any]]:
+        """Fold a check-in older than its summary's last day into the streaks
+
+        Only the run of consecutive days around ``day`` can change, so only
+        the buckets of the months it spans are read. The run raises the
+        longest streak, and the current one if it ends on the last day.
+        Raising is safe against concurrent check-ins; one that landed next
+        to the run after it was read leaves the two runs apart, and the run
+        is read again.
+        """
+        doc, end = None, None
+        while True:
+            start, grown_end = await self._run_around(stack_id, habit_id, day)
+            if grown_end == end:
+                return doc
+            end = grown_end
+            length = run_length(start, end)
+            doc = await self.db[SUMMARIES_COLLECTION].find_one_and_update(
+                {"_id": _summary_id(stack_id, habit_id)},
+                [{"$set": {
+                    "longest_streak": {"$max": ["$longest_streak", length]},
+                    "current_streak": {"$cond": [
+                        {"$eq": ["$last_day", end]}, {"$max": ["$current_streak", length]}, "$current_streak"
+                    ]},
+                }}],
+                projection=SUMMARY_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+            # None once the habit or stack was deleted meanwhile
+            if doc is None or doc["last_day"] == end:
+                return doc
+            if run_length(end, doc["last_day"]) != doc["current_streak"] + 1:
+                return doc
+
+    async def _run_around(self, stack_id: str, habit_id: Optional[str], day: str) -> Tuple[str, str]:
+        """First and last day of the run of consecutive check-ins holding ``day``"""
+        months: Dict[str, Set[str]] = {}
+
+        async def checked_in(candidate):
+            month = month_bucket(candidate)
+            if month not in months:
+                months[month] = await self._month_days(stack_id, habit_id, month)
+            return candidate in months[month]
+
+        start = end = day
+        while await checked_in(previous_day(start)):
+            start = previous_day(start)
+        while await checked_in(next_day(end)):
+            end = next_day(end)
+        return start, end
+
+    async def _month_days(self, stack_id: str, habit_id: Optional[str], month: str) -> Set[str]:
+        """Days in ``month`` with a check-in of the habit, or of any habit of the stack"""
+        if habit_id is not None:
+            bucket = await self.db[CHECK_INS_COLLECTION].find_one(
+                {"_id": _bucket_id(stack_id, habit_id, month)}, {"_id": 0, "days": 1}
+            )
+            return set(bucket["days"]) if bucket else set()
+        days: Set[str] = set()
+        prefix = stack_id + "|"
+        async for bucket in self.db[CHECK_INS_COLLECTION].find(
+            {"_id": {"$gt": prefix, "$lt": prefix + "~"}, "stack_id": stack_id, "month": month},
+            {"_id": 0, "days": 1}
+        ):
+            days.update(bucket["days"])
+        return days
+
+    async def _delete_check_ins(self, keys: Sequence[Tuple[str, Optional[str]]]) -> None:
+        """Drop the history and streak summaries of deleted ``(stack_id, habit_id)`` pairs
+
+        A habit id of None drops everything recorded for the stack.
+        """
+        buckets = []
+        summaries = []
+        for stack_id, habit_id in keys:
+            prefix = _summary_id(stack_id, habit_id)
+            buckets.append({"_id": {"$gt": prefix + "|", "$lt": prefix + "|~"}})
+            summaries += [{"_id": prefix}, {"_id": {"$gt": prefix + "|", "$lt": prefix + "|~"}}]
+        await self.db[CHECK_INS_COLLECTION].delete_many({"$or": buckets})
+        await self.db[SUMMARIES_COLLECTION].delete_many({"$or": summaries})
+
+    async def get_streaks(self, stack_id: str) -> Dict[Optional[str], Dict[str, Any]]:
+        summaries = {}
+        async for summary in self.db[SUMMARIES_COLLECTION].find(
+            {"_id": {"$gte": stack_id, "$lt": stack_id + "~"}, "stack_id": stack_id}, SUMMARY_PROJECTION
+        ):
+            summaries[summary.get("habit_id")] = _summary_fields(summary)
+        return summaries
+
+    async def list_check_ins(self, stack_id: str, habit_id: str, start: str, end: str) -> List[str]:
+        days = []
+        async for bucket in self.db[CHECK_INS_COLLECTION].find(
+            {"_id": {
+                "$gte": _bucket_id(stack_id, habit_id, month_bucket(start)),
+                "$lte": _bucket_id(stack_id, habit_id, month_bucket(end)),
+            }},
+            {"days": 1}
+        ).sort("_id", 1):
+            days.extend(day for day in bucket["days"] if start <= day <= end)
+        return sorted(days)
+
+    async def list_stack_check_ins(self, stack_id: str, start: str, end: str) -> Dict[str, List[str]]:
+        # One query over the stack's buckets, fetching only the habit and its days
+        days: Dict[str, List[str]] = {}
+        prefix = stack_id + "|"
+        async for bucket in self.db[CHECK_INS_COLLECTION].find(
+            {
+                "_id": {"$gt": prefix, "$lt": prefix + "~"},
+                "stack_id": stack_id,
+                "month": {"$gte": month_bucket(start), "$lte": month_bucket(end)},
+            },
+            {"_id": 0, "habit_id": 1, "days": 1}
+        ):
+            days.setdefault(bucket["habit_id"], []).extend(
+                day for day in bucket["days"] if start <= day <= end
+            )
+        return days
+
+    async def get_version(self, user_id: str) -> str:
+        doc = await self.db[VERSIONS_COLLECTION].find_one({"_id": _version_id(user_id)}, {"version": 1})
+        return str(doc["version"] if doc else 0)
+
+    async def bump_version(self, user_id: str) -> None:
+        await self.db[VERSIONS_COLLECTION].update_one(
+            {"_id": _version_id(user_id)}, {"$inc": {"version": 1}}, upsert=True
+        )
+
+    async def add_status_check(self, doc: Dict[str, Any]) -> None:
+        await self.db.status_checks.insert_one(dict(doc))
+
+    async def list_status_checks(self, limit: int) -> List[Dict[str, Any]]:
+        return await self.db.status_checks.find({}, {"_id": 0}).to_list(limit)
@@ -0,0 +1,439 @@
+import asyncio
+import heapq
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+
+from pymongo import DeleteMany, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from services.indexes import (
+    HABIT_INDEXES,
+    HABIT_ROUTE_QUERIES,
+    RETIRED_HABIT_INDEXES,
+    check_query_plans,
+    ensure_indexes,
+)
+from services.pagination import LIST_SORT, after_filter, build_projection, habit_after_filter
+from services.ranking import habit_key
+from services.search import SEARCH_FIELDS
+from services.serialization import STACK_PROJECTION
+from storage.base import LEGACY_USER_ID, HabitOp, StackDoc, StackStore
+from storage.mongo import MotorStackStore
+
+logger = logging.getLogger(__name__)
+
+# One document per habit, _id "<stack_id>|<habit_id>", carrying its
+# stack's user_id so habit queries are scoped like stack queries
+HABITS_COLLECTION = "habits"
+HABIT_PROJECTION = {"_id": 0, "user_id": 0, "stack_id": 0}
+HABIT_SORT = [("rank", 1), ("order", 1), ("id", 1)]
+
+# Stacks written before the switch still embed their habits until migrated
+EMBEDDED = {"habits": {"$exists": True}}
+SPLIT = {"habits": {"$exists": False}}
+
+# Only one process migrates at a time, holding a lease it renews per batch
+MIGRATIONS_COLLECTION = "migrations"
+MIGRATION_ID = "habits_collection"
+MIGRATION_LEASE_SECONDS = 60
+MIGRATION_RETRIES = 3
+
+
+def _habit_id(stack_id: str, habit_id: str) -> str:
+    return f"{stack_id}|{habit_id}"
+
+
+def _habit_doc(user_id: str, stack_id: str, habit: Dict[str, Any]) -> Dict[str, Any]:
+    return {"_id": _habit_id(stack_id, habit["id"]), "user_id": user_id, "stack_id": stack_id, **habit}
+
+
+def _summary_doc(doc: StackDoc) -> StackDoc:
+    summary = {field: value for field, value in doc.items() if field != "habits"}
+    summary["habit_count"] = len(doc.get("habits", []))
+    return summary
+
+
+class HabitCollectionStackStore(MotorStackStore):
+    """MongoDB engine keeping habits in their own collection
+
+    Stack documents carry only summary fields (``habit_count``), so a habit
+    write touches one small document and stack reads without ``habits``
+    never load them, however large the stack. Habits come back sorted by
+    ``habit_key``.
+
+    Stacks stored by the embedded layout keep working, and ``migrate``
+    moves their habits out in the background. Without multi-document
+    transactions, a habit write and its stack summary update are two
+    separate writes.
+    """
+
+    name = "mongo-habits"
+
+    def __init__(self, database, migration_batch_size: int = 100, migration_pause: float = 0.05):
+        super().__init__(database)
+        self.habits = database[HABITS_COLLECTION]
+        self.migration_batch_size = migration_batch_size
+        self.migration_pause = migration_pause
+
+    async def initialize(self) -> None:
+        await super().initialize()
+        await ensure_indexes(self.db, HABITS_COLLECTION, HABIT_INDEXES, RETIRED_HABIT_INDEXES)
+
+    async def check_query_plans(self) -> Dict[str, List[str]]:
+        plans = await super().check_query_plans()
+        plans.update(await check_query_plans(self.db, HABITS_COLLECTION, HABIT_ROUTE_QUERIES))
+        return plans
+
+    async def _attach_habits(self, user_id: str, docs: List[StackDoc]) -> List[StackDoc]:
+        """Fill in ``habits`` of a user's stacks read with ``habit_count`` in their projection"""
+        split = {}
+        for doc in docs:
+            if doc.pop("habit_count", None) is not None:
+                doc["habits"] = []
+                split[doc["id"]] = doc
+        if split:
+            async for habit in self.habits.find(
+                {"user_id": user_id, "stack_id": {"$in": list(split)}}, {"_id": 0, "user_id": 0}
+            ).sort(HABIT_SORT):
+                split[habit.pop("stack_id")]["habits"].append(habit)
+        return docs
+
+    # Reads
+
+    async def list_stacks(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[Tuple[datetime, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        if fields and "habits" not in fields:
+            return await super().list_stacks(user_id, limit, after, fields)
+        projection = {**build_projection(fields), "habit_count": 1}
+        cursor = self.db.habit_stacks.find({"user_id": user_id, **after_filter(after)}, projection)
+        return await self._attach_habits(user_id, await cursor.sort(LIST_SORT).limit(limit).to_list(limit))
+
+    async def get_stack(self, user_id: str, stack_id: str, fields: Optional[List[str]] = None) -> Optional[StackDoc]:
+        if fields and "habits" not in fields:
+            return await super().get_stack(user_id, stack_id, fields)
+        projection = {"_id": 0, **{field: 1 for field in fields}} if fields else dict(STACK_PROJECTION)
+        projection.update(id=1, habit_count=1)
+        doc = await self.db.habit_stacks.find_one({"user_id": user_id, "id": stack_id}, projection)
+        if doc is None:
+            return None
+        await self._attach_habits(user_id, [doc])
+        if fields and "id" not in fields:
+            del doc["id"]
+        return doc
+
+    async def iter_stacks(self, user_id: str, batch_size: int) -> AsyncIterator[StackDoc]:
+        batch = []
+        projection = {**STACK_PROJECTION, "habit_count": 1}
+        async for doc in self.db.habit_stacks.find({"user_id": user_id}, projection, batch_size=batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                for attached in await self._attach_habits(user_id, batch):
+                    yield attached
+                batch = []
+        for attached in await self._attach_habits(user_id, batch):
+            yield attached
+
+    async def search_stacks(
+        self,
+        user_id: str,
+        query: str,
+        limit: int,
+        after: Optional[Tuple[float, str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[StackDoc]:
+        # Stack names (and habits of stacks not migrated yet) score on the
+        # stacks' text index and habit names on the habits collection's; a
+        # stack's score is the sum of both
+        scores: Dict[str, float] = {}
+        async for hit in self.db.habit_stacks.aggregate([
+            {"$match": {"user_id": user_id, "$text": {"$search": query}}},
+            {"$project": {"_id": 0, "id": 1, "score": {"$meta": "textScore"}}},
+        ]):
+            scores[hit["id"]] = hit["score"]
+        async for hit in self.habits.aggregate([
+            {"$match": {"user_id": user_id, "$text": {"$search": query}}},
+            {"$project": {"_id": 0, "stack_id": 1, "score": {"$meta": "textScore"}}},
+            {"$group": {"_id": "$stack_id", "score": {"$sum": "$score"}}},
+        ]):
+            scores[hit["_id"]] = scores.get(hit["_id"], 0.0) + hit["score"]
+
+        keys = ((-score, stack_id) for stack_id, score in scores.items())
+        if after:
+            score, stack_id = after
+            keys = (key for key in keys if key > (-score, stack_id))
+        page = heapq.nsmallest(limit, keys)
+        if not page:
+            return []
+
+        projection = {"_id": 0, "id": 1}
+        for field in fields or SEARCH_FIELDS:
+            projection[field] = 1
+        if "habits" in projection:
+            projection["habit_count"] = 1
+        docs = {
+            doc["id"]: doc
+            async for doc in self.db.habit_stacks.find(
+                {"user_id": user_id, "id": {"$in": [stack_id for _, stack_id in page]}}, projection
+            )
+        }
+        hits = []
+        for negated_score, stack_id in page:
+            doc = docs.get(stack_id)
+            if doc is not None:
+                doc["score"] = -negated_score
+                hits.append(doc)
+        return await self._attach_habits(user_id, hits)
+
+    async def has_habit(self, user_id: str, stack_id: str, habit_id: str) -> Optional[bool]:
+        if await self.habits.count_documents({"_id": _habit_id(stack_id, habit_id), "user_id": user_id}, limit=1):
+            return True
+        return await super().has_habit(user_id, stack_id, habit_id)
+
+    async def list_habits(
+        self, user_id: str, stack_id: str, limit: int, after: Optional[Tuple[str, int, str]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        doc = await self.db.habit_stacks.find_one({"user_id": user_id, "id": stack_id}, {"_id": 0, "habit_count": 1})
+        if doc is None:
+            return None
+        if "habit_count" not in doc:
+            return await super().list_habits(user_id, stack_id, limit, after)
+        query = {"user_id": user_id, "stack_id": stack_id, **(habit_after_filter(after) if after else {})}
+        return await self.habits.find(query, HABIT_PROJECTION).sort(HABIT_SORT).limit(limit).to_list(limit)
+
+    # Writes. Each one first tries the collection layout, conditioned on the
+    # stack having no habits array, and falls back to the embedded layout.
+    # Both are tried twice in case a migration lands in between.
+
+    async def insert_stacks(self, docs: Sequence[StackDoc]) -> Dict[int, str]:
+        if not docs:
+            return {}
+        errors = {}
+        try:
+            await self.db.habit_stacks.insert_many([_summary_doc(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            errors = {err["index"]: err["errmsg"] for err in e.details.get("writeErrors", [])}
+        # Habits only once their stack exists, so a rejected duplicate adds nothing
+        habits = [
+            _habit_doc(doc["user_id"], doc["id"], habit)
+            for i, doc in enumerate(docs) if i not in errors
+            for habit in doc.get("habits", [])
+        ]
+        if habits:
+            await self.habits.insert_many(habits, ordered=False)
+        return errors
+
+    async def _replace_habits(self, user_id: str, stack_id: str, habits: List[Dict[str, Any]]) -> None:
+        operations = [DeleteMany({
+            "user_id": user_id, "stack_id": stack_id, "id": {"$nin": [habit["id"] for habit in habits]}
+        })]
+        operations += [
+            ReplaceOne(
+                {"_id": _habit_id(stack_id, habit["id"]), "user_id": user_id},
+                _habit_doc(user_id, stack_id, habit),
+                upsert=True
+            )
+            for habit in habits
+        ]
+        await self.habits.bulk_write(operations, ordered=False)
+
+    async def update_stack(
+        self, user_id: str, stack_id: str, changes: Dict[str, Any], expected_updated_at: Optional[datetime] = None
+    ) -> Optional[StackDoc]:
+        query = {"user_id": user_id, "id": stack_id}
+        if expected_updated_at is not None:
+            query["updated_at"] = expected_updated_at
+        projection = {**STACK_PROJECTION, "habit_count": 1}
+        habits = changes.get("habits")
+        if habits is None:
+            doc = await self.db.habit_stacks.find_one_and_update(
+                query, {"$set": changes}, projection=projection, return_document=ReturnDocument.AFTER
+            )
+            return (await self._attach_habits(user_id, [doc]))[0] if doc else None
+
+        for _ in range(2):
+            doc = await self.db.habit_stacks.find_one_and_update(
+                {**query, **SPLIT},
+                {"$set": _summary_doc(changes)},
+                projection=STACK_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is not None:
+                await self._replace_habits(user_id, stack_id, habits)
+                doc["habits"] = [dict(habit) for habit in sorted(habits, key=habit_key)]
+                return doc
+            doc = await self.db.habit_stacks.find_one_and_update(
+                {**query, **EMBEDDED},
+                {"$set": changes},
+                projection=STACK_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is not None:
+                return doc
+        return None
+
+    async def update_stacks(self, user_id: str, updates: Sequence[Tuple[str, Dict[str, Any]]]) -> Dict[str, str]:
+        plain = [(stack_id, changes) for stack_id, changes in updates if "habits" not in changes]
+        errors = await super().update_stacks(user_id, plain) if plain else {}
+        for stack_id, changes in updates:
+            if "habits" in changes and await self.update_stack(user_id, stack_id, changes) is None:
+                errors[stack_id] = "Habit stack not found"
+        return errors
+
+    async def delete_stacks(self, user_id: str, stack_ids: Sequence[str]) -> Set[str]:
+        deleted = await super().delete_stacks(user_id, stack_ids)
+        if deleted:
+            await self.habits.delete_many({"user_id": user_id, "stack_id": {"$in": list(deleted)}})
+        return deleted
+
+    async def push_habit(self, user_id: str, stack_id: str, habit: Dict[str, Any], updated_at: datetime) -> Optional[StackDoc]:
+        for _ in range(2):
+            doc = await self.db.habit_stacks.find_one_and_update(
+                {"user_id": user_id, "id": stack_id, **SPLIT},
+                {"$inc": {"habit_count": 1}, "$set": {"updated_at": updated_at}},
+                projection={**STACK_PROJECTION, "habit_count": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is not None:
+                await self.habits.insert_one(_habit_doc(user_id, stack_id, habit))
+                return (await self._attach_habits(user_id, [doc]))[0]
+            doc = await self.db.habit_stacks.find_one_and_update(
+                {"user_id": user_id, "id": stack_id, **EMBEDDED},
+                {"$push": {"habits": habit}, "$set": {"updated_at": updated_at}},
+                projection=STACK_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is not None:
+                return doc
+        return None
+
+    async def apply_habit_ops(self, ops: Sequence[HabitOp]) -> List[Any]:
+        # Every habit is its own document, so there is no array update to merge
+        return await StackStore.apply_habit_ops(self, ops)
+
+    async def update_habit(
+        self,
+        user_id: str,
+        stack_id: str,
+        habit_id: str,
+        changes: Dict[str, Any],
+        updated_at: datetime,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Optional[StackDoc]:
+        query = {"user_id": user_id, "id": stack_id, **SPLIT}
+        if expected_updated_at is not None:
+            query["updated_at"] = expected_updated_at
+        key = {"_id": _habit_id(stack_id, habit_id), "user_id": user_id}
+        for _ in range(2):
+            if await self.habits.count_documents(key, limit=1):
+                doc = await self.db.habit_stacks.find_one_and_update(
+                    query,
+                    {"$set": {"updated_at": updated_at}},
+                    projection={**STACK_PROJECTION, "habit_count": 1},
+                    return_document=ReturnDocument.AFTER
+                )
+                if doc is not None:
+                    await self.habits.update_one(key, {"$set": changes})
+                    return (await self._attach_habits(user_id, [doc]))[0]
+            # Embedded stacks: the positional update only matches a habits array
+            doc = await super().update_habit(user_id, stack_id, habit_id, changes, updated_at, expected_updated_at)
+            if doc is not None:
+                return doc
+        return None
+
+    async def pull_habit(self, user_id: str, stack_id: str, habit_id: str, updated_at: datetime) -> Optional[bool]:
+        result = await self.habits.delete_one({"_id": _habit_id(stack_id, habit_id), "user_id": user_id})
+        if result.deleted_count:
+            updated = await self.db.habit_stacks.update_one(
+                {"user_id": user_id, "id": stack_id, **SPLIT},
+                {"$inc": {"habit_count": -1}, "$set": {"updated_at": updated_at}}
+            )
+            if updated.modified_count:
+                await self._delete_check_ins([(stack_id, habit_id)])
+                return True
+        # Embedded stacks, or a habit that is not there
+        return await super().pull_habit(user_id, stack_id, habit_id, updated_at)
+
+    # Migration from the embedded layout
+
+    async def migrate(self) -> int:
+        """Move the habits of embedded stacks into the habits collection
+
+        Runs while serving: stacks are converted one at a time, in ``_id``
+        order, pausing between batches. A stack written to while it is
+        converted is retried. Only the holder of the migration lease
+        converts stacks; other processes wait for it to finish.
+        """
+        migrated = await super().migrate()
+        # Habits split out before stacks had owners belong to legacy stacks
+        await self.habits.update_many({"user_id": {"$exists": False}}, {"$set": {"user_id": LEGACY_USER_ID}})
+
+        owner = uuid.uuid4().hex
+        last_id = None
+        try:
+            while True:
+                if not await self._renew_lease(owner):
+                    await asyncio.sleep(MIGRATION_LEASE_SECONDS / 4)
+                    continue
+                query = {**EMBEDDED, **({"_id": {"$gt": last_id}} if last_id is not None else {})}
+                batch = await self.db.habit_stacks.find(
+                    query, {"_id": 1, "user_id": 1, "id": 1}
+                ).sort("_id", 1).limit(self.migration_batch_size).to_list(None)
+                if not batch:
+                    return migrated
+                for doc in batch:
+                    if await self._split_stack(doc["user_id"], doc["id"]):
+                        migrated += 1
+                last_id = batch[-1]["_id"]
+                await asyncio.sleep(self.migration_pause)
+        finally:
+            await self.db[MIGRATIONS_COLLECTION].delete_one({"_id": MIGRATION_ID, "owner": owner})
+
+    async def _renew_lease(self, owner: str) -> bool:
+        now = datetime.utcnow()
+        try:
+            await self.db[MIGRATIONS_COLLECTION].update_one(
+                {"_id": MIGRATION_ID, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another process holds a live lease
+            return False
+        return True
+
+    async def _split_stack(self, user_id: str, stack_id: str) -> bool:
+        """Convert one embedded stack; False if it is gone or kept changing"""
+        stack = {"user_id": user_id, "id": stack_id}
+        leftovers = {"user_id": user_id, "stack_id": stack_id}
+        for _ in range(MIGRATION_RETRIES):
+            doc = await self.db.habit_stacks.find_one({**stack, **EMBEDDED}, {"_id": 0, "habits": 1})
+            if doc is None:
+                return False
+            habits = doc["habits"]
+            # Clear leftovers of an interrupted attempt; readers ignore them
+            # while the stack still embeds its habits
+            await self.habits.delete_many(leftovers)
+            try:
+                if habits:
+                    await self.habits.insert_many([_habit_doc(user_id, stack_id, habit) for habit in habits])
+            except BulkWriteError as e:
+                logger.error(f"Cannot migrate habit stack {stack_id}: {e.details.get('writeErrors', [])[:1]}")
+                await self.habits.delete_many(leftovers)
+                return False
+            # Commit only if the habits are still exactly what was copied
+            result = await self.db.habit_stacks.update_one(
+                {**stack, "habits": habits},
+                {"$unset": {"habits": ""}, "$set": {"habit_count": len(habits)}}
+            )
+            if result.modified_count:
+                return True
+        await self.habits.delete_many(leftovers)
+        logger.warning(f"Habit stack {stack_id} kept changing during migration, it will be retried on the next run")
+        return False
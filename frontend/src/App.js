@@ -20,6 +20,8 @@ function App() {
   const [currentView, setCurrentView] = useState(VIEWS.HOME);
   const [currentStack, setCurrentStack] = useState(null);
   const [savedStacks, setSavedStacks] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [predefinedRoutines, setPredefinedRoutines] = useState([]);
   const [loading, setLoading] = useState(true);
   const { toast } = useToast();
@@ -31,12 +33,13 @@ function App() {
   const loadInitialData = async () => {
     try {
       setLoading(true);
-      const [routines, stacks] = await Promise.all([
+      const [routines, page] = await Promise.all([
         apiService.getPredefinedRoutines(),
         apiService.getHabitStacks()
       ]);
       setPredefinedRoutines(routines);
-      setSavedStacks(stacks);
+      setSavedStacks(page.stacks);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Error loading initial data:', error);
       toast({
@@ -49,6 +52,32 @@ function App() {
     }
   };
 
+  // Reload the first page of saved stacks; later pages load on demand
+  const refreshSavedStacks = async () => {
+    const page = await apiService.getHabitStacks();
+    setSavedStacks(page.stacks);
+    setNextCursor(page.nextCursor);
+  };
+
+  const handleLoadMoreStacks = async () => {
+    if (!nextCursor || loadingMore) return;
+    try {
+      setLoadingMore(true);
+      const page = await apiService.getHabitStacks(nextCursor);
+      setSavedStacks(stacks => [...stacks, ...page.stacks]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error loading more stacks:', error);
+      toast({
+        title: "Error",
+        description: "Failed to load more stacks. Please try again.",
+        variant: "destructive"
+      });
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSelectRoutine = async (routine) => {
     try {
       // Create a new stack based on the selected routine
@@ -65,8 +94,7 @@ function App() {
       setCurrentView(VIEWS.EDITOR);
       
       // Refresh saved stacks
-      const updatedStacks = await apiService.getHabitStacks();
-      setSavedStacks(updatedStacks);
+      await refreshSavedStacks();
       
       toast({
         title: "Stack Created",
@@ -94,8 +122,7 @@ function App() {
       setCurrentView(VIEWS.EDITOR);
       
       // Refresh saved stacks
-      const updatedStacks = await apiService.getHabitStacks();
-      setSavedStacks(updatedStacks);
+      await refreshSavedStacks();
       
       toast({
         title: "Custom Stack Created",
@@ -111,14 +138,12 @@ function App() {
     }
   };
 
-  const handleUpdateHabits = async (habits) => {
+  const handleMoveHabit = async (habitId, position) => {
     try {
-      const updatedStack = await apiService.updateHabitStack(currentStack.id, {
-        habits: habits
-      });
+      const updatedStack = await apiService.moveHabitInStack(currentStack.id, habitId, position);
       setCurrentStack(updatedStack);
     } catch (error) {
-      console.error('Error updating habits:', error);
+      console.error('Error moving habit:', error);
       toast({
         title: "Error",
         description: "Failed to update habits. Please try again.",
@@ -200,8 +225,7 @@ function App() {
   const handleSaveStack = async () => {
     try {
       // Stack is already saved in the database, just refresh the saved stacks list
-      const updatedStacks = await apiService.getHabitStacks();
-      setSavedStacks(updatedStacks);
+      await refreshSavedStacks();
       
       toast({
         title: "Stack Saved",
@@ -238,8 +262,7 @@ function App() {
       await apiService.deleteHabitStack(stackId);
       
       // Refresh saved stacks
-      const updatedStacks = await apiService.getHabitStacks();
-      setSavedStacks(updatedStacks);
+      await refreshSavedStacks();
       
       toast({
         title: "Stack Deleted",
@@ -316,7 +339,7 @@ function App() {
                     className="flex items-center gap-2"
                   >
                     <Bookmark className="w-4 h-4" />
-                    Saved ({savedStacks.length})
+                    Saved ({savedStacks.length}{nextCursor ? '+' : ''})
                   </Button>
                 </div>
               </div>
@@ -336,7 +359,7 @@ function App() {
             {currentView === VIEWS.EDITOR && currentStack && (
               <HabitChain
                 habitStack={currentStack}
-                onUpdateHabits={handleUpdateHabits}
+                onMoveHabit={handleMoveHabit}
                 onSaveStack={handleSaveStack}
                 onAddHabit={handleAddHabit}
                 onEditHabit={handleEditHabit}
@@ -350,6 +373,9 @@ function App() {
                 onLoadStack={handleLoadStack}
                 onDeleteStack={handleDeleteStack}
                 onEditStack={handleLoadStack}
+                hasMore={Boolean(nextCursor)}
+                loadingMore={loadingMore}
+                onLoadMore={handleLoadMoreStacks}
               />
             )}
           </main>
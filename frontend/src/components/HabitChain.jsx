@@ -9,7 +9,7 @@ import { Plus, ArrowDown, Save, ChevronRight } from 'lucide-react';
 
 const HabitChain = ({ 
   habitStack, 
-  onUpdateHabits, 
+  onMoveHabit, 
   onSaveStack, 
   onAddHabit, 
   onEditHabit, 
@@ -27,18 +27,20 @@ const HabitChain = ({
 
   const handleDragEnd = (result) => {
     if (!result.destination) return;
+    if (result.destination.index === result.source.index) return;
 
     const items = Array.from(habitStack.habits);
     const [reorderedItem] = items.splice(result.source.index, 1);
     items.splice(result.destination.index, 0, reorderedItem);
 
-    // Update order property
-    const updatedItems = items.map((item, index) => ({
-      ...item,
-      order: index
-    }));
+    // Only the moved habit changes: place it after its new predecessor,
+    // or before the new second habit when dropped at the top
+    const index = result.destination.index;
+    const position = index > 0
+      ? { after: items[index - 1].id }
+      : { before: items[1].id };
 
-    onUpdateHabits(updatedItems);
+    onMoveHabit(reorderedItem.id, position);
   };
 
   const handleDragStart = () => {
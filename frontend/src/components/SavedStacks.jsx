@@ -2,9 +2,17 @@ import React from 'react';
 import { Card } from './ui/card';
 import { Button } from './ui/button';
 import { Badge } from './ui/badge';
-import { Clock, Trash2, Edit, Calendar } from 'lucide-react';
+import { Clock, Trash2, Edit, Calendar, Loader2 } from 'lucide-react';
 
-const SavedStacks = ({ stacks, onLoadStack, onDeleteStack, onEditStack }) => {
+const SavedStacks = ({
+  stacks,
+  onLoadStack,
+  onDeleteStack,
+  onEditStack,
+  hasMore = false,
+  loadingMore = false,
+  onLoadMore
+}) => {
   const formatDate = (dateString) => {
     return new Date(dateString).toLocaleDateString('en-US', {
       year: 'numeric',
@@ -102,6 +110,15 @@ const SavedStacks = ({ stacks, onLoadStack, onDeleteStack, onEditStack }) => {
           </Card>
         ))}
       </div>
+
+      {hasMore && (
+        <div className="flex justify-center mt-6">
+          <Button variant="outline" onClick={onLoadMore} disabled={loadingMore}>
+            {loadingMore && <Loader2 className="w-4 h-4 mr-2 animate-spin" />}
+            Load more stacks
+          </Button>
+        </div>
+      )}
     </div>
   );
 };
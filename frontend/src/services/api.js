@@ -17,10 +17,16 @@ export const apiService = {
   },
 
   // Habit stacks
-  getHabitStacks: async () => {
+  // One page of stacks, newest first; pass the returned nextCursor to get
+  // the following page (null once there are no more)
+  getHabitStacks: async (cursor = null) => {
     try {
-      const response = await axios.get(`${API}/habit-stacks`);
-      return response.data;
+      const params = cursor ? { cursor } : {};
+      const response = await axios.get(`${API}/habit-stacks`, { params });
+      return {
+        stacks: response.data,
+        nextCursor: response.headers['x-next-cursor'] || null
+      };
     } catch (error) {
       console.error('Error fetching habit stacks:', error);
       throw error;
@@ -78,6 +84,17 @@ export const apiService = {
     }
   },
 
+  moveHabitInStack: async (stackId, habitId, position) => {
+    try {
+      // position is { before: habitId } or { after: habitId }
+      const response = await axios.post(`${API}/habit-stacks/${stackId}/habits/${habitId}/move`, position);
+      return response.data;
+    } catch (error) {
+      console.error('Error moving habit in stack:', error);
+      throw error;
+    }
+  },
+
   removeHabitFromStack: async (stackId, habitId) => {
     try {
       const response = await axios.delete(`${API}/habit-stacks/${stackId}/habits/${habitId}`);
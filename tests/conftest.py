@@ -0,0 +1,29 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is run from its own directory, so its packages are top level
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Run ``scenario(client)`` against the app backed by a fresh in-memory store"""
+    import httpx
+    import server
+
+    monkeypatch.setattr(server, "STORAGE_ENGINE", "embedded")
+    monkeypatch.setenv("EMBEDDED_JOURNAL_PATH", "")
+
+    def run(scenario):
+        async def main():
+            async with server.app.router.lifespan_context(server.app):
+                transport = httpx.ASGITransport(app=server.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    return await scenario(client)
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,195 @@
+"""
+Tests for admission control and load shedding
+"""
+
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController, AdmissionMiddleware, Overloaded
+
+
+def controller(**kwargs):
+    options = dict(read_concurrency=2, write_concurrency=1, max_queue=2, queue_timeout=0.05, adjust_interval=0)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_queued_requests_get_slots_in_order():
+    async def scenario():
+        limiter = controller().limiters["write"]
+        await limiter.acquire()
+        order = []
+
+        async def request(name):
+            await limiter.acquire()
+            order.append(name)
+
+        waiters = [asyncio.create_task(request(name)) for name in ("a", "b")]
+        await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 2
+
+        limiter.release()
+        await asyncio.sleep(0.01)
+        assert order == ["a"]
+        assert limiter.in_flight == 1
+        limiter.release()
+        await asyncio.gather(*waiters)
+        assert order == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        limiter = controller(queue_timeout=1.0).limiters["write"]
+        await limiter.acquire()
+        waiters = [asyncio.create_task(limiter.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded) as excinfo:
+            await limiter.acquire()
+        assert excinfo.value.status_code == 429
+        assert excinfo.value.retry_after == 1
+        assert limiter.stats()["rejected"] == 1
+
+        for _ in range(3):
+            limiter.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_is_503_and_frees_the_queue_spot():
+    async def scenario():
+        limiter = controller().limiters["write"]
+        await limiter.acquire()
+        with pytest.raises(Overloaded) as excinfo:
+            await limiter.acquire()
+        assert excinfo.value.status_code == 503
+        assert limiter.stats()["queued"] == 0
+        assert limiter.stats()["timed_out"] == 1
+
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_read_and_write_budgets_are_separate():
+    async def scenario():
+        admission = controller()
+        await admission.limiter_for("POST").acquire()
+        await admission.limiter_for("GET").acquire()
+        await admission.limiter_for("GET").acquire()
+        assert admission.limiters["read"].in_flight == 2
+        assert admission.limiters["write"].in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_capacity_shrinks_on_slow_database_and_recovers():
+    admission = controller(read_concurrency=100)
+    for _ in range(20):
+        admission.observe_latency(0.002)
+    assert admission.capacity == 1.0
+
+    for _ in range(40):
+        admission.observe_latency(0.2)
+    assert admission.capacity < 0.5
+    assert admission.limiters["read"].limit < 50
+
+    for _ in range(200):
+        admission.observe_latency(0.002)
+    assert admission.capacity == 1.0
+    assert admission.limiters["read"].limit == 100
+
+
+def test_capacity_follows_request_latency_on_the_embedded_engine(api, monkeypatch):
+    import server
+    import routes.habit_stacks as habit_stacks
+    from services.admission import LatencyTracker
+
+    admission = server.admission
+    monkeypatch.setattr(admission, "adjust_interval", 0)
+    monkeypatch.setattr(admission, "capacity", 1.0)
+    monkeypatch.setattr(admission, "database", LatencyTracker(admission.database.min_slack))
+    monkeypatch.setattr(admission, "requests", LatencyTracker(admission.requests.min_slack))
+
+    async def scenario(client):
+        list_stacks = habit_stacks.store.list_stacks
+        delay = {"seconds": 0}
+
+        async def slow_list_stacks(*args, **kwargs):
+            await asyncio.sleep(delay["seconds"])
+            return await list_stacks(*args, **kwargs)
+
+        monkeypatch.setattr(habit_stacks.store, "list_stacks", slow_list_stacks)
+
+        async def requests(count):
+            for _ in range(count):
+                response = await client.get("/api/habit-stacks")
+                assert response.status_code == 200
+
+        await requests(10)
+        assert admission.capacity == 1.0
+
+        # The embedded engine issues no database commands, so only the
+        # request latency can move the limit
+        delay["seconds"] = 0.1
+        await requests(15)
+        assert admission.database.recent is None
+        assert admission.capacity < 0.5
+        assert admission.limiters["read"].limit < admission.limiters["read"].max_concurrency
+
+        delay["seconds"] = 0
+        await requests(100)
+        assert admission.capacity == 1.0
+
+    api(scenario)
+
+
+def test_higher_capacity_admits_queued_requests():
+    async def scenario():
+        admission = controller(write_concurrency=10, queue_timeout=1.0)
+        admission.capacity = 0.19
+        limiter = admission.limiters["write"]
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 1
+
+        # No request finishes; the raised limit alone hands out the slot
+        admission.observe_request_latency(0.001)
+        assert limiter.limit == 2
+        await asyncio.wait_for(waiter, 0.1)
+        assert limiter.in_flight == 2
+
+    asyncio.run(scenario())
+
+
+def test_payload_bound_routes_do_not_feed_the_latency_signal():
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(0.02)
+
+    async def scenario():
+        admission = controller()
+        middleware = AdmissionMiddleware(slow_app, admission)
+
+        async def request(method, path):
+            await middleware({"type": "http", "method": method, "path": path}, None, None)
+
+        for method, path in [
+            ("GET", "/api/habit-stacks/export"),
+            ("POST", "/api/habit-stacks/import"),
+            ("POST", "/api/habit-stacks:batch"),
+            ("GET", "/api/habit-stacks/some-stack/analytics"),
+        ]:
+            await request(method, path)
+        assert admission.requests.recent is None
+
+        await request("GET", "/api/habit-stacks/some-stack")
+        assert admission.requests.recent is not None
+
+    asyncio.run(scenario())
@@ -0,0 +1,52 @@
+"""
+Tests for the vectorized completion analytics
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from services.analytics import compute_analytics  # noqa: E402
+
+START = date(2024, 1, 1)  # a Monday
+
+
+def days(*offsets):
+    return [(START + timedelta(days=offset)).isoformat() for offset in offsets]
+
+
+def test_rates_heatmap_and_weekdays():
+    result = compute_analytics(["a", "b"], {"a": days(0, 1, 7), "b": days(0, 99)}, START, START + timedelta(days=13))
+    assert result["heatmap"][:3] == [2, 1, 0]
+    assert result["habit_rates"] == [round(3 / 14, 4), round(1 / 14, 4)]
+    assert result["completion_rate"] == round(4 / 28, 4)
+    # Two Mondays, two habits, three check-ins between them
+    assert result["weekday_rates"][0] == 0.75
+    assert result["weekday_rates"][6] == 0.0
+
+
+def test_rolling_rates_need_a_full_window():
+    result = compute_analytics(["a"], {"a": days(*range(7))}, START, START + timedelta(days=9))
+    rolling = result["rolling_rates"]["7"]
+    assert rolling[:6] == [None] * 6
+    assert rolling[6:] == [1.0, round(6 / 7, 4), round(5 / 7, 4), round(4 / 7, 4)]
+    assert result["rolling_rates"]["30"] == [None] * 10
+
+
+def test_consecutive_correlations():
+    end = START + timedelta(days=3)
+    result = compute_analytics(
+        ["a", "b", "c", "d"],
+        {"a": days(0, 1), "b": days(0, 1), "c": days(2, 3)},
+        START, end
+    )
+    # b follows a exactly, c is its opposite, d never varies
+    assert result["consecutive_correlations"] == [1.0, -1.0, None]
+
+
+def test_empty_stack():
+    result = compute_analytics([], {}, START, START)
+    assert result["completion_rate"] == 0.0
+    assert result["consecutive_correlations"] == []
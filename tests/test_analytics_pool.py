@@ -0,0 +1,49 @@
+"""
+Tests for the analytics worker pool
+"""
+
+import asyncio
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+from services import analytics_pool
+
+START = date(2024, 1, 1)
+
+
+@pytest.fixture
+def pool():
+    analytics_pool.shutdown_pool()
+    yield analytics_pool
+    analytics_pool.shutdown_pool()
+
+
+def test_warm_up_starts_every_worker(pool):
+    asyncio.run(pool.warm_up_pool())
+    assert pool.stats() == {"workers": pool.ANALYTICS_WORKERS, "started": pool.ANALYTICS_WORKERS}
+
+
+def test_run_analytics_computes_in_a_worker(pool):
+    pytest.importorskip("numpy")
+    days = [(START + timedelta(days=offset)).isoformat() for offset in (0, 2)]
+    loaded = "numpy" in sys.modules
+
+    result = asyncio.run(pool.run_analytics(["a"], {"a": days}, START, START + timedelta(days=3)))
+    assert result["heatmap"] == [1, 0, 1, 0]
+    assert result["habit_rates"] == [0.5]
+    # The server process hands the work off without importing NumPy itself
+    assert ("numpy" in sys.modules) == loaded
+
+
+def test_shutdown_releases_the_pool(pool):
+    asyncio.run(pool.warm_up_pool())
+    executor = pool.get_pool()
+    pool.shutdown_pool()
+
+    assert pool.stats()["started"] == 0
+    with pytest.raises(RuntimeError):
+        executor.submit(pool._ready)
+    # The next request starts a fresh pool
+    assert pool.get_pool() is not executor
@@ -0,0 +1,80 @@
+"""
+Tests for the batch create, update and delete endpoints
+"""
+
+import pytest
+
+import server
+
+
+def _fail_after_first_chunk(monkeypatch, method):
+    original = getattr(server.store, method)
+    calls = []
+
+    async def flaky(*args):
+        calls.append(args)
+        if len(calls) > 1:
+            raise ConnectionError("storage went away")
+        return await original(*args)
+
+    monkeypatch.setattr(server.store, method, flaky)
+
+
+@pytest.mark.parametrize("method", ["insert_stacks", "update_stacks", "delete_stacks"])
+def test_partial_failure_still_invalidates_listings(api, monkeypatch, method):
+    async def scenario(client):
+        created = await client.post("/api/habit-stacks:batch", json=[{"name": "a"}, {"name": "b"}])
+        ids = [item["id"] for item in created.json()["results"]]
+        before = await client.get("/api/habit-stacks")
+        etag = before.headers["ETag"]
+        stack = (await client.get(f"/api/habit-stacks/{ids[0]}")).json()
+
+        _fail_after_first_chunk(monkeypatch, method)
+        if method == "insert_stacks":
+            failed = await client.post("/api/habit-stacks:batch?chunk_size=1", json=[{"name": "c"}, {"name": "d"}])
+        elif method == "update_stacks":
+            failed = await client.patch(
+                "/api/habit-stacks:batch?chunk_size=1", json=[{"id": i, "name": "renamed"} for i in ids]
+            )
+        else:
+            failed = await client.request("DELETE", "/api/habit-stacks:batch?chunk_size=1", json=ids)
+
+        after = await client.get("/api/habit-stacks", headers={"If-None-Match": etag})
+        reread = await client.get(f"/api/habit-stacks/{ids[0]}")
+        return failed, after, stack, reread
+
+    failed, after, stack, reread = api(scenario)
+    assert failed.status_code == 200
+    assert [item["status"] for item in failed.json()["results"]][1] == "failed"
+    # The first chunk was written, so the old listing must not be confirmed
+    assert after.status_code == 200
+    if method == "update_stacks":
+        assert reread.json()["name"] == "renamed" != stack["name"]
+    if method == "delete_stacks":
+        assert reread.status_code == 404
+
+
+def test_failed_chunk_reports_what_was_written(api, monkeypatch):
+    async def scenario(client):
+        _fail_after_first_chunk(monkeypatch, "insert_stacks")
+        response = await client.post(
+            "/api/habit-stacks:batch?chunk_size=2", json=[{"name": f"s{i}"} for i in range(5)]
+        )
+        created = [item["id"] for item in response.json()["results"] if item["status"] == "created"]
+        fetched = [await client.get(f"/api/habit-stacks/{stack_id}") for stack_id in created]
+        listing = await client.get("/api/habit-stacks")
+        return response, fetched, listing
+
+    response, fetched, listing = api(scenario)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["succeeded"], body["failed"]) == (2, 3)
+    results = body["results"]
+    assert [item["index"] for item in results] == [0, 1, 2, 3, 4]
+    assert [item["status"] for item in results] == ["created", "created", "failed", "failed", "skipped"]
+    # The created ids come back, so a client retries only the rest
+    assert [r.json()["name"] for r in fetched] == ["s0", "s1"]
+    assert {stack["name"] for stack in listing.json()} == {"s0", "s1"}
+    assert all(item["id"] for item in results[:4]) and results[4]["id"] is None
+    assert "storage went away" in results[2]["error"]
+    assert results[4]["error"] and results[0]["error"] is None
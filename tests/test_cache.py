@@ -0,0 +1,165 @@
+"""
+Tests for the read-through cache of single habit stacks
+"""
+
+from datetime import datetime
+
+import pytest
+
+import routes.habit_stacks as habit_stacks
+import services.cache
+from services.cache import StackCache
+
+ALICE = {"X-User-Id": "alice"}
+BOB = {"X-User-Id": "bob"}
+
+TTL = 300
+MAX_STALENESS = 10
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(services.cache.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(monkeypatch, clock):
+    """Give the routes a fresh cache running on ``clock``"""
+    stack_cache = StackCache(ttl=TTL, max_staleness=MAX_STALENESS)
+    monkeypatch.setattr(habit_stacks, "stack_cache", stack_cache)
+    return stack_cache
+
+
+async def create_stack(client, name="morning", headers=ALICE):
+    response = await client.post(
+        "/api/habit-stacks", json={"name": name, "habits": [{"name": "a"}, {"name": "b"}]}, headers=headers
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+async def read(client, stack_id, headers=ALICE):
+    return await client.get(f"/api/habit-stacks/{stack_id}", headers=headers)
+
+
+def test_second_read_is_a_hit(api, cache):
+    async def scenario(client):
+        stack = await create_stack(client)
+        first = await read(client, stack["id"])
+        assert cache.stats()["misses"] == 1
+        second = await read(client, stack["id"])
+        assert cache.stats()["hits"] == 1
+        assert first.json() == second.json() == stack
+        assert first.headers["ETag"] == second.headers["ETag"]
+
+    api(scenario)
+
+
+def test_other_users_can_neither_read_nor_evict_a_cached_stack(api, cache, clock):
+    async def scenario(client):
+        stack_id = (await create_stack(client))["id"]
+        assert (await read(client, stack_id)).status_code == 200
+        cached = cache.stats()
+
+        # Past the staleness window, so a shared entry would be revalidated
+        clock.now += MAX_STALENESS + 1
+        for _ in range(2):
+            assert (await read(client, stack_id, headers=BOB)).status_code == 404
+        assert cache.stats()["hits"] == cached["hits"]
+        assert cache.stats()["revalidations"] == cached["revalidations"]
+        assert cache.stats()["size"] == 1
+
+        hits = cache.stats()["hits"]
+        assert (await read(client, stack_id)).status_code == 200
+        assert cache.stats()["hits"] == hits + 1
+
+    api(scenario)
+
+
+def _writes(client, stack):
+    """Each write kind, as a coroutine function changing ``stack``'s name or habits"""
+    url = f"/api/habit-stacks/{stack['id']}"
+    first, second = (habit["id"] for habit in stack["habits"])
+    return {
+        "update": lambda: client.put(url, json={"name": "renamed"}, headers=ALICE),
+        "push habit": lambda: client.post(f"{url}/habits", json={"name": "c"}, headers=ALICE),
+        "update habit": lambda: client.put(f"{url}/habits/{first}", json={"name": "z"}, headers=ALICE),
+        "move habit": lambda: client.post(f"{url}/habits/{first}/move", json={"after": second}, headers=ALICE),
+        "pull habit": lambda: client.delete(f"{url}/habits/{first}", headers=ALICE),
+        "batch update": lambda: client.patch(
+            "/api/habit-stacks:batch", json=[{"id": stack["id"], "name": "renamed"}], headers=ALICE
+        ),
+        "delete": lambda: client.delete(url, headers=ALICE),
+        "batch delete": lambda: client.request("DELETE", "/api/habit-stacks:batch", json=[stack["id"]], headers=ALICE),
+    }
+
+
+@pytest.mark.parametrize("kind", [
+    "update", "push habit", "update habit", "move habit", "pull habit", "batch update", "delete", "batch delete",
+])
+def test_writes_are_visible_to_the_next_read(api, cache, kind):
+    async def scenario(client):
+        stack = await create_stack(client)
+        # Cache the stack, well inside the staleness window
+        assert (await read(client, stack["id"])).json() == stack
+        assert (await read(client, stack["id"])).json() == stack
+        written = await _writes(client, stack)[kind]()
+        assert written.status_code == 200
+        return stack, await read(client, stack["id"])
+
+    stack, after = api(scenario)
+    if kind in ("delete", "batch delete"):
+        assert after.status_code == 404
+        return
+    assert after.status_code == 200
+    assert after.json() != stack
+    assert after.json()["updated_at"] != stack["updated_at"]
+
+
+def test_writes_from_other_workers_show_after_the_staleness_window(api, cache, clock):
+    async def scenario(client):
+        stack = await create_stack(client)
+        await read(client, stack["id"])
+        # Another worker writes the stack; this worker's cache is not told
+        await habit_stacks.store.update_stack(
+            "alice", stack["id"], {"name": "elsewhere", "updated_at": datetime.utcnow()}
+        )
+
+        clock.now += MAX_STALENESS - 1
+        assert (await read(client, stack["id"])).json()["name"] == "morning"
+        assert cache.stats()["revalidations"] == 0
+
+        clock.now += 2
+        assert (await read(client, stack["id"])).json()["name"] == "elsewhere"
+        assert cache.stats()["revalidations"] == 1
+
+    api(scenario)
+
+
+def test_unchanged_entries_are_revalidated_then_expire(api, cache, clock):
+    async def scenario(client):
+        stack = await create_stack(client)
+        await read(client, stack["id"])
+
+        clock.now += MAX_STALENESS + 1
+        await read(client, stack["id"])
+        assert (cache.stats()["revalidations"], cache.stats()["hits"]) == (1, 1)
+
+        # Revalidation does not extend the entry's life
+        clock.now = 1000.0 + TTL + 1
+        misses = cache.stats()["misses"]
+        assert (await read(client, stack["id"])).json() == stack
+        assert cache.stats()["misses"] == misses + 1
+        assert cache.stats()["revalidations"] == 1
+
+    api(scenario)
@@ -0,0 +1,124 @@
+"""
+Tests for the habit write coalescer
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from services.coalescer import WriteCoalescer
+from storage.base import HabitOp
+
+NOW = datetime(2024, 1, 1)
+
+
+def push(stack_id, habit_id):
+    return HabitOp("push", "alice", stack_id, NOW, habit={"id": habit_id})
+
+
+def test_operations_in_a_window_share_one_call():
+    calls = []
+
+    async def apply(ops):
+        calls.append([op.habit["id"] for op in ops])
+        return [op.habit["id"].upper() for op in ops]
+
+    async def scenario():
+        coalescer = WriteCoalescer(apply, window=0.005)
+        results = await asyncio.gather(*(coalescer.submit(push("s", f"h{i}")) for i in range(5)))
+        assert results == ["H0", "H1", "H2", "H3", "H4"]
+        assert calls == [["h0", "h1", "h2", "h3", "h4"]]
+        assert coalescer.stats()["batches"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_batches_of_a_stack_run_one_at_a_time_in_order():
+    running, order = [], []
+
+    async def apply(ops):
+        running.append(1)
+        assert len(running) == 1
+        await asyncio.sleep(0.01)
+        order.extend(op.habit["id"] for op in ops)
+        running.pop()
+        return [None] * len(ops)
+
+    async def scenario():
+        coalescer = WriteCoalescer(apply, window=0.001, max_batch=2)
+        await asyncio.gather(*(coalescer.submit(push("s", f"h{i}")) for i in range(5)))
+        assert order == ["h0", "h1", "h2", "h3", "h4"]
+        assert coalescer.stats()["batches"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_stacks_are_written_concurrently():
+    running, peak = [], []
+
+    async def apply(ops):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return [None] * len(ops)
+
+    async def scenario():
+        coalescer = WriteCoalescer(apply, window=0.001, max_batch=1)
+        await asyncio.gather(*(coalescer.submit(push(f"s{i}", "h")) for i in range(5)))
+        assert max(peak) == 5
+
+    asyncio.run(scenario())
+
+
+def test_batches_grow_while_a_write_is_in_flight():
+    # A 10 ms write with a 2 ms window at about 2000 operations a second
+    # over 50 stacks: operations queue behind each write instead of the
+    # writes queueing behind each other
+    sizes = []
+
+    async def apply(ops):
+        sizes.append(len(ops))
+        await asyncio.sleep(0.01)
+        return [None] * len(ops)
+
+    async def scenario():
+        coalescer = WriteCoalescer(apply, window=0.002)
+        loop = asyncio.get_running_loop()
+        latencies = []
+
+        async def timed(op):
+            start = loop.time()
+            await coalescer.submit(op)
+            latencies.append(loop.time() - start)
+
+        tasks = []
+        for i in range(600):
+            tasks.append(asyncio.create_task(timed(push(f"s{i % 50}", f"h{i}"))))
+            if i % 10 == 9:
+                await asyncio.sleep(0.005)
+        await asyncio.gather(*tasks)
+        assert sum(sizes) == 600
+        assert sum(sizes) / len(sizes) > 5
+        assert max(latencies) < 0.1
+        assert coalescer.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_caller_in_the_batch():
+    async def apply(ops):
+        raise RuntimeError("write failed")
+
+    async def scenario():
+        coalescer = WriteCoalescer(apply, window=0.001)
+        results = await asyncio.gather(
+            coalescer.submit(push("s", "a")), coalescer.submit(push("s", "b")), return_exceptions=True
+        )
+        assert all(isinstance(result, RuntimeError) for result in results)
+        # The coalescer keeps working after a failed batch
+        with pytest.raises(RuntimeError):
+            await coalescer.submit(push("s", "c"))
+
+    asyncio.run(scenario())
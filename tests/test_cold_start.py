@@ -0,0 +1,32 @@
+"""
+Cold-start regression tests: a fresh worker must serve its first request
+within budget without loading dependencies it only needs later
+"""
+
+import os
+
+import pytest
+
+from benchmarks.bench_cold_start import format_report, measure_cold_start
+
+# Milliseconds from spawning the interpreter to the first response; about
+# 350 ms on a developer laptop, with headroom for slow CI machines
+COLD_START_BUDGET_MS = float(os.environ.get("COLD_START_BUDGET_MS", "1500"))
+
+# Loaded on first use; importing any of them at startup is a regression
+LAZY_MODULES = {"numpy", "pandas", "boto3", "motor", "pymongo", "bson"}
+
+
+@pytest.fixture(scope="module")
+def cold_start():
+    return measure_cold_start(env={"STORAGE_ENGINE": "embedded", "EMBEDDED_JOURNAL_PATH": ""}, runs=3)
+
+
+def test_first_request_within_budget(cold_start):
+    assert cold_start["status"] == 200
+    assert cold_start["time_to_first_request_ms"] <= COLD_START_BUDGET_MS, format_report(cold_start)
+
+
+def test_heavy_dependencies_are_not_loaded_at_startup(cold_start):
+    loaded = {name.split(".")[0] for name, *_ in cold_start["modules"]}
+    assert not loaded & LAZY_MODULES, format_report(cold_start)
@@ -0,0 +1,102 @@
+"""
+Tests for ETags and conditional GETs on listings, search and single stacks
+"""
+
+import json
+
+import pytest
+
+import routes.habit_stacks as habit_stacks
+
+ALICE = {"X-User-Id": "alice"}
+BOB = {"X-User-Id": "bob"}
+
+
+async def create_stack(client, name="morning", headers=ALICE):
+    response = await client.post(
+        "/api/habit-stacks", json={"name": name, "habits": [{"name": "a"}, {"name": "b"}]}, headers=headers
+    )
+    return response.json()
+
+
+def _if_none_match(variant, etag):
+    return {
+        "strong": etag,
+        "weak": f"W/{etag}",
+        "list": f'"something-else", {etag}',
+        "any": "*",
+    }[variant]
+
+
+@pytest.mark.parametrize("variant", ["strong", "weak", "list", "any"])
+@pytest.mark.parametrize("resource", ["listing", "search", "stack"])
+def test_matching_if_none_match_is_not_modified(api, variant, resource):
+    async def scenario(client):
+        stack = await create_stack(client)
+        url = {
+            "listing": "/api/habit-stacks",
+            "search": "/api/habit-stacks/search?q=morning",
+            "stack": f"/api/habit-stacks/{stack['id']}",
+        }[resource]
+        fresh = await client.get(url, headers=ALICE)
+        etag = fresh.headers["ETag"]
+        cached = await client.get(url, headers={**ALICE, "If-None-Match": _if_none_match(variant, etag)})
+        other = await client.get(url, headers={**ALICE, "If-None-Match": '"something-else"'})
+        return fresh, cached, other
+
+    fresh, cached, other = api(scenario)
+    assert fresh.status_code == 200
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == fresh.headers["ETag"]
+    assert cached.content == b""
+    assert other.status_code == 200
+
+
+def _writes(client, stack):
+    url = f"/api/habit-stacks/{stack['id']}"
+    first, second = (habit["id"] for habit in stack["habits"])
+    body = b"".join(json.dumps({"name": name}).encode() + b"\n" for name in ("x", "y"))
+    return {
+        "create": lambda: client.post("/api/habit-stacks", json={"name": "new"}, headers=ALICE),
+        "batch create": lambda: client.post("/api/habit-stacks:batch", json=[{"name": "new"}], headers=ALICE),
+        "import": lambda: client.post("/api/habit-stacks/import", content=body, headers=ALICE),
+        "update": lambda: client.put(url, json={"name": "renamed"}, headers=ALICE),
+        "batch update": lambda: client.patch(
+            "/api/habit-stacks:batch", json=[{"id": stack["id"], "name": "renamed"}], headers=ALICE
+        ),
+        "push habit": lambda: client.post(f"{url}/habits", json={"name": "c"}, headers=ALICE),
+        "update habit": lambda: client.put(f"{url}/habits/{first}", json={"name": "z"}, headers=ALICE),
+        "move habit": lambda: client.post(f"{url}/habits/{first}/move", json={"after": second}, headers=ALICE),
+        "pull habit": lambda: client.delete(f"{url}/habits/{first}", headers=ALICE),
+        "delete": lambda: client.delete(url, headers=ALICE),
+        "batch delete": lambda: client.request("DELETE", "/api/habit-stacks:batch", json=[stack["id"]], headers=ALICE),
+    }
+
+
+@pytest.mark.parametrize("kind", [
+    "create", "batch create", "import", "update", "batch update", "push habit", "update habit",
+    "move habit", "pull habit", "delete", "batch delete",
+])
+def test_every_write_changes_only_its_users_version(api, kind):
+    async def scenario(client):
+        stack = await create_stack(client)
+        await create_stack(client, headers=BOB)
+        versions = {user: await habit_stacks.store.get_version(user) for user in ("alice", "bob")}
+        listings = {
+            user: (await client.get("/api/habit-stacks", headers=headers)).headers["ETag"]
+            for user, headers in (("alice", ALICE), ("bob", BOB))
+        }
+
+        written = await _writes(client, stack)[kind]()
+        assert written.status_code == 200
+
+        alice = await client.get("/api/habit-stacks", headers={**ALICE, "If-None-Match": listings["alice"]})
+        bob = await client.get("/api/habit-stacks", headers={**BOB, "If-None-Match": listings["bob"]})
+        after = {user: await habit_stacks.store.get_version(user) for user in ("alice", "bob")}
+        return versions, after, alice, bob
+
+    versions, after, alice, bob = api(scenario)
+    assert after["alice"] != versions["alice"]
+    assert after["bob"] == versions["bob"]
+    assert alice.status_code == 200
+    assert bob.status_code == 304
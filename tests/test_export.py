@@ -0,0 +1,81 @@
+"""
+Tests for the streaming NDJSON export
+"""
+
+import asyncio
+import gzip
+import json
+
+import pytest
+
+import routes.habit_stacks as habit_stacks
+from services.export import ndjson_batches
+
+ALICE = {"X-User-Id": "alice"}
+BOB = {"X-User-Id": "bob"}
+CAROL = {"X-User-Id": "carol"}
+
+
+def test_ndjson_batches_chunk_at_batch_size():
+    async def docs():
+        for i in range(7):
+            yield {"i": i}
+
+    async def scenario():
+        return [chunk async for chunk in ndjson_batches(docs(), 3)]
+
+    chunks = asyncio.run(scenario())
+    assert [chunk.count(b"\n") for chunk in chunks] == [3, 3, 1]
+    assert [json.loads(line)["i"] for line in b"".join(chunks).splitlines()] == list(range(7))
+
+
+def habits_of(stack):
+    return [habit["name"] for habit in stack["habits"]]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_export_round_trips_through_the_import(api, monkeypatch, compress):
+    async def scenario(client):
+        stacks = [
+            {"name": f"stack {i}", "habits": [{"name": f"{i}-{habit}"} for habit in "abc"[:i % 3 + 1]]}
+            for i in range(7)
+        ]
+        await client.post("/api/habit-stacks:batch", json=stacks, headers=ALICE)
+        await client.post("/api/habit-stacks:batch", json=[{"name": "not alice's"}] * 2, headers=BOB)
+
+        iter_stacks = habit_stacks.store.iter_stacks
+        batch_sizes = []
+
+        def spy(user_id, batch_size):
+            batch_sizes.append(batch_size)
+            return iter_stacks(user_id, batch_size)
+
+        monkeypatch.setattr(habit_stacks.store, "iter_stacks", spy)
+        url = f"/api/habit-stacks/export?batch_size=3&compress={str(compress).lower()}"
+        exported = await client.get(url, headers=ALICE)
+        body = gzip.decompress(exported.content) if compress else exported.content
+
+        imported = await client.post("/api/habit-stacks/import", content=body, headers=CAROL)
+        originals = (await client.get("/api/habit-stacks", headers=ALICE)).json()
+        copies = (await client.get("/api/habit-stacks", headers=CAROL)).json()
+        return exported, body, batch_sizes, imported, originals, copies
+
+    exported, body, batch_sizes, imported, originals, copies = api(scenario)
+    assert exported.status_code == 200
+    assert exported.headers["content-type"] == ("application/gzip" if compress else "application/x-ndjson")
+    assert batch_sizes == [3]
+
+    lines = [json.loads(line) for line in body.decode().splitlines()]
+    # 7 stacks span three batches of 3; every one of them, and only the caller's
+    assert len(lines) == 7
+    assert {line["id"] for line in lines} == {stack["id"] for stack in originals}
+    assert {line["user_id"] for line in lines} == {"alice"}
+    by_id = {stack["id"]: stack for stack in originals}
+    for line in lines:
+        assert line["name"] == by_id[line["id"]]["name"]
+        assert habits_of(line) == habits_of(by_id[line["id"]])
+
+    assert (imported.json()["accepted"], imported.json()["rejected"]) == (7, 0)
+    assert sorted((stack["name"], habits_of(stack)) for stack in copies) == sorted(
+        (stack["name"], habits_of(stack)) for stack in originals
+    )
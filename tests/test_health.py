@@ -0,0 +1,92 @@
+"""
+Tests for the health probes and the SIGTERM readiness drain
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+import server
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+
+
+def test_liveness_and_readiness(api):
+    async def scenario(client):
+        live = await client.get("/api/health/live")
+        ready = await client.get("/api/health/ready")
+        return live, ready
+
+    live, ready = api(scenario)
+    assert live.status_code == 200 and live.json() == {"status": "alive"}
+    assert ready.status_code == 200
+    assert ready.json() == {"status": "ready", "storage_engine": "embedded"}
+
+
+def test_readiness_fails_when_storage_does_not_answer(api, monkeypatch):
+    async def scenario(client):
+        async def broken_ping():
+            raise ConnectionError("storage down")
+
+        monkeypatch.setattr(server.store, "ping", broken_ping)
+        return await client.get("/api/health/ready"), await client.get("/api/health/live")
+
+    ready, live = api(scenario)
+    assert ready.status_code == 503
+    assert ready.json() == {"status": "unavailable", "error": "storage down"}
+    assert live.status_code == 200
+
+
+def test_readiness_fails_while_not_started_or_draining(api):
+    async def scenario(client):
+        server.app.state.ready = False
+        return await client.get("/api/health/ready")
+
+    response = api(scenario)
+    assert response.status_code == 503
+    assert response.json() == {"status": "not ready"}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_sigterm_fails_readiness_before_uvicorn_stops():
+    port = _free_port()
+    env = {**os.environ, "STORAGE_ENGINE": "embedded", "EMBEDDED_JOURNAL_PATH": "", "SHUTDOWN_DRAIN_DELAY": "1"}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}/api/health/ready"
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                if httpx.get(url).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            assert time.monotonic() < deadline, "server did not become ready"
+            time.sleep(0.05)
+
+        signalled = time.monotonic()
+        process.send_signal(signal.SIGTERM)
+        time.sleep(0.3)
+        draining = httpx.get(url)
+        assert draining.status_code == 503 and draining.json() == {"status": "not ready"}
+        assert process.poll() is None
+
+        process.wait(timeout=10)
+        assert time.monotonic() - signalled >= 1
+    finally:
+        process.kill()
+        process.wait()
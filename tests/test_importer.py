@@ -0,0 +1,122 @@
+"""
+Tests for the streaming NDJSON importer
+"""
+
+import asyncio
+import gzip
+import json
+
+from services.importer import NDJSONImporter, gunzip_stream, iter_lines
+from storage.embedded import EmbeddedStackStore
+
+
+async def stream(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def collect_lines(data: bytes, size: int, max_line_bytes: int = 1 << 20):
+    async def scenario():
+        return [pair async for pair in iter_lines(stream(data, size), max_line_bytes)]
+
+    return asyncio.run(scenario())
+
+
+def ndjson(*rows) -> bytes:
+    return b"".join(row if isinstance(row, bytes) else json.dumps(row).encode() + b"\n" for row in rows)
+
+
+def test_lines_are_split_across_chunk_boundaries():
+    data = b"first\nsecond line\n\nlast"
+    expected = [(1, b"first"), (2, b"second line"), (3, b""), (4, b"last")]
+    for size in (1, 3, 7, len(data)):
+        assert collect_lines(data, size) == expected
+
+
+def test_overlong_lines_are_reported_without_being_buffered():
+    data = b"short\n" + b"x" * 50 + b"\nafter\n" + b"y" * 50
+    for size in (4, 16, len(data)):
+        assert collect_lines(data, size, max_line_bytes=10) == [(1, b"short"), (2, None), (3, b"after"), (4, None)]
+
+
+def test_mixed_valid_and_invalid_lines():
+    async def scenario():
+        store = EmbeddedStackStore()
+        await store.initialize()
+        body = ndjson(
+            {"name": "Morning", "habits": [{"name": "stretch"}, {"name": "coffee"}]},
+            b"not json\n",
+            {"habits": []},
+            b"\n",
+            {"name": "Evening"},
+            b'{"name": "' + b"z" * 300 + b'"}\n',
+        )
+        result = await NDJSONImporter(store, "alice", batch_size=1, max_line_bytes=200).run(stream(body, 5))
+        stacks = await store.list_stacks("alice", 10)
+        return result, stacks
+
+    result, stacks = asyncio.run(scenario())
+    assert (result.accepted, result.rejected) == (2, 3)
+    assert [error.line for error in result.errors] == [2, 3, 6]
+    assert result.errors[1].error.startswith("name:")
+    assert "longer than 200 bytes" in result.errors[2].error
+    assert sorted(stack["name"] for stack in stacks) == ["Evening", "Morning"]
+    morning = next(stack for stack in stacks if stack["name"] == "Morning")
+    assert [habit["name"] for habit in morning["habits"]] == ["stretch", "coffee"]
+
+
+def test_gzip_bodies_are_imported():
+    async def scenario():
+        store = EmbeddedStackStore()
+        await store.initialize()
+        body = gzip.compress(ndjson(*({"name": f"stack {i}"} for i in range(20))))
+        result = await NDJSONImporter(store, "alice", batch_size=7).run(gunzip_stream(stream(body, 16)))
+        return result, await store.list_stacks("alice", 100)
+
+    result, stacks = asyncio.run(scenario())
+    assert (result.accepted, result.rejected) == (20, 0)
+    assert len(stacks) == 20
+
+
+def test_gzip_import_route(api):
+    async def scenario(client):
+        body = gzip.compress(ndjson({"name": "gzipped"}))
+        response = await client.post(
+            "/api/habit-stacks/import", content=body, headers={"Content-Encoding": "gzip", "X-User-Id": "alice"}
+        )
+        corrupt = await client.post(
+            "/api/habit-stacks/import", content=b"not gzip", headers={"Content-Encoding": "gzip", "X-User-Id": "alice"}
+        )
+        listed = await client.get("/api/habit-stacks", headers={"X-User-Id": "alice"})
+        return response, corrupt, listed
+
+    response, corrupt, listed = api(scenario)
+    assert response.status_code == 200 and response.json()["accepted"] == 1
+    assert corrupt.status_code == 400
+    assert [stack["name"] for stack in listed.json()] == ["gzipped"]
+
+
+class SlowStore:
+    """Records how many batch inserts run at once"""
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+        self.batches = 0
+
+    async def insert_stacks(self, docs):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        self.batches += 1
+        return {}
+
+
+def test_in_flight_batches_are_bounded():
+    store = SlowStore()
+    body = ndjson(*({"name": f"stack {i}"} for i in range(40)))
+    result = asyncio.run(NDJSONImporter(store, "alice", batch_size=2, max_in_flight=3).run(stream(body, 64)))
+    assert result.accepted == 40
+    assert store.batches == 20
+    assert store.peak == 3
@@ -0,0 +1,100 @@
+"""
+Tests for the Prometheus metrics endpoint and the registry behind it
+"""
+
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from services.metrics import Metrics
+
+ALICE = {"X-User-Id": "alice"}
+STACK_ROUTE = "/api/habit-stacks/{stack_id}"
+
+# One sample of the Prometheus text format: name, optional labels, value
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{([a-zA-Z_]\w*="[^"]*"(,[a-zA-Z_]\w*="[^"]*")*)?\})? (\S+)$')
+
+
+def parse(text):
+    """Samples keyed by (name, labels) after checking every line's syntax"""
+    samples = {}
+    types = {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+            continue
+        if not line or line.startswith("# HELP "):
+            continue
+        match = SAMPLE.match(line)
+        assert match, f"not a Prometheus sample: {line!r}"
+        name, labels, value = match.group(1), match.group(3) or "", match.group(5)
+        assert re.sub(r"_(bucket|sum|count)$", "", name) in types or name in types, f"no TYPE for {name}"
+        samples[(name, labels)] = float(value)
+    return samples
+
+
+def request_samples(samples, method, route, status):
+    labels = f'method="{method}",route="{route}"'
+    return (
+        samples.get(("http_requests_total", f'{labels},status="{status}"'), 0),
+        samples.get(("http_request_duration_seconds_count", labels), 0),
+    )
+
+
+def test_serving_a_request_moves_its_counter_and_histogram(api):
+    async def scenario(client):
+        created = await client.post("/api/habit-stacks", json={"name": "morning"}, headers=ALICE)
+        stack_id = created.json()["id"]
+        before = await client.get("/api/metrics")
+        await client.get(f"/api/habit-stacks/{stack_id}", headers=ALICE)
+        await client.get(f"/api/habit-stacks/{stack_id}", headers=ALICE)
+        await client.get("/api/habit-stacks/missing", headers=ALICE)
+        after = await client.get("/api/metrics")
+        return before, after
+
+    before, after = api(scenario)
+    assert after.status_code == 200
+    assert after.headers["content-type"].startswith("text/plain; version=0.0.4")
+    old, new = parse(before.text), parse(after.text)
+
+    assert request_samples(new, "GET", STACK_ROUTE, 200)[0] == request_samples(old, "GET", STACK_ROUTE, 200)[0] + 2
+    assert request_samples(new, "GET", STACK_ROUTE, 404)[0] == request_samples(old, "GET", STACK_ROUTE, 404)[0] + 1
+    # Latency is per route, whatever the status; ids never become labels
+    assert request_samples(new, "GET", STACK_ROUTE, 200)[1] == request_samples(old, "GET", STACK_ROUTE, 200)[1] + 3
+    assert not any("missing" in labels for _, labels in new)
+
+    labels = f'method="GET",route="{STACK_ROUTE}"'
+    buckets = [
+        value for (name, sample_labels), value in new.items()
+        if name == "http_request_duration_seconds_bucket" and sample_labels.startswith(labels + ",")
+    ]
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == new[("http_request_duration_seconds_count", labels)]
+    total = ("http_request_duration_seconds_sum", labels)
+    assert new[total] > old.get(total, 0)
+
+
+def test_mongo_listeners_feed_the_registry():
+    pytest.importorskip("pymongo")
+    from services.mongo_metrics import MongoCommandMetrics, PoolCheckoutMetrics
+
+    registry = Metrics()
+    observed = []
+    registry.mongo_observers.append(observed.append)
+    commands = MongoCommandMetrics(registry)
+    commands.succeeded(SimpleNamespace(command_name="find", duration_micros=2000))
+    commands.failed(SimpleNamespace(command_name="find", duration_micros=5000))
+    pool = PoolCheckoutMetrics(registry)
+    pool.connection_check_out_started(None)
+    pool.connection_checked_out(None)
+    pool.connection_check_out_failed(None)
+
+    samples = parse(registry.render())
+    assert samples[("mongodb_command_duration_seconds_count", 'command="find"')] == 2
+    assert samples[("mongodb_command_duration_seconds_sum", 'command="find"')] == pytest.approx(0.007)
+    assert samples[("mongodb_command_errors_total", 'command="find"')] == 1
+    assert samples[("mongodb_pool_checkout_wait_seconds_count", "")] == 1
+    assert samples[("mongodb_pool_checkout_failures_total", "")] == 1
+    assert observed == [0.002, 0.005]
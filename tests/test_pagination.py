@@ -0,0 +1,83 @@
+"""
+Tests for cursor pagination and field projection on the listing route
+"""
+
+ALICE = {"X-User-Id": "alice"}
+BOB = {"X-User-Id": "bob"}
+
+
+async def create_stacks(client, count, headers=ALICE):
+    ids = []
+    for i in range(count):
+        response = await client.post(
+            "/api/habit-stacks", json={"name": f"stack {i}", "habits": [{"name": "a"}]}, headers=headers
+        )
+        ids.append(response.json()["id"])
+    return ids
+
+
+async def all_pages(client, query, headers=ALICE):
+    pages, cursor = [], None
+    while True:
+        params = f"{query}&cursor={cursor}" if cursor else query
+        response = await client.get(f"/api/habit-stacks?{params}", headers=headers)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_cursor_walks_every_stack_once_newest_first(api):
+    async def scenario(client):
+        ids = await create_stacks(client, 7)
+        await create_stacks(client, 2, headers=BOB)
+        return ids, await all_pages(client, "limit=3")
+
+    ids, pages = api(scenario)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    listed = [stack for page in pages for stack in page]
+    assert [stack["id"] for stack in listed] == list(reversed(ids))
+    assert [stack["updated_at"] for stack in listed] == sorted((s["updated_at"] for s in listed), reverse=True)
+
+
+def test_writes_between_pages_neither_repeat_nor_skip_older_stacks(api):
+    async def scenario(client):
+        ids = await create_stacks(client, 5)
+        first = await client.get("/api/habit-stacks?limit=2", headers=ALICE)
+        # A new stack sorts before the cursor and does not shift later pages
+        await create_stacks(client, 1)
+        rest = await client.get(
+            f"/api/habit-stacks?limit=10&cursor={first.headers['X-Next-Cursor']}", headers=ALICE
+        )
+        return ids, first.json(), rest
+
+    ids, first, rest = api(scenario)
+    assert "X-Next-Cursor" not in rest.headers
+    assert [s["id"] for s in first + rest.json()] == list(reversed(ids))
+
+
+def test_fields_project_each_page(api):
+    async def scenario(client):
+        ids = await create_stacks(client, 3)
+        return ids, await all_pages(client, "limit=2&fields=id,name")
+
+    ids, pages = api(scenario)
+    assert [len(page) for page in pages] == [2, 1]
+    listed = [stack for page in pages for stack in page]
+    # Items hold exactly the requested fields; the cursor still pages on
+    # updated_at and id
+    assert all(set(stack) == {"id", "name"} for stack in listed)
+    assert [stack["id"] for stack in listed] == list(reversed(ids))
+
+
+def test_invalid_cursor_and_fields_are_rejected(api):
+    async def scenario(client):
+        bad_cursor = await client.get("/api/habit-stacks?cursor=not-a-cursor", headers=ALICE)
+        bad_fields = await client.get("/api/habit-stacks?fields=name,password", headers=ALICE)
+        return bad_cursor, bad_fields
+
+    bad_cursor, bad_fields = api(scenario)
+    assert bad_cursor.status_code == 400
+    assert bad_fields.status_code == 400
+    assert "password" in bad_fields.json()["detail"]
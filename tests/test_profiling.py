@@ -0,0 +1,80 @@
+"""
+Tests for on-demand request profiling
+"""
+
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from services.profiling import ProfilingMiddleware, sign_profile_request, verify_profile_token
+
+SECRET = "test-secret"
+
+
+async def fake_database_call():
+    await asyncio.sleep(0.05)
+
+
+def build_app(**options):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, secret=SECRET, interval=0.002, **options)
+
+    @app.get("/slow")
+    async def slow_endpoint():
+        await fake_database_call()
+        return {"ok": True}
+
+    return app
+
+
+def fetch(app, path, headers=None):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, headers=headers)
+
+    return asyncio.run(scenario())
+
+
+def test_tokens_are_bound_to_request_and_expire():
+    token = sign_profile_request(SECRET, "GET", "/slow")
+    assert verify_profile_token(SECRET, token, "GET", "/slow")
+    assert not verify_profile_token(SECRET, token, "POST", "/slow")
+    assert not verify_profile_token(SECRET, token, "GET", "/other")
+    assert not verify_profile_token("other-secret", token, "GET", "/slow")
+    assert not verify_profile_token(SECRET, sign_profile_request(SECRET, "GET", "/slow", ttl=-1), "GET", "/slow")
+    assert not verify_profile_token(SECRET, "garbage", "GET", "/slow")
+
+
+def test_inline_profile_attributes_awaits_to_their_caller():
+    headers = {"X-Profile": sign_profile_request(SECRET, "GET", "/slow"), "X-Profile-Output": "inline"}
+    response = fetch(build_app(), "/slow", headers)
+    assert response.status_code == 200
+    assert response.headers["x-profiled-status"] == "200"
+    assert response.headers["content-type"].startswith("text/plain")
+
+    stacks = [line.rsplit(" ", 1) for line in response.text.splitlines()]
+    assert stacks and all(count.isdigit() for _, count in stacks)
+    awaiting = [stack for stack, _ in stacks if "fake_database_call" in stack]
+    assert awaiting
+    assert all(stack.index("slow_endpoint") < stack.index("fake_database_call") for stack in awaiting)
+    # Suspended samples end in the awaited future
+    assert any(stack.rsplit(";", 1)[-1].startswith("<await ") for stack in awaiting)
+
+
+def test_sampled_profiles_are_written_to_directory(tmp_path):
+    response = fetch(build_app(sample_rate=1.0, directory=str(tmp_path)), "/slow")
+    assert response.json() == {"ok": True}
+    profile = tmp_path / f"{response.headers['x-profile-id']}.collapsed"
+    assert "slow_endpoint" in profile.read_text()
+
+
+def test_unsigned_requests_are_not_profiled(tmp_path):
+    app = build_app(directory=str(tmp_path))
+    forged = f"{int(time.time()) + 60}.{'0' * 64}"
+    response = fetch(app, "/slow", {"X-Profile": forged, "X-Profile-Output": "inline"})
+    assert response.json() == {"ok": True}
+    assert "x-profile-id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
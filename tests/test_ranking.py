@@ -0,0 +1,161 @@
+"""
+Tests for the habit rank keys used to reorder habits
+"""
+
+import random
+
+import pytest
+
+import services.ranking as ranking
+from services.ranking import (
+    ahead_of_clock, assign_ranks, observe_rank, order_habits, plan_move, rank_between, slot_ranks
+)
+
+
+def test_slot_ranks_increase_across_calls():
+    ranks = slot_ranks(3) + slot_ranks(2)
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == 5
+
+
+def test_rank_between_stays_inside_the_interval():
+    rng = random.Random(7)
+    ranks = slot_ranks(4)
+    for _ in range(1000):
+        i = rng.randrange(len(ranks) + 1)
+        low = ranks[i - 1] if i > 0 else None
+        high = ranks[i] if i < len(ranks) else None
+        rank = rank_between(low, high)
+        assert (low is None or low < rank) and (high is None or rank < high)
+        assert not rank.endswith("0")
+        ranks.insert(i, rank)
+    assert ranks == sorted(ranks)
+
+
+def test_rank_between_rejects_empty_intervals():
+    with pytest.raises(ValueError):
+        rank_between("b", "b")
+
+
+def test_order_habits_sorts_by_rank_and_renumbers():
+    habits = assign_ranks([{"id": x, "name": x, "order": 0} for x in "abc"])
+    habits[0]["rank"] = rank_between(habits[2]["rank"], None)
+    doc = order_habits({"id": "s", "habits": habits})
+    assert [(h["id"], h["order"]) for h in doc["habits"]] == [("b", 0), ("c", 1), ("a", 2)]
+    assert order_habits(doc) is doc
+
+
+def test_plan_move_touches_only_the_moved_habit():
+    habits = assign_ranks([{"id": x, "name": x, "order": i} for i, x in enumerate("abcd")])
+    rank, rewritten = plan_move(habits, "d", before="b")
+    assert rewritten is None
+    assert habits[0]["rank"] < rank < habits[1]["rank"]
+
+    rank, _ = plan_move(habits, "a", after="d")
+    assert rank > habits[3]["rank"]
+
+    with pytest.raises(KeyError):
+        plan_move(habits, "a", after="missing")
+
+
+def test_plan_move_ranks_legacy_stacks():
+    habits = [{"id": x, "name": x, "order": i} for i, x in enumerate("abc")]
+    rank, rewritten = plan_move(habits, "c", before="a")
+    assert [h["id"] for h in rewritten] == ["c", "a", "b"]
+    assert rewritten[0]["rank"] == rank
+    assert [h["rank"] for h in rewritten] == sorted(h["rank"] for h in rewritten)
+
+
+def test_move_to_the_end_then_append():
+    habits = assign_ranks([{"id": x, "name": x, "order": i} for i, x in enumerate("abc")])
+    habits[0]["rank"], _ = plan_move(habits, "a", after="c")
+    habits.append({"id": "d", "name": "d", "rank": slot_ranks(1)[0]})
+    assert [h["id"] for h in order_habits({"habits": habits})["habits"]] == ["b", "c", "a", "d"]
+
+
+def test_repeated_moves_to_the_end_then_batch_append():
+    habits = assign_ranks([{"id": x, "name": x, "order": i} for i, x in enumerate("abc")])
+    for habit_id in "abab":
+        rank, _ = plan_move(habits, habit_id, after=order_habits({"habits": habits})["habits"][-1]["id"])
+        next(h for h in habits if h["id"] == habit_id)["rank"] = rank
+    habits += assign_ranks([{"id": x, "name": x} for x in "de"])
+    assert [h["id"] for h in order_habits({"habits": habits})["habits"]] == ["c", "a", "b", "d", "e"]
+
+
+def test_move_then_append_through_the_api(api):
+    async def scenario(client):
+        response = await client.post("/api/habit-stacks", json={"name": "s", "habits": [{"name": x} for x in "abc"]})
+        stack = response.json()
+        ids = {h["name"]: h["id"] for h in stack["habits"]}
+        url = f"/api/habit-stacks/{stack['id']}/habits"
+        await client.post(f"{url}/{ids['a']}/move", json={"after": ids["c"]})
+        await client.post(url, json={"name": "d"})
+        return (await client.get(f"/api/habit-stacks/{stack['id']}")).json()
+
+    stack = api(scenario)
+    assert [h["name"] for h in stack["habits"]] == ["b", "c", "a", "d"]
+
+
+def test_observed_ranks_move_the_clock_forward(monkeypatch):
+    rank = slot_ranks(1)[0]
+    # The clock steps back an hour, as after an NTP correction or on a
+    # worker whose clock lags
+    now = ranking.time.time_ns()
+    monkeypatch.setattr(ranking.time, "time_ns", lambda: now - 3600 * 10**9)
+    monkeypatch.setattr(ranking, "_last_slot", 0)
+    assert slot_ranks(1)[0] < rank
+    assert ahead_of_clock(rank)
+
+    observe_rank(rank)
+    assert not ahead_of_clock(rank)
+    assert slot_ranks(1)[0] > rank
+    assert slot_ranks(1)[0] > rank_between(rank, None)
+
+
+def test_append_after_the_clock_stepped_back_stays_last(api, monkeypatch):
+    async def scenario(client):
+        response = await client.post("/api/habit-stacks", json={"name": "s", "habits": [{"name": x} for x in "ab"]})
+        stack = response.json()
+        url = f"/api/habit-stacks/{stack['id']}/habits"
+
+        now = ranking.time.time_ns()
+        monkeypatch.setattr(ranking.time, "time_ns", lambda: now - 3600 * 10**9)
+        monkeypatch.setattr(ranking, "_last_slot", 0)
+        appended = (await client.post(url, json={"name": "c"})).json()
+        # Later appends use the clock moved past the stack's ranks
+        await client.post(url, json={"name": "d"})
+        return appended, (await client.get(f"/api/habit-stacks/{stack['id']}")).json()
+
+    appended, stack = api(scenario)
+    assert [h["name"] for h in appended["habits"]] == ["a", "b", "c"]
+    assert [h["name"] for h in stack["habits"]] == ["a", "b", "c", "d"]
+    assert [h["order"] for h in stack["habits"]] == [0, 1, 2, 3]
+
+
+def test_created_stack_reports_habit_positions(api):
+    async def scenario(client):
+        response = await client.post("/api/habit-stacks", json={"name": "s", "habits": [{"name": x} for x in "abc"]})
+        created = response.json()
+        fetched = (await client.get(f"/api/habit-stacks/{created['id']}")).json()
+        return created, fetched
+
+    created, fetched = api(scenario)
+    assert [h["order"] for h in created["habits"]] == [0, 1, 2]
+    assert created["habits"] == fetched["habits"]
+
+
+def test_habit_order_cannot_be_set_directly(api):
+    async def scenario(client):
+        response = await client.post("/api/habit-stacks", json={"name": "s", "habits": [{"name": x} for x in "ab"]})
+        stack = response.json()
+        habit = stack["habits"][0]
+        url = f"/api/habit-stacks/{stack['id']}/habits/{habit['id']}"
+        rejected = await client.put(url, json={"order": 1})
+        renamed = await client.put(url, json={"name": "z"})
+        return rejected, renamed
+
+    rejected, renamed = api(scenario)
+    assert rejected.status_code == 400
+    assert "move" in rejected.json()["detail"]
+    assert renamed.status_code == 200
+    assert [h["name"] for h in renamed.json()["habits"]] == ["z", "b"]
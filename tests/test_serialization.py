@@ -0,0 +1,90 @@
+"""
+Tests for response content negotiation and compression
+"""
+
+import asyncio
+import gzip
+from datetime import datetime
+
+import httpx
+import msgpack
+from fastapi import FastAPI
+
+from services.serialization import ContentNegotiationMiddleware, NegotiatedResponse, json_response, negotiate
+
+NOW = datetime(2024, 1, 1, 12, 30)
+
+
+def build_app():
+    app = FastAPI(default_response_class=NegotiatedResponse)
+    app.add_middleware(ContentNegotiationMiddleware)
+
+    @app.get("/small")
+    async def small():
+        return {"name": "stack", "created_at": NOW}
+
+    @app.get("/large")
+    async def large():
+        return json_response([{"id": i, "name": "stack", "updated_at": NOW} for i in range(200)], headers={"ETag": '"v1"'})
+
+    return app
+
+
+def fetch(path, headers):
+    async def scenario():
+        transport = httpx.ASGITransport(app=build_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, headers=headers)
+
+    return asyncio.run(scenario())
+
+
+def test_negotiate():
+    assert negotiate("", "") == ("application/json", False)
+    assert negotiate("application/msgpack", "gzip, br") == ("application/msgpack", True)
+    assert negotiate("application/json, application/msgpack;q=0.5", "") == ("application/json", False)
+    assert negotiate("application/x-msgpack, */*;q=0.1", "gzip;q=0") == ("application/msgpack", False)
+    assert negotiate("*/*", "*") == ("application/json", True)
+
+
+def test_msgpack_matches_json():
+    as_json = fetch("/small", {"Accept-Encoding": "identity"})
+    as_msgpack = fetch("/small", {"Accept": "application/msgpack", "Accept-Encoding": "identity"})
+    assert as_msgpack.headers["content-type"] == "application/msgpack"
+    assert as_msgpack.headers["vary"] == "Accept, Accept-Encoding"
+    assert msgpack.unpackb(as_msgpack.content) == as_json.json() == {"name": "stack", "created_at": "2024-01-01T12:30:00"}
+
+
+def test_large_responses_are_gzipped_with_weak_etag():
+    response = fetch("/large", {"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert len(response.json()) == 200
+
+    raw = fetch("/large", {"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers
+    assert raw.headers["etag"] == '"v1"'
+    assert len(gzip.compress(raw.content)) < len(raw.content)
+
+
+def test_small_responses_are_not_compressed():
+    response = fetch("/small", {"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+
+def test_predefined_routines_are_negotiated(api):
+    async def scenario(client):
+        identity = {"Accept-Encoding": "identity"}
+        as_json = await client.get("/api/predefined-routines", headers=identity)
+        as_msgpack = await client.get("/api/predefined-routines", headers={"Accept": "application/msgpack", **identity})
+        gzipped = await client.get("/api/predefined-routines", headers={"Accept-Encoding": "gzip"})
+        return as_json, as_msgpack, gzipped
+
+    as_json, as_msgpack, gzipped = api(scenario)
+    assert as_json.headers["content-type"] == "application/json"
+    assert as_msgpack.headers["content-type"] == "application/msgpack"
+    assert as_msgpack.headers["vary"] == "Accept, Accept-Encoding"
+    assert msgpack.unpackb(as_msgpack.content) == as_json.json()
+    assert as_msgpack.headers["etag"] == f"W/{as_json.headers['etag']}"
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.json() == as_json.json()
@@ -0,0 +1,643 @@
+"""
+Conformance tests shared by every storage engine
+
+Each test runs against the embedded engine (in memory and journaled) and
+the Motor engine, with habits embedded in stacks or in their own
+collection. The Motor engines use mongomock-motor unless TEST_MONGO_URL
+points at a real mongod.
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage.base import LEGACY_USER_ID, HabitOp
+from storage.embedded import EmbeddedStackStore
+from storage.mongo import (
+    CHECK_INS_COLLECTION, SUMMARIES_COLLECTION, MotorStackStore, _advance_pipeline, _search_pipeline
+)
+from storage.mongo_habits import HabitCollectionStackStore
+
+
+def _motor_database():
+    if os.environ.get("TEST_MONGO_URL"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ["TEST_MONGO_URL"])
+    else:
+        mongomock_motor = pytest.importorskip("mongomock_motor")
+        client = mongomock_motor.AsyncMongoMockClient()
+    return client[f"conformance_{uuid.uuid4().hex[:8]}"]
+
+
+@pytest.fixture(params=["embedded", "embedded-journal", "mongo", "mongo-habits"])
+def store(request, tmp_path):
+    if request.param == "embedded":
+        return EmbeddedStackStore()
+    if request.param == "embedded-journal":
+        return EmbeddedStackStore(journal_path=tmp_path / "stacks.journal")
+    if request.param == "mongo-habits":
+        return HabitCollectionStackStore(_motor_database())
+    return MotorStackStore(_motor_database())
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+BASE_TIME = datetime(2024, 1, 1, 12, 0, 0)
+USER = "alice"
+
+
+def make_stack(name, minutes=0, habits=("a", "b")):
+    when = BASE_TIME + timedelta(minutes=minutes)
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": USER,
+        "name": name,
+        "habits": [{"id": str(uuid.uuid4()), "name": habit, "order": i} for i, habit in enumerate(habits)],
+        "created_at": when,
+        "updated_at": when,
+    }
+
+
+def test_insert_and_get(store):
+    async def scenario():
+        await store.initialize()
+        doc = make_stack("morning")
+        assert await store.insert_stacks([doc]) == {}
+        fetched = await store.get_stack(USER, doc["id"])
+        assert fetched == doc
+        assert await store.get_stack(USER, "missing") is None
+        assert await store.get_stack(USER, doc["id"], ["updated_at"]) == {"updated_at": doc["updated_at"]}
+        await store.close()
+    run(scenario())
+
+
+def test_duplicate_ids_are_reported_per_item(store):
+    async def scenario():
+        await store.initialize()
+        first, second = make_stack("one"), make_stack("two")
+        errors = await store.insert_stacks([first, dict(first), second])
+        assert list(errors) == [1]
+        assert await store.get_stack(USER, second["id"]) is not None
+        await store.close()
+    run(scenario())
+
+
+def test_list_is_keyset_paginated_newest_first(store):
+    async def scenario():
+        await store.initialize()
+        docs = [make_stack(f"s{i}", minutes=i) for i in range(5)]
+        await store.insert_stacks(docs)
+        first_page = await store.list_stacks(USER, 2)
+        assert [d["name"] for d in first_page] == ["s4", "s3"]
+        last = first_page[-1]
+        second_page = await store.list_stacks(USER, 10, after=(last["updated_at"], last["id"]), fields=["name"])
+        assert [d["name"] for d in second_page] == ["s2", "s1", "s0"]
+        assert set(second_page[0]) == {"id", "updated_at", "name"}
+        await store.close()
+    run(scenario())
+
+
+def test_update_stack_and_batch_update(store):
+    async def scenario():
+        await store.initialize()
+        doc = make_stack("old")
+        await store.insert_stacks([doc])
+        later = BASE_TIME + timedelta(hours=1)
+        updated = await store.update_stack(USER, doc["id"], {"name": "new", "updated_at": later})
+        assert updated["name"] == "new" and updated["updated_at"] == later
+        assert await store.update_stack(USER, "missing", {"name": "x"}) is None
+
+        errors = await store.update_stacks(USER, [(doc["id"], {"name": "batched"}), ("missing", {"name": "x"})])
+        assert errors == {"missing": "Habit stack not found"}
+        assert (await store.get_stack(USER, doc["id"]))["name"] == "batched"
+        await store.close()
+    run(scenario())
+
+
+def test_habit_operations(store):
+    async def scenario():
+        await store.initialize()
+        doc = make_stack("habits", habits=("a",))
+        await store.insert_stacks([doc])
+        habit_id = doc["habits"][0]["id"]
+        now = BASE_TIME + timedelta(hours=1)
+
+        pushed = await store.push_habit(USER, doc["id"], {"id": "h2", "name": "b", "order": 1}, now)
+        assert [h["name"] for h in pushed["habits"]] == ["a", "b"]
+        assert await store.push_habit(USER, "missing", {"id": "h3", "name": "c", "order": 2}, now) is None
+
+        changed = await store.update_habit(USER, doc["id"], habit_id, {"name": "A"}, now)
+        assert changed["habits"][0] == {"id": habit_id, "name": "A", "order": 0}
+        assert await store.update_habit(USER, doc["id"], "missing", {"name": "x"}, now) is None
+
+        assert await store.pull_habit(USER, doc["id"], habit_id, now) is True
+        assert await store.pull_habit(USER, doc["id"], habit_id, now) is False
+        assert await store.pull_habit(USER, "missing", habit_id, now) is None
+        assert [h["id"] for h in (await store.get_stack(USER, doc["id"]))["habits"]] == ["h2"]
+        await store.close()
+    run(scenario())
+
+
+def test_conditional_updates_detect_conflicts(store):
+    async def scenario():
+        await store.initialize()
+        doc = make_stack("guarded")
+        await store.insert_stacks([doc])
+        later = BASE_TIME + timedelta(hours=1)
+        stale = BASE_TIME - timedelta(hours=1)
+        habit_id = doc["habits"][0]["id"]
+
+        assert await store.update_stack(USER, doc["id"], {"name": "x"}, expected_updated_at=stale) is None
+        assert await store.update_habit(USER, doc["id"], habit_id, {"rank": "V"}, later, expected_updated_at=stale) is None
+        assert (await store.get_stack(USER, doc["id"]))["name"] == "guarded"
+
+        updated = await store.update_habit(
+            USER, doc["id"], habit_id, {"rank": "V"}, doc["updated_at"], expected_updated_at=doc["updated_at"]
+        )
+        # Engines may return habits in rank order rather than array order
+        assert {h["id"]: h for h in updated["habits"]}[habit_id]["rank"] == "V"
+
+        # Once another write moves updated_at, the old value conflicts
+        await store.update_stack(USER, doc["id"], {"updated_at": later})
+        assert await store.update_stack(USER, doc["id"], {"name": "x"}, expected_updated_at=doc["updated_at"]) is None
+        assert (await store.get_stack(USER, doc["id"]))["name"] == "guarded"
+        await store.close()
+    run(scenario())
+
+
+def test_delete_and_iterate(store):
+    async def scenario():
+        await store.initialize()
+        docs = [make_stack(f"s{i}", minutes=i) for i in range(3)]
+        await store.insert_stacks(docs)
+        assert await store.delete_stacks(USER, [docs[0]["id"], "missing"]) == {docs[0]["id"]}
+        remaining = [doc async for doc in store.iter_stacks(USER, batch_size=1)]
+        assert sorted(d["name"] for d in remaining) == ["s1", "s2"]
+        await store.close()
+    run(scenario())
+
+
+def test_returned_documents_are_not_shared(store):
+    async def scenario():
+        await store.initialize()
+        doc = make_stack("isolated")
+        await store.insert_stacks([doc])
+        fetched = await store.get_stack(USER, doc["id"])
+        fetched["habits"][0]["name"] = "mutated"
+        assert (await store.get_stack(USER, doc["id"]))["habits"][0]["name"] == "a"
+        await store.close()
+    run(scenario())
+
+
+def test_stacks_are_scoped_to_their_owner(store):
+    async def scenario():
+        await store.initialize()
+        mine = make_stack("mine")
+        theirs = dict(make_stack("theirs", minutes=1), user_id="bob")
+        await store.insert_stacks([mine, theirs])
+        habit_id = mine["habits"][0]["id"]
+        now = BASE_TIME + timedelta(hours=1)
+
+        assert [d["name"] for d in await store.list_stacks(USER, 10)] == ["mine"]
+        assert [d["name"] async for d in store.iter_stacks("bob", 10)] == ["theirs"]
+        assert await store.get_stack("bob", mine["id"]) is None
+        assert await store.update_stack("bob", mine["id"], {"name": "x"}) is None
+        assert await store.update_stacks("bob", [(mine["id"], {"name": "x"})]) == {mine["id"]: "Habit stack not found"}
+        assert await store.push_habit("bob", mine["id"], {"id": "h", "name": "x", "order": 2}, now) is None
+        assert await store.update_habit("bob", mine["id"], habit_id, {"name": "x"}, now) is None
+        assert await store.has_habit("bob", mine["id"], habit_id) is None
+        assert await store.list_habits("bob", mine["id"], 10) is None
+        assert await store.pull_habit("bob", mine["id"], habit_id, now) is None
+        assert await store.delete_stacks("bob", [mine["id"]]) == set()
+        assert await store.get_stack(USER, mine["id"]) == mine
+        await store.close()
+    run(scenario())
+
+
+def test_stacks_without_owner_belong_to_legacy_user():
+    async def scenario():
+        database = _motor_database()
+        legacy = make_stack("legacy")
+        del legacy["user_id"]
+        await database.habit_stacks.insert_one(dict(legacy))
+
+        store = MotorStackStore(database)
+        await store.initialize()
+        assert await store.get_stack(LEGACY_USER_ID, legacy["id"]) is None
+        assert await store.migrate() == 1
+        assert await store.get_stack(LEGACY_USER_ID, legacy["id"]) == dict(legacy, user_id=LEGACY_USER_ID)
+        assert await store.migrate() == 0
+        await store.close()
+    run(scenario())
+
+
+def test_version_changes_on_bump(store):
+    async def scenario():
+        await store.initialize()
+        before = await store.get_version(USER)
+        other = await store.get_version("bob")
+        await store.bump_version(USER)
+        assert await store.get_version(USER) != before
+        # Versions are per user, so other users' ETags stay valid
+        assert await store.get_version("bob") == other
+        await store.close()
+    run(scenario())
+
+
+def test_status_checks(store):
+    async def scenario():
+        await store.initialize()
+        await store.add_status_check({"id": "1", "client_name": "probe", "timestamp": BASE_TIME})
+        assert await store.list_status_checks(10) == [
+            {"id": "1", "client_name": "probe", "timestamp": BASE_TIME}
+        ]
+        await store.close()
+    run(scenario())
+
+
+def test_embedded_journal_survives_restart(tmp_path):
+    async def scenario():
+        path = tmp_path / "stacks.journal"
+        store = EmbeddedStackStore(journal_path=path, compact_ratio=0.001)
+        await store.initialize()
+        docs = [make_stack(f"s{i}", minutes=i) for i in range(3)]
+        await store.insert_stacks(docs)
+        await store.push_habit(USER, docs[0]["id"], {"id": "h", "name": "c", "order": 2}, BASE_TIME + timedelta(hours=1))
+        await store.delete_stacks(USER, [docs[1]["id"]])
+        await store.close()
+        # Simulate a crash in the middle of a write
+        with path.open("a") as f:
+            f.write('{"op":"put","doc":{"id"')
+
+        reopened = EmbeddedStackStore(journal_path=path)
+        await reopened.initialize()
+        listed = await reopened.list_stacks(USER, 10)
+        assert [d["name"] for d in listed] == ["s0", "s2"]
+        assert [h["name"] for h in listed[0]["habits"]] == ["a", "b", "c"]
+
+        # Writes after recovery must land on a clean line
+        await reopened.insert_stacks([make_stack("s3", minutes=3)])
+        await reopened.close()
+        recovered = EmbeddedStackStore(journal_path=path)
+        await recovered.initialize()
+        assert [d["name"] for d in await recovered.list_stacks(USER, 10)] == ["s0", "s3", "s2"]
+        await recovered.close()
+    run(scenario())
+
+
+def test_search_ranks_and_paginates(store):
+    # mongomock does not implement $text, so the Motor engines' search only
+    # runs here against a real mongod; test_search_pipeline_limits_after_the_cursor
+    # covers the shape of the query meanwhile
+    if isinstance(store, MotorStackStore) and not os.environ.get("TEST_MONGO_URL"):
+        pytest.skip("mongomock does not implement $text; set TEST_MONGO_URL to run")
+
+    async def scenario():
+        await store.initialize()
+        morning = make_stack("Morning routine", habits=("stretch", "coffee"))
+        evening = make_stack("Evening", habits=("morning prep", "read"))
+        other = make_stack("Workout", habits=("run",))
+        await store.insert_stacks([morning, evening, other])
+
+        hits = await store.search_stacks(USER, "morning", 10)
+        assert [hit["id"] for hit in hits] == [morning["id"], evening["id"]]
+        assert hits[0]["score"] > hits[1]["score"]
+        assert set(hits[0]) == {"id", "name", "updated_at", "score"}
+
+        first = await store.search_stacks(USER, "morning", 1, fields=["habits"])
+        assert set(first[0]) == {"id", "habits", "score"}
+        rest = await store.search_stacks(USER, "morning", 10, after=(first[0]["score"], first[0]["id"]))
+        assert [hit["id"] for hit in rest] == [evening["id"]]
+
+        # The index follows writes
+        await store.update_stack(USER, other["id"], {"name": "Morning run"})
+        await store.delete_stacks(USER, [evening["id"]])
+        hits = await store.search_stacks(USER, "morning", 10)
+        assert {hit["id"] for hit in hits} == {morning["id"], other["id"]}
+        assert await store.search_stacks(USER, "nothing matches", 10) == []
+        await store.close()
+    run(scenario())
+
+
+def test_search_pipeline_limits_after_the_cursor():
+    pipeline = _search_pipeline(USER, "morning", 11, (1.5, "stack-id"), {"_id": 0, "id": 1, "score": 1})
+    stages = [next(iter(stage)) for stage in pipeline]
+    assert stages == ["$match", "$addFields", "$match", "$sort", "$limit", "$project"]
+    assert pipeline[0]["$match"] == {"user_id": USER, "$text": {"$search": "morning"}}
+    assert pipeline[2]["$match"] == {"$or": [
+        {"score": {"$lt": 1.5}},
+        {"score": 1.5, "id": {"$gt": "stack-id"}},
+    ]}
+    assert pipeline[3]["$sort"] == {"score": -1, "id": 1}
+    assert pipeline[4]["$limit"] == 11
+
+    first_page = [next(iter(stage)) for stage in _search_pipeline(USER, "morning", 11, None, {})]
+    assert first_page == ["$match", "$addFields", "$sort", "$limit", "$project"]
+
+
+def test_check_ins_maintain_streaks(store):
+    async def scenario():
+        await store.initialize()
+        stack = make_stack("daily")
+        first, second = (habit["id"] for habit in stack["habits"])
+        await store.insert_stacks([stack])
+
+        for day in ("2024-01-30", "2024-01-31", "2024-02-01"):
+            recorded, habit, total = await store.add_check_in(stack["id"], first, day)
+            assert recorded
+        assert (habit["current_streak"], habit["longest_streak"], habit["completions"]) == (3, 3, 3)
+        assert habit["last_day"] == "2024-02-01"
+
+        recorded, habit, _ = await store.add_check_in(stack["id"], first, "2024-01-31")
+        assert not recorded and habit["completions"] == 3
+
+        # A gap restarts the current streak but keeps the longest
+        _, habit, _ = await store.add_check_in(stack["id"], first, "2024-02-05")
+        assert (habit["current_streak"], habit["longest_streak"]) == (1, 3)
+
+        # Backfilling the gap joins both runs
+        for day in ("2024-02-02", "2024-02-04", "2024-02-03"):
+            _, habit, _ = await store.add_check_in(stack["id"], first, day)
+        assert (habit["current_streak"], habit["longest_streak"], habit["completions"]) == (7, 7, 7)
+        assert habit["last_day"] == "2024-02-05"
+
+        # The stack streak counts days with any check-in
+        _, _, total = await store.add_check_in(stack["id"], second, "2024-02-05")
+        assert (total["current_streak"], total["completions"]) == (7, 8)
+
+        streaks = await store.get_streaks(stack["id"])
+        assert set(streaks) == {None, first, second}
+        assert streaks[second]["current_streak"] == 1
+        assert await store.list_check_ins(stack["id"], first, "2024-01-31", "2024-02-02") == [
+            "2024-01-31", "2024-02-01", "2024-02-02"
+        ]
+        assert await store.get_streaks("missing") == {}
+        await store.close()
+    run(scenario())
+
+
+@pytest.mark.parametrize("written", ["bucket", "habit summary"])
+def test_repeated_check_in_completes_an_interrupted_one(written):
+    async def scenario():
+        database = _motor_database()
+        store = MotorStackStore(database)
+        await store.initialize()
+        stack = make_stack("daily", habits=("a",))
+        habit_id = stack["habits"][0]["id"]
+        await store.insert_stacks([stack])
+        await store.add_check_in(stack["id"], habit_id, "2024-01-01")
+
+        # A writer died after recording the day, and maybe updating the habit's summary
+        await database[CHECK_INS_COLLECTION].update_one(
+            {"_id": f"{stack['id']}|{habit_id}|2024-01"}, {"$addToSet": {"days": "2024-01-02"}}
+        )
+        if written == "habit summary":
+            await database[SUMMARIES_COLLECTION].update_one(
+                {"_id": f"{stack['id']}|{habit_id}"},
+                _advance_pipeline(stack["id"], habit_id, "2024-01-02", "2024-01", 2)
+            )
+
+        for _ in range(2):
+            recorded, habit, total = await store.add_check_in(stack["id"], habit_id, "2024-01-02")
+            assert not recorded
+            assert (habit["completions"], habit["current_streak"]) == (2, 2)
+            assert (total["completions"], total["current_streak"]) == (2, 2)
+        await store.close()
+    run(scenario())
+
+
+def test_deleting_stacks_and_habits_drops_their_check_ins(store):
+    async def scenario():
+        await store.initialize()
+        stack, other = make_stack("daily"), make_stack("other", habits=("c",))
+        first, second = (habit["id"] for habit in stack["habits"])
+        await store.insert_stacks([stack, other])
+        for habit_id in (first, second):
+            await store.add_check_in(stack["id"], habit_id, "2024-01-01")
+        await store.add_check_in(other["id"], other["habits"][0]["id"], "2024-01-01")
+
+        assert await store.pull_habit(USER, stack["id"], first, BASE_TIME) is True
+        assert await store.list_check_ins(stack["id"], first, "2024-01-01", "2024-01-31") == []
+        assert first not in await store.get_streaks(stack["id"])
+        assert set(await store.list_stack_check_ins(stack["id"], "2024-01-01", "2024-01-31")) == {second}
+
+        assert await store.delete_stacks(USER, [stack["id"]]) == {stack["id"]}
+        assert await store.get_streaks(stack["id"]) == {}
+        # A stack imported again under the same id starts without history
+        await store.insert_stacks([stack])
+        assert await store.list_stack_check_ins(stack["id"], "2024-01-01", "2024-01-31") == {}
+        assert set(await store.get_streaks(other["id"])) == {None, other["habits"][0]["id"]}
+        await store.close()
+    run(scenario())
+
+
+def test_backfill_reads_only_the_months_its_run_spans():
+    async def scenario():
+        store = MotorStackStore(_motor_database())
+        await store.initialize()
+        stack = make_stack("daily", habits=("a",))
+        habit_id = stack["habits"][0]["id"]
+        await store.insert_stacks([stack])
+        for day in ("2023-11-10", "2024-01-01", "2024-01-31", "2024-02-02", "2024-02-03"):
+            await store.add_check_in(stack["id"], habit_id, day)
+
+        month_days = store._month_days
+        read = []
+
+        async def spy(stack_id, summary_habit_id, month):
+            read.append((summary_habit_id, month))
+            return await month_days(stack_id, summary_habit_id, month)
+
+        store._month_days = spy
+        _, habit, total = await store.add_check_in(stack["id"], habit_id, "2024-02-01")
+        assert (habit["current_streak"], habit["longest_streak"], habit["completions"]) == (4, 4, 6)
+        assert (total["current_streak"], total["longest_streak"], total["completions"]) == (4, 4, 6)
+        # The run from January 31st to February 3rd, not the history before it
+        assert len(read) == 4
+        assert set(read) == {(owner, month) for owner in (habit_id, None) for month in ("2024-01", "2024-02")}
+        await store.close()
+    run(scenario())
+
+
+def test_backfill_joins_a_check_in_that_landed_after_its_run_was_read():
+    async def scenario():
+        database = _motor_database()
+        store = MotorStackStore(database)
+        await store.initialize()
+        stack = make_stack("daily", habits=("a",))
+        habit_id = stack["habits"][0]["id"]
+        await store.insert_stacks([stack])
+        for day in ("2024-01-01", "2024-01-02", "2024-01-04"):
+            await store.add_check_in(stack["id"], habit_id, day)
+        await database[CHECK_INS_COLLECTION].update_one(
+            {"_id": f"{stack['id']}|{habit_id}|2024-01"}, {"$addToSet": {"days": "2024-01-03"}}
+        )
+
+        # The run was read before January 4th was recorded
+        run_around = store._run_around
+        runs = [("2024-01-01", "2024-01-03")]
+
+        async def stale_once(stack_id, summary_habit_id, day):
+            return runs.pop() if runs else await run_around(stack_id, summary_habit_id, day)
+
+        store._run_around = stale_once
+        await store._merge_backfill(stack["id"], habit_id, "2024-01-03")
+        habit = (await store.get_streaks(stack["id"]))[habit_id]
+        assert (habit["current_streak"], habit["longest_streak"], habit["completions"]) == (4, 4, 3)
+        await store.close()
+    run(scenario())
+
+
+def test_apply_habit_ops_keeps_per_operation_results(store):
+    async def scenario():
+        await store.initialize()
+        hot, other = make_stack("hot", habits=("a",)), make_stack("other", habits=())
+        await store.insert_stacks([hot, other])
+        later = BASE_TIME + timedelta(minutes=5)
+        existing = hot["habits"][0]["id"]
+        ops = [
+            HabitOp("push", USER, hot["id"], later, habit={"id": "h1", "name": "one", "order": 1}),
+            HabitOp("push", USER, hot["id"], later, habit={"id": "h2", "name": "two", "order": 2}),
+            HabitOp("pull", USER, hot["id"], later, habit_id=existing),
+            HabitOp("pull", USER, hot["id"], later, habit_id=existing),
+            HabitOp("push", USER, other["id"], later, habit={"id": "h3", "name": "three", "order": 0}),
+            HabitOp("pull", USER, hot["id"], later, habit_id="h1"),
+            HabitOp("push", USER, "missing", later, habit={"id": "h4", "name": "four", "order": 0}),
+            HabitOp("pull", USER, "missing", later, habit_id="h4"),
+        ]
+        results = await store.apply_habit_ops(ops)
+
+        assert "h2" in [habit["id"] for habit in results[1]["habits"]]
+        assert results[2:4] == [True, False]
+        assert [habit["id"] for habit in results[4]["habits"]] == ["h3"]
+        assert results[5:] == [True, None, None]
+
+        stored = await store.get_stack(USER, hot["id"])
+        assert [habit["id"] for habit in stored["habits"]] == ["h2"]
+        assert stored["updated_at"] == later
+        await store.close()
+    run(scenario())
+
+
+def test_apply_habit_ops_reports_what_the_write_found():
+    class Racing:
+        """Database whose habit_stacks collection lets another writer in first"""
+
+        def __init__(self, database, concurrent_write):
+            self._database = database
+            self._concurrent_write = concurrent_write
+
+        def __getattr__(self, name):
+            return getattr(self._database, name)
+
+        def __getitem__(self, name):
+            return self._database[name]
+
+        @property
+        def habit_stacks(self):
+            collection = self._database.habit_stacks
+            racing = self
+
+            class Collection:
+                def __getattr__(self, name):
+                    return getattr(collection, name)
+
+                async def _race(self):
+                    if racing._concurrent_write is not None:
+                        write, racing._concurrent_write = racing._concurrent_write, None
+                        await write
+
+                async def bulk_write(self, *args, **kwargs):
+                    await self._race()
+                    return await collection.bulk_write(*args, **kwargs)
+
+                async def find_one_and_update(self, *args, **kwargs):
+                    await self._race()
+                    return await collection.find_one_and_update(*args, **kwargs)
+
+            return Collection()
+
+    async def scenario():
+        database = _motor_database()
+        store = MotorStackStore(database)
+        await store.initialize()
+        stack = make_stack("hot", habits=("a", "b"))
+        first, second = (habit["id"] for habit in stack["habits"])
+        await store.insert_stacks([stack])
+
+        # Another process removes the first habit just before the batch is written
+        store.db = Racing(database, database.habit_stacks.update_one(
+            {"id": stack["id"]}, {"$pull": {"habits": {"id": first}}}
+        ))
+        later = BASE_TIME + timedelta(minutes=5)
+        results = await store.apply_habit_ops([
+            HabitOp("pull", USER, stack["id"], later, habit_id=first),
+            HabitOp("pull", USER, stack["id"], later, habit_id=second),
+        ])
+        assert results == [False, True]
+        store.db = database
+        assert (await store.get_stack(USER, stack["id"]))["habits"] == []
+        await store.close()
+    run(scenario())
+
+
+def test_list_habits_pages_in_rank_order(store):
+    async def scenario():
+        await store.initialize()
+        doc = make_stack("long", habits=[f"h{i}" for i in range(5)])
+        ranks = ["b", "d", "a", "e", "c"]
+        for habit, rank in zip(doc["habits"], ranks):
+            habit["rank"] = rank
+        await store.insert_stacks([doc])
+
+        first = await store.list_habits(USER, doc["id"], 2)
+        assert [h["rank"] for h in first] == ["a", "b"]
+        last = first[-1]
+        rest = await store.list_habits(USER, doc["id"], 10, after=(last["rank"], last["order"], last["id"]))
+        assert [h["rank"] for h in rest] == ["c", "d", "e"]
+        assert await store.list_habits(USER, "missing", 2) is None
+
+        assert await store.has_habit(USER, doc["id"], doc["habits"][0]["id"]) is True
+        assert await store.has_habit(USER, doc["id"], "missing") is False
+        assert await store.has_habit(USER, "missing", "missing") is None
+        await store.close()
+    run(scenario())
+
+
+def test_habits_collection_serves_and_migrates_embedded_stacks():
+    async def scenario():
+        database = _motor_database()
+        embedded = MotorStackStore(database)
+        await embedded.initialize()
+        legacy = [make_stack(f"legacy{i}", habits=("a", "b", "c")) for i in range(3)]
+        await embedded.insert_stacks(legacy)
+
+        store = HabitCollectionStackStore(database, migration_batch_size=2, migration_pause=0)
+        await store.initialize()
+        now = BASE_TIME + timedelta(hours=1)
+        # Writes work on stacks that still embed their habits
+        await store.push_habit(USER, legacy[0]["id"], {"id": "new", "name": "d", "order": 3}, now)
+        assert await store.pull_habit(USER, legacy[1]["id"], legacy[1]["habits"][0]["id"], now) is True
+        fresh = make_stack("fresh")
+        await store.insert_stacks([fresh])
+
+        assert await store.migrate() == 3
+        assert await database.habit_stacks.count_documents({"habits": {"$exists": True}}) == 0
+        assert await store.migrate() == 0
+
+        assert [h["name"] for h in (await store.get_stack(USER, legacy[0]["id"]))["habits"]] == ["a", "b", "c", "d"]
+        assert [h["name"] for h in (await store.get_stack(USER, legacy[1]["id"]))["habits"]] == ["b", "c"]
+        assert await store.get_stack(USER, legacy[2]["id"]) == legacy[2]
+        assert await store.get_stack(USER, fresh["id"]) == fresh
+        stored = await database.habit_stacks.find_one({"id": legacy[2]["id"]})
+        assert stored["habit_count"] == 3
+
+        assert await store.delete_stacks(USER, [legacy[2]["id"]]) == {legacy[2]["id"]}
+        assert await database.habits.count_documents({"stack_id": legacy[2]["id"]}) == 0
+        await store.close()
+    run(scenario())